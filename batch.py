@@ -0,0 +1,234 @@
+import sys
+import hashlib
+import multiprocessing
+from collections import namedtuple
+from random import Random
+
+from main import Stations, FindTheCatGame
+from events import NullEventSink
+from game_statistics import GamesStatistics
+
+
+GameResult = namedtuple('GameResult', [
+    'game_index', 'seed', 'cats_count', 'cats_found', 'cats_unreachable',
+    'steps_count',
+])
+
+
+def derive_seed(base_seed, game_index):
+    """
+    The seed of a game in a batch depends only on the seed of the batch and
+    the position of the game in it, so that any single game can be re-run on
+    its own, no matter how the batch was split between workers.
+    """
+    digest = hashlib.sha1('%d:%d' % (base_seed, game_index)).digest()
+    return int(digest[:8].encode('hex'), 16)
+
+
+def run_game(stations, pairs_count, seed, iteration_count=100000,
+             events=None):
+    if events is None:
+        events = NullEventSink()
+    return FindTheCatGame.start_and_run(
+        stations, pairs_count, iteration_count=iteration_count,
+        rng=Random(seed), events=events)
+
+
+class BatchResults(object):
+    def __init__(self, games_results):
+        self.games_results = sorted(
+            games_results, key=lambda game_result: game_result.game_index)
+
+    @property
+    def games_count(self):
+        return len(self.games_results)
+
+    @property
+    def cats_count(self):
+        return sum(
+            game_result.cats_count
+            for game_result in self.games_results
+        )
+
+    @property
+    def cats_found(self):
+        return sum(
+            game_result.cats_found
+            for game_result in self.games_results
+        )
+
+    @property
+    def cats_unreachable(self):
+        return sum(
+            game_result.cats_unreachable
+            for game_result in self.games_results
+        )
+
+    @property
+    def mean_cats_found(self):
+        if not self.games_results:
+            return 0.
+        return float(self.cats_found) / self.games_count
+
+    def get_cats_found_histogram(self):
+        histogram = {}
+        for game_result in self.games_results:
+            histogram[game_result.cats_found] = \
+                histogram.get(game_result.cats_found, 0) + 1
+
+        return histogram
+
+
+# The stations of a worker process, set once when the pool starts
+worker_stations = None
+
+
+def initialise_worker(stations):
+    global worker_stations
+    worker_stations = stations
+
+
+def run_worker_game(job):
+    game_index, seed, pairs_count, iteration_count = job
+    game = run_game(worker_stations, pairs_count, seed,
+                    iteration_count=iteration_count)
+
+    return GameResult(game_index, seed, game.cats_count, game.cats_found,
+                      game.cats_unreachable, game.steps_count)
+
+
+def run_worker_statistics(job):
+    first_game_index, games_count, base_seed, pairs_count, \
+        iteration_count = job
+    statistics = GamesStatistics()
+    for game_index in xrange(first_game_index,
+                             first_game_index + games_count):
+        run_game(worker_stations, pairs_count,
+                 derive_seed(base_seed, game_index),
+                 iteration_count=iteration_count,
+                 events=statistics.create_event_sink())
+
+    return statistics
+
+
+class BatchRunner(object):
+    """
+    Runs many independent games over the same stations, on a pool of worker
+    processes.
+
+    Each game gets its own `Random`, seeded with `derive_seed`, so the results
+    are the same whatever the number of workers.
+    """
+    @classmethod
+    def from_json_files(cls, stations_filename, connections_filename,
+                        processes=None):
+        stations = Stations.from_json_files(stations_filename,
+                                            connections_filename)
+
+        return cls(stations, processes=processes)
+
+    def __init__(self, stations, processes=None):
+        self.stations = stations
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+
+    def create_jobs(self, games_count, pairs_count, base_seed,
+                    iteration_count):
+        return [
+            (game_index, derive_seed(base_seed, game_index), pairs_count,
+             iteration_count)
+            for game_index in xrange(games_count)
+        ]
+
+    def run(self, games_count, pairs_count, base_seed=0,
+            iteration_count=100000):
+        jobs = self.create_jobs(games_count, pairs_count, base_seed,
+                                iteration_count)
+        # Compile the graph before the workers fork, so that they all share it
+        self.stations.graph
+        pool = multiprocessing.Pool(
+            self.processes, initializer=initialise_worker,
+            initargs=(self.stations,))
+        try:
+            games_results = pool.map(run_worker_game, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+        return BatchResults(games_results)
+
+    def run_statistics(self, games_count, pairs_count, base_seed=0,
+                       iteration_count=100000, chunk_size=100):
+        """
+        Like `run`, but only keeps the distributions of the results, as
+        `GamesStatistics`, so it takes the same memory for any number of
+        games. Each worker summarises `chunk_size` games at a time, and the
+        summaries are merged in order.
+        """
+        jobs = (
+            (first_game_index,
+             min(chunk_size, games_count - first_game_index), base_seed,
+             pairs_count, iteration_count)
+            for first_game_index in xrange(0, games_count, chunk_size)
+        )
+        self.stations.graph
+        pool = multiprocessing.Pool(
+            self.processes, initializer=initialise_worker,
+            initargs=(self.stations,))
+        statistics = GamesStatistics()
+        try:
+            for chunk_statistics in pool.imap(run_worker_statistics, jobs):
+                statistics.merge(chunk_statistics)
+        finally:
+            pool.close()
+            pool.join()
+
+        return statistics
+
+
+def main():
+    success, arguments = get_arguments()
+    if not success:
+        return
+
+    games_count, pairs_count, base_seed = arguments
+
+    runner = BatchRunner.from_json_files("./tfl_stations.json",
+                                         "./tfl_connections.json")
+    results = runner.run(games_count, pairs_count, base_seed=base_seed)
+
+    print 'Number of games:', results.games_count
+    print 'Total number of cats:', results.cats_count
+    print 'Number of cats found:', results.cats_found
+    print 'Number of cats unreachable:', results.cats_unreachable
+    print 'Average number of cats found per game:', results.mean_cats_found
+
+
+def get_arguments():
+    if len(sys.argv) < 3:
+        print 'Please put the number of games and the number of pairs'
+        return False, []
+
+    if len(sys.argv) > 4:
+        print 'Too many arguments - only put the number of games, the ' \
+            'number of pairs, and optionally a seed'
+        return False, []
+
+    try:
+        games_count, pairs_count = map(int, sys.argv[1:3])
+        base_seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    except ValueError:
+        print 'Please enter numeric values for the number of games, the ' \
+            'number of pairs and the seed'
+        return False, []
+
+    if games_count < 1 or pairs_count < 1:
+        print 'Please enter positive numeric values for the number of ' \
+            'games and the number of pairs'
+        return False, []
+
+    return True, [games_count, pairs_count, base_seed]
+
+if __name__ == '__main__':
+    main()
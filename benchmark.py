@@ -0,0 +1,473 @@
+import sys
+import json
+import math
+import time
+import platform
+import resource
+import multiprocessing
+from random import Random
+
+from main import Stations, StationsGraph, FindTheCatGame
+from events import NullEventSink
+from verification import run_verification
+
+try:
+    import numpy
+    from numpy_game import NumpyFindTheCatGames
+except ImportError:
+    numpy = None
+
+
+def create_grid_graph(size, rng):
+    """
+    A square grid of about `size` stations, each connected to the ones next
+    to it.
+    """
+    side = max(2, int(round(math.sqrt(size))))
+    edges = []
+    for row in xrange(side):
+        for column in xrange(side):
+            index = row * side + column
+            if column + 1 < side:
+                edges.append((index, index + 1))
+            if row + 1 < side:
+                edges.append((index, index + side))
+
+    return StationsGraph.from_edges(range(side * side), edges)
+
+
+def create_random_geometric_graph(size, rng, mean_degree=4.):
+    """
+    Stations at random points in the unit square, connected when they're
+    closer than the radius that gives about `mean_degree` neighbours each.
+    Points are bucketed in cells as big as the radius, so only neighbouring
+    cells are compared.
+    """
+    radius = math.sqrt(mean_degree / (math.pi * size))
+    cells_per_side = max(1, int(1 / radius))
+    points = [(rng.random(), rng.random()) for _ in xrange(size)]
+    cells = {}
+    for index, (x, y) in enumerate(points):
+        cell = (min(int(x * cells_per_side), cells_per_side - 1),
+                min(int(y * cells_per_side), cells_per_side - 1))
+        cells.setdefault(cell, []).append(index)
+
+    edges = []
+    squared_radius = radius * radius
+    for (cell_x, cell_y), indexes in cells.iteritems():
+        for other_cell_x in xrange(cell_x - 1, cell_x + 2):
+            for other_cell_y in xrange(cell_y - 1, cell_y + 2):
+                for index in indexes:
+                    x, y = points[index]
+                    for other_index in cells.get(
+                            (other_cell_x, other_cell_y), ()):
+                        if other_index <= index:
+                            continue
+                        other_x, other_y = points[other_index]
+                        if (x - other_x) ** 2 + (y - other_y) ** 2 \
+                                < squared_radius:
+                            edges.append((index, other_index))
+
+    return StationsGraph.from_edges(range(size), edges)
+
+
+def create_scale_free_graph(size, rng, edges_per_station=2):
+    """
+    Preferential attachment: each new station connects to
+    `edges_per_station` existing ones, picked with a probability
+    proportional to their degree.
+    """
+    edges = []
+    # Every station appears once per edge end it has
+    edges_ends = []
+    for index in xrange(1, size):
+        targets = set()
+        for _ in xrange(min(edges_per_station, index)):
+            if edges_ends:
+                targets.add(rng.choice(edges_ends))
+            else:
+                targets.add(0)
+        for target in targets:
+            edges.append((index, target))
+            edges_ends.extend((index, target))
+
+    return StationsGraph.from_edges(range(size), edges)
+
+
+def create_tree_graph(size, rng):
+    """
+    A random recursive tree: each station connects to one of the stations
+    before it.
+    """
+    edges = [
+        (index, rng.randrange(index))
+        for index in xrange(1, size)
+    ]
+
+    return StationsGraph.from_edges(range(size), edges)
+
+
+def load_tfl_graph():
+    return Stations.from_json_files("./tfl_stations.json",
+                                    "./tfl_connections.json").graph
+
+
+def create_tiled_tfl_graph(size, rng, tfl_graph=None):
+    """
+    Copies of the TfL map, as many as fit in `size` stations (at least one),
+    each connected to the next through a random station.
+    """
+    if tfl_graph is None:
+        tfl_graph = load_tfl_graph()
+    tile_size = tfl_graph.stations_count
+    tiles_count = max(1, size // tile_size)
+
+    edges = []
+    for tile in xrange(tiles_count):
+        tile_offset = tile * tile_size
+        for index in xrange(tile_size):
+            for neighbour_index in tfl_graph.get_neighbours_indexes(index):
+                if neighbour_index > index:
+                    edges.append((tile_offset + index,
+                                  tile_offset + neighbour_index))
+        if tile:
+            edges.append((tile_offset - tile_size + rng.randrange(tile_size),
+                          tile_offset + rng.randrange(tile_size)))
+
+    return StationsGraph.from_edges(range(tiles_count * tile_size), edges)
+
+
+NETWORKS_GENERATORS = {
+    'grid': create_grid_graph,
+    'geometric': create_random_geometric_graph,
+    'scale_free': create_scale_free_graph,
+    'tree': create_tree_graph,
+    'tfl_tiled': create_tiled_tfl_graph,
+}
+
+NETWORKS = sorted(NETWORKS_GENERATORS)
+SIZES = [1000, 10000, 100000]
+PAIRS_COUNTS = [10, 1000, 10000]
+QUICK_SIZES = [1000]
+QUICK_PAIRS_COUNTS = [10, 1000]
+LOCKSTEP_NETWORKS = ['scale_free', 'tfl_tiled']
+LOCKSTEP_SIZES = [1000]
+LOCKSTEP_GAMES_COUNTS = [100, 1000]
+QUICK_LOCKSTEP_GAMES_COUNTS = [100]
+LOCKSTEP_PAIRS_COUNT = 10
+# Games played one after the other with `FindTheCatGame`, to compare with
+LOCKSTEP_REFERENCE_GAMES_COUNT = 20
+VERIFICATION_NETWORK = 'scale_free'
+VERIFICATION_SIZE = 100
+
+
+def run_case(case):
+    """
+    Runs one benchmark case, and measures it. It's meant to run in its own
+    process, so that the peak RSS is the one of this case only.
+    """
+    network, size, pairs_count, seed, iteration_count = case
+    rng = Random(seed)
+
+    start = time.time()
+    graph = NETWORKS_GENERATORS[network](size, rng)
+    stations = Stations.from_graph(graph)
+    generate_seconds = time.time() - start
+
+    # The most the first game on a graph pays to track reachability, once:
+    # all of it when the graph is connected
+    start = time.time()
+    graph.get_components_ids()
+    graph.get_blocks_ids()
+    reachability_setup_seconds = time.time() - start
+
+    start = time.time()
+    game = FindTheCatGame(stations, rng=rng, events=NullEventSink())
+    game.start(pairs_count)
+    startup_seconds = time.time() - start
+
+    moves_count = 0
+    start = time.time()
+    for _ in xrange(iteration_count):
+        game.step()
+        # The agents still in the moving sets are the ones that just moved
+        moves_count += len(game.moving_cats_pairs_ids) \
+            + len(game.moving_owners_pairs_ids)
+        if not game.roaming_pairs_exist:
+            break
+    run_seconds = time.time() - start
+
+    return {
+        'network': network,
+        'size': size,
+        'pairs_count': pairs_count,
+        'seed': seed,
+        'stations_count': graph.stations_count,
+        'connections_count': len(graph.neighbours_indexes) / 2,
+        'generate_seconds': generate_seconds,
+        'reachability_setup_seconds': reachability_setup_seconds,
+        'startup_seconds': startup_seconds,
+        'run_seconds': run_seconds,
+        'steps_count': game.steps_count,
+        'moves_count': moves_count,
+        'steps_per_second': game.steps_count / run_seconds
+        if run_seconds else None,
+        'moves_per_second': moves_count / run_seconds
+        if run_seconds else None,
+        'cats_found': game.cats_found,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def run_lockstep_case(case):
+    """
+    Runs `games_count` games in lockstep with `NumpyFindTheCatGames`, and
+    some games one after the other with `FindTheCatGame`, and measures the
+    games/s of both, and the memory the lockstep games use.
+    """
+    network, size, games_count, seed, iteration_count = case
+    rng = Random(seed)
+    graph = NETWORKS_GENERATORS[network](size, rng)
+    stations = Stations.from_graph(graph)
+
+    start = time.time()
+    games = NumpyFindTheCatGames.start_and_run(
+        stations, games_count, LOCKSTEP_PAIRS_COUNT,
+        iteration_count=iteration_count,
+        random_state=numpy.random.RandomState(seed))
+    run_seconds = time.time() - start
+
+    reference_games_count = min(games_count, LOCKSTEP_REFERENCE_GAMES_COUNT)
+    # Only the first game on a network pays for this, so it's left out
+    graph.get_components_ids()
+    graph.get_blocks_ids()
+    start = time.time()
+    for _ in xrange(reference_games_count):
+        FindTheCatGame.start_and_run(
+            stations, LOCKSTEP_PAIRS_COUNT, iteration_count=iteration_count,
+            rng=rng, events=NullEventSink())
+    reference_run_seconds = time.time() - start
+
+    return {
+        'network': network,
+        'size': size,
+        'games_count': games_count,
+        'pairs_count': LOCKSTEP_PAIRS_COUNT,
+        'seed': seed,
+        'run_seconds': run_seconds,
+        'steps_count': games.steps_count,
+        'games_per_second': games_count / run_seconds
+        if run_seconds else None,
+        'reference_run_seconds': reference_run_seconds,
+        'reference_games_per_second':
+        reference_games_count / reference_run_seconds
+        if reference_run_seconds else None,
+        'owners_visited_bytes': games.owners_visited.nbytes,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def create_cases(networks=None, sizes=None, pairs_counts=None, seed=0,
+                 iteration_count=200):
+    return [
+        (network, size, pairs_count, seed, iteration_count)
+        for network in networks or NETWORKS
+        for size in sizes or SIZES
+        for pairs_count in pairs_counts or PAIRS_COUNTS
+    ]
+
+
+def create_lockstep_cases(games_counts=None, seed=0, iteration_count=200):
+    if numpy is None:
+        return []
+
+    return [
+        (network, size, games_count, seed, iteration_count)
+        for network in LOCKSTEP_NETWORKS
+        for size in LOCKSTEP_SIZES
+        for games_count in games_counts or LOCKSTEP_GAMES_COUNTS
+    ]
+
+
+def run_in_fresh_processes(function, cases):
+    cases_results = []
+    for case in cases:
+        # A fresh process per case
+        pool = multiprocessing.Pool(1)
+        try:
+            cases_results.append(pool.apply(function, (case,)))
+        finally:
+            pool.close()
+            pool.join()
+
+    return cases_results
+
+
+def run_benchmark(cases, lockstep_cases=()):
+    return {
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'cases': run_in_fresh_processes(run_case, cases),
+        'lockstep_cases': run_in_fresh_processes(run_lockstep_case,
+                                                 lockstep_cases),
+    }
+
+
+def get_case_key(case_result):
+    return (case_result['network'], case_result['size'],
+            case_result.get('games_count'), case_result['pairs_count'])
+
+
+# For each measure, whether higher is better, and the duration it was
+# measured over, if it's a timing
+COMPARED_MEASURES = {
+    'steps_per_second': (True, 'run_seconds'),
+    'moves_per_second': (True, 'run_seconds'),
+    'startup_seconds': (False, 'startup_seconds'),
+    'reachability_setup_seconds': (False, 'reachability_setup_seconds'),
+    'peak_rss_kb': (False, None),
+}
+LOCKSTEP_COMPARED_MEASURES = {
+    'games_per_second': (True, 'run_seconds'),
+    'owners_visited_bytes': (False, None),
+    'peak_rss_kb': (False, None),
+}
+
+
+def compare_with_baseline(results, baseline, tolerance=0.2,
+                          min_seconds=0.05):
+    """
+    The measures that got worse than in the baseline by more than
+    `tolerance` (a fraction), for the cases that are in both. Timings over
+    less than `min_seconds` are too noisy to compare, and are skipped.
+    """
+    regressions = []
+    for cases_name, compared_measures in [
+            ('cases', COMPARED_MEASURES),
+            ('lockstep_cases', LOCKSTEP_COMPARED_MEASURES)]:
+        regressions.extend(compare_cases(
+            results.get(cases_name, []), baseline.get(cases_name, []),
+            compared_measures, tolerance, min_seconds))
+
+    return regressions
+
+
+def compare_cases(cases_results, baseline_cases_results, compared_measures,
+                  tolerance, min_seconds):
+    baseline_cases = {
+        get_case_key(case_result): case_result
+        for case_result in baseline_cases_results
+    }
+    regressions = []
+    for case_result in cases_results:
+        baseline_case = baseline_cases.get(get_case_key(case_result))
+        if baseline_case is None:
+            continue
+        for measure, (higher_is_better, seconds_measure) in sorted(
+                compared_measures.iteritems()):
+            value = case_result.get(measure)
+            baseline_value = baseline_case.get(measure)
+            if not value or not baseline_value:
+                continue
+            if seconds_measure is not None and min(
+                    case_result[seconds_measure],
+                    baseline_case[seconds_measure]) < min_seconds:
+                continue
+            change = float(value - baseline_value) / baseline_value
+            if higher_is_better:
+                change = -change
+            if change > tolerance:
+                regressions.append({
+                    'network': case_result['network'],
+                    'size': case_result['size'],
+                    'games_count': case_result.get('games_count', 1),
+                    'pairs_count': case_result['pairs_count'],
+                    'measure': measure,
+                    'value': value,
+                    'baseline_value': baseline_value,
+                })
+
+    return regressions
+
+
+def main():
+    success, arguments = get_arguments()
+    if not success:
+        return
+
+    results_filename, baseline_filename, quick, verify = arguments
+
+    if quick:
+        cases = create_cases(sizes=QUICK_SIZES,
+                             pairs_counts=QUICK_PAIRS_COUNTS)
+        lockstep_cases = create_lockstep_cases(
+            games_counts=QUICK_LOCKSTEP_GAMES_COUNTS)
+    else:
+        cases = create_cases()
+        lockstep_cases = create_lockstep_cases()
+    results = run_benchmark(cases, lockstep_cases)
+    with open(results_filename, 'w') as f:
+        json.dump(results, f, sort_keys=True, indent=2)
+
+    for case_result in results['cases']:
+        print '%(network)s %(size)s stations, %(pairs_count)s pairs: ' \
+            '%(steps_per_second).1f steps/s, %(moves_per_second).0f ' \
+            'moves/s, %(reachability_setup_seconds).3fs reachability ' \
+            'setup, %(startup_seconds).3fs startup, ' \
+            '%(peak_rss_kb)s kB peak RSS' % case_result
+    for case_result in results['lockstep_cases']:
+        print '%(network)s %(size)s stations, %(games_count)s lockstep ' \
+            'games of %(pairs_count)s pairs: %(games_per_second).1f ' \
+            'games/s (%(reference_games_per_second).1f games/s one after ' \
+            'the other), %(owners_visited_bytes)s bytes of visited ' \
+            'stations, %(peak_rss_kb)s kB peak RSS' % case_result
+
+    if baseline_filename is not None:
+        with open(baseline_filename, 'rb') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline)
+        for regression in regressions:
+            print 'Regression in %(network)s %(size)s stations, ' \
+                '%(games_count)s x %(pairs_count)s pairs: %(measure)s is ' \
+                '%(value)s, was %(baseline_value)s' % regression
+    else:
+        regressions = []
+
+    if verify:
+        graph = NETWORKS_GENERATORS[VERIFICATION_NETWORK](VERIFICATION_SIZE,
+                                                          Random(0))
+        failures = run_verification(Stations.from_graph(graph), quick=quick)
+        for failure in failures:
+            print 'Verification failed: %s' % failure
+    else:
+        failures = []
+
+    if regressions or failures:
+        sys.exit(1)
+
+
+def get_arguments():
+    arguments = sys.argv[1:]
+    quick = '--quick' in arguments
+    if quick:
+        arguments.remove('--quick')
+    verify = '--verify' in arguments
+    if verify:
+        arguments.remove('--verify')
+
+    if len(arguments) < 1:
+        print 'Please put the file to write the results to'
+        return False, []
+
+    if len(arguments) > 2:
+        print 'Too many arguments - only put the results file, and ' \
+            'optionally a baseline results file to compare with'
+        return False, []
+
+    results_filename = arguments[0]
+    baseline_filename = arguments[1] if len(arguments) > 1 else None
+
+    return True, [results_filename, baseline_filename, quick, verify]
+
+if __name__ == '__main__':
+    main()
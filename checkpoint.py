@@ -0,0 +1,255 @@
+import os
+import struct
+import cPickle
+from array import array
+from random import Random
+
+from main import FindTheCatGame
+
+try:
+    from random_streams import RandomStream
+except ImportError:
+    RandomStream = None
+
+
+class CheckpointError(Exception):
+    pass
+
+
+def get_rng_type(rng):
+    """
+    What `resume_game` creates to carry on drawing where the game was, since
+    the states of the generators aren't interchangeable.
+    """
+    if RandomStream is not None and isinstance(rng, RandomStream):
+        return 'random_stream'
+    if isinstance(rng, Random):
+        return 'random'
+    raise CheckpointError("Unsupported random generator %r" % rng)
+
+
+def create_rng(rng_type):
+    if rng_type == 'random':
+        return Random()
+    if rng_type == 'random_stream':
+        if RandomStream is None:
+            raise CheckpointError(
+                "The game used a RandomStream, which needs NumPy")
+        return RandomStream()
+    raise CheckpointError("Unknown random generator %r" % rng_type)
+
+
+class Checkpointer(object):
+    """
+    Saves the state of a game every `interval` steps, to resume it later
+    with `resume_game`.
+
+    The file is a sequence of length-prefixed records. The first one has the
+    whole state of the game, and every other one only what changed since the
+    one before: pairs that are done don't move anymore, so only the ones that
+    were still roaming at the previous checkpoint are written again, along
+    with the stations closed since then. Records are appended and flushed,
+    so an interrupted write only loses the last checkpoint.
+    """
+    RECORD_LENGTH = struct.Struct('<Q')
+
+    def __init__(self, filename, interval=5000):
+        self.filename = filename
+        self.interval = interval
+        self.previous_state = None
+
+    def step_completed(self, game):
+        if game.steps_count % self.interval == 0:
+            self.save(game)
+
+    def save(self, game):
+        state = game.get_state()
+        state['rng_type'] = get_rng_type(game.rng)
+        if self.previous_state is None:
+            record = self.create_record(state, self.get_empty_state(state))
+            mode = 'wb'
+        else:
+            record = self.create_record(state, self.previous_state)
+            mode = 'ab'
+
+        payload = cPickle.dumps(record, cPickle.HIGHEST_PROTOCOL)
+        with open(self.filename, mode) as f:
+            f.write(self.RECORD_LENGTH.pack(len(payload)))
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.previous_state = {
+            'roaming_pairs_ids': set(state['roaming_pairs_ids']),
+            'found_pairs_ids': set(state['found_pairs_ids']),
+            'unreachable_pairs_ids': set(state['unreachable_pairs_ids']),
+            'closed_indexes': set(state['closed_indexes']),
+            'components_ids': dict(state.get('components_ids', {})),
+        }
+
+    def get_empty_state(self, state):
+        return {
+            'roaming_pairs_ids': set(xrange(state['pairs_count'])),
+            'found_pairs_ids': set(),
+            'unreachable_pairs_ids': set(),
+            'closed_indexes': set(),
+            'components_ids': {},
+        }
+
+    def create_record(self, state, previous_state):
+        """
+        The pairs written are the ones that were roaming at the previous
+        checkpoint: the others haven't changed since.
+        """
+        pairs_ids = array('l', sorted(previous_state['roaming_pairs_ids']))
+        cats_indexes = state['cats_indexes']
+        owners_indexes = state['owners_indexes']
+        owners_visited = state['owners_visited']
+        owners_visited_first_bytes = state['owners_visited_first_bytes']
+
+        record = {
+            'graph_hash': state['graph_hash'],
+            'track_reachability': state['track_reachability'],
+            'pairs_count': state['pairs_count'],
+            'steps_count': state['steps_count'],
+            'rng_type': state['rng_type'],
+            'rng_state': state['rng_state'],
+            'pairs_ids': pairs_ids.tostring(),
+            'cats_indexes': array('l', [
+                cats_indexes[pair_id]
+                for pair_id in pairs_ids
+            ]).tostring(),
+            'owners_indexes': array('l', [
+                owners_indexes[pair_id]
+                for pair_id in pairs_ids
+            ]).tostring(),
+            'owners_visited': [
+                str(owners_visited[pair_id])
+                for pair_id in pairs_ids
+            ],
+            'owners_visited_first_bytes': array('l', [
+                owners_visited_first_bytes[pair_id]
+                for pair_id in pairs_ids
+            ]).tostring(),
+            'stopped_roaming_pairs_ids': sorted(
+                previous_state['roaming_pairs_ids']
+                - state['roaming_pairs_ids']),
+            'found_pairs_ids': sorted(
+                state['found_pairs_ids'] - previous_state['found_pairs_ids']),
+            'unreachable_pairs_ids': sorted(
+                state['unreachable_pairs_ids']
+                - previous_state['unreachable_pairs_ids']),
+            'closed_indexes': sorted(
+                state['closed_indexes'] - previous_state['closed_indexes']),
+            'dormant_cats_pairs_ids': sorted(state['dormant_cats_pairs_ids']),
+            'dormant_owners_pairs_ids': sorted(
+                state['dormant_owners_pairs_ids']),
+            'dirty_indexes': sorted(state['dirty_indexes']),
+            'reachability_check_pending': state['reachability_check_pending'],
+        }
+        if state['track_reachability']:
+            previous_components_ids = previous_state['components_ids']
+            record['components_ids'] = [
+                (index, component_id)
+                for index, component_id in state['components_ids'].iteritems()
+                if previous_components_ids.get(index) != component_id
+            ]
+            record['next_component_id'] = state['next_component_id']
+
+        return record
+
+
+def iterate_records(filename):
+    """
+    The records in a checkpoint file, leaving out a last one that was only
+    partly written.
+    """
+    record_length_size = Checkpointer.RECORD_LENGTH.size
+    with open(filename, 'rb') as f:
+        while True:
+            header = f.read(record_length_size)
+            if len(header) < record_length_size:
+                return
+            length, = Checkpointer.RECORD_LENGTH.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            yield cPickle.loads(payload)
+
+
+def load_state(filename):
+    """
+    The state of the game at the last checkpoint in the file, as
+    `FindTheCatGame.set_state` takes it.
+    """
+    state = None
+    for record in iterate_records(filename):
+        if state is None:
+            pairs_count = record['pairs_count']
+            state = {
+                'cats_indexes': array('l', [-1]) * pairs_count,
+                'owners_indexes': array('l', [-1]) * pairs_count,
+                'owners_visited': [''] * pairs_count,
+                'owners_visited_first_bytes': array('l', [0]) * pairs_count,
+                'roaming_pairs_ids': set(xrange(pairs_count)),
+                'found_pairs_ids': set(),
+                'unreachable_pairs_ids': set(),
+                'closed_indexes': set(),
+                'components_ids': {},
+            }
+        apply_record(state, record)
+
+    if state is None:
+        raise CheckpointError("No checkpoint in %s" % filename)
+
+    return state
+
+
+def apply_record(state, record):
+    for key in ('graph_hash', 'track_reachability', 'pairs_count',
+                'steps_count', 'rng_type', 'rng_state',
+                'reachability_check_pending',
+                'dormant_cats_pairs_ids', 'dormant_owners_pairs_ids',
+                'dirty_indexes'):
+        state[key] = record[key]
+
+    pairs_ids = array('l')
+    pairs_ids.fromstring(record['pairs_ids'])
+    for key in ('cats_indexes', 'owners_indexes',
+                'owners_visited_first_bytes'):
+        values = array('l')
+        values.fromstring(record[key])
+        for pair_id, value in zip(pairs_ids, values):
+            state[key][pair_id] = value
+    for pair_id, visited in zip(pairs_ids, record['owners_visited']):
+        state['owners_visited'][pair_id] = visited
+
+    state['roaming_pairs_ids'].difference_update(
+        record['stopped_roaming_pairs_ids'])
+    state['found_pairs_ids'].update(record['found_pairs_ids'])
+    state['unreachable_pairs_ids'].update(record['unreachable_pairs_ids'])
+    state['closed_indexes'].update(record['closed_indexes'])
+    if record['track_reachability']:
+        state['components_ids'].update(record['components_ids'])
+        state['next_component_id'] = record['next_component_id']
+
+
+def resume_game(stations, filename, rng=None, events=None):
+    """
+    A game in the state of the last checkpoint in the file, drawing from a
+    new generator of the type the game used, unless `rng` is given.
+    """
+    state = load_state(filename)
+    if rng is None:
+        rng = create_rng(state['rng_type'])
+    elif get_rng_type(rng) != state['rng_type']:
+        raise CheckpointError("The game used a generator of type %r" %
+                              state['rng_type'])
+    game = FindTheCatGame(stations, rng=rng, events=events,
+                          track_reachability=state['track_reachability'])
+    try:
+        game.set_state(state)
+    except ValueError as e:
+        raise CheckpointError(str(e))
+
+    return game
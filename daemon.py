@@ -0,0 +1,308 @@
+import os
+import sys
+import json
+import Queue
+import socket
+import threading
+import multiprocessing
+import SocketServer
+from random import Random
+
+from main import Stations, FindTheCatGame
+from events import NullEventSink
+
+
+MAX_PAIRS_COUNT = 10 ** 6
+MAX_ITERATION_COUNT = 10 ** 7
+
+
+def get_count(job, field, maximum, default=None):
+    count = job[field] if default is None else job.get(field, default)
+    if isinstance(count, bool) or not isinstance(count, (int, long)):
+        raise ValueError("%s must be an integer" % field)
+    if not 1 <= count <= maximum:
+        raise ValueError("%s must be between 1 and %s" % (field, maximum))
+
+    return count
+
+
+def run_job(stations, job):
+    """
+    Runs the game a job asks for, and answers with its result, or with what
+    was wrong with the job. The id of the job, if any, is sent back as is.
+    """
+    response = {'id': job.get('id')}
+    try:
+        stations_pairs_ids = job.get('stations_pairs_ids')
+        if stations_pairs_ids is None:
+            pairs_count = get_count(job, 'pairs_count', MAX_PAIRS_COUNT)
+        else:
+            pairs_count = len(stations_pairs_ids)
+            if pairs_count > MAX_PAIRS_COUNT:
+                raise ValueError("Too many stations pairs - at most %s" %
+                                 MAX_PAIRS_COUNT)
+        iteration_count = get_count(job, 'iteration_count',
+                                    MAX_ITERATION_COUNT, default=100000)
+
+        game = FindTheCatGame(stations, rng=Random(job.get('seed')),
+                              events=NullEventSink())
+        game.start(pairs_count, stations_pairs_ids=stations_pairs_ids)
+        game.run(iteration_count=iteration_count)
+        response['result'] = game.get_result()
+    except KeyError as e:
+        response['error'] = 'Unknown station or missing field: %s' % e
+    except (ValueError, TypeError) as e:
+        response['error'] = str(e)
+
+    return response
+
+
+def answer_job(stations, job):
+    """
+    Like `run_job`, but whatever goes wrong is answered as an error too, so
+    that every job gets exactly one response, and a job can't take the
+    daemon down.
+    """
+    try:
+        return run_job(stations, job)
+    except Exception as e:
+        return {'id': job.get('id'), 'error': 'Job failed: %r' % e}
+
+
+# The stations of a worker process, set once when the pool starts
+worker_stations = None
+
+
+def initialise_worker(stations):
+    global worker_stations
+    worker_stations = stations
+
+
+def run_worker_job(job):
+    return answer_job(worker_stations, job)
+
+
+class SimulationService(object):
+    """
+    Runs jobs on stations loaded once, on a pool of worker processes, or in
+    the calling thread if `processes` is 0, which has the least overhead for
+    jobs that only take a few milliseconds.
+    """
+    @classmethod
+    def from_json_files(cls, stations_filename, connections_filename,
+                        snapshot_filename=None, processes=None):
+        stations = Stations.from_json_files(
+            stations_filename, connections_filename,
+            snapshot_filename=snapshot_filename)
+
+        return cls(stations, processes=processes)
+
+    def __init__(self, stations, processes=None):
+        self.stations = stations
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        # Compile the graph before the workers fork, so that they all share it
+        self.stations.graph
+        self.pool = None
+        if processes:
+            self.pool = multiprocessing.Pool(
+                processes, initializer=initialise_worker,
+                initargs=(stations,))
+
+    def submit(self, job, callback):
+        """
+        Runs the job, and calls `callback` with the response once it's done,
+        from another thread when there's a pool.
+        """
+        if self.pool is None:
+            callback(answer_job(self.stations, job))
+        else:
+            self.pool.apply_async(run_worker_job, (job,), callback=callback)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+def read_jobs(service, input_stream, responses):
+    """
+    Submits the jobs of each line of the stream, with `responses.put` as
+    their callback, and then puts how many jobs there were, an integer
+    unlike the responses.
+    """
+    jobs_count = 0
+    try:
+        for line in iter(input_stream.readline, ''):
+            line = line.strip()
+            if not line:
+                continue
+            jobs_count += 1
+            try:
+                job = json.loads(line)
+                if not isinstance(job, dict):
+                    raise ValueError("Jobs must be JSON objects")
+            except ValueError as e:
+                responses.put({'id': None, 'error': 'Invalid job: %s' % e})
+                continue
+            service.submit(job, responses.put)
+    except (socket.error, IOError):
+        # The client went away, the jobs it sent are still answered
+        pass
+    finally:
+        responses.put(jobs_count)
+
+
+def serve_stream(service, input_stream, output_stream):
+    """
+    Reads one JSON job per line, and writes one JSON response per line, in
+    the order the jobs finish in. It returns once the input ends and every
+    job has been answered.
+
+    Only the calling thread writes, the jobs are read from another one: the
+    pool's callbacks just queue the responses, so that a client going away
+    can't break the pool.
+    """
+    responses = Queue.Queue()
+    reader = threading.Thread(target=read_jobs,
+                              args=(service, input_stream, responses))
+    reader.daemon = True
+    reader.start()
+
+    jobs_count = None
+    answered_count = 0
+    connected = True
+    while jobs_count is None or answered_count < jobs_count:
+        response = responses.get()
+        if isinstance(response, int):
+            jobs_count = response
+            continue
+        answered_count += 1
+        if not connected:
+            continue
+        try:
+            output_stream.write(json.dumps(response, sort_keys=True,
+                                           separators=(',', ':')) + '\n')
+            if responses.empty():
+                output_stream.flush()
+        except (socket.error, IOError):
+            # The responses to a client that went away are dropped, but
+            # still waited for
+            connected = False
+    reader.join()
+
+
+class JobsRequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        serve_stream(self.server.service, self.rfile, self.wfile)
+
+    def finish(self):
+        # Flushing what's left for a client that went away fails too
+        try:
+            SocketServer.StreamRequestHandler.finish(self)
+        except socket.error:
+            pass
+
+
+class JobsServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """
+    Serves jobs on a Unix socket, one thread per connection, all of them
+    sharing the same service.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, service):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.service = service
+        SocketServer.UnixStreamServer.__init__(self, socket_path,
+                                               JobsRequestHandler)
+
+
+class SimulationClient(object):
+    """
+    Sends jobs to a `JobsServer`. `run_many` sends jobs without waiting for
+    the previous ones to be answered, which is what makes small jobs cheap.
+    """
+    def __init__(self, socket_path):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(socket_path)
+        self.input_stream = self.socket.makefile('rb')
+        self.output_stream = self.socket.makefile('wb')
+        self.next_id = 0
+
+    def run(self, **job):
+        return self.run_many([job])[0]
+
+    def run_many(self, jobs):
+        """
+        The responses to the jobs, in the same order as the jobs.
+        """
+        jobs = list(jobs)
+        first_id = self.next_id
+        self.next_id += len(jobs)
+
+        def send():
+            for job_id, job in enumerate(jobs, first_id):
+                job = dict(job, id=job_id)
+                self.output_stream.write(json.dumps(job) + '\n')
+            self.output_stream.flush()
+
+        # Sent from another thread, so that responses are read while jobs
+        # are still being sent, and neither side blocks on a full buffer
+        sender = threading.Thread(target=send)
+        sender.start()
+        responses = [None] * len(jobs)
+        for _ in xrange(len(jobs)):
+            response = json.loads(self.input_stream.readline())
+            responses[response['id'] - first_id] = response
+        sender.join()
+
+        return responses
+
+    def close(self):
+        self.output_stream.close()
+        self.input_stream.close()
+        self.socket.close()
+
+
+def main():
+    success, arguments = get_arguments()
+    if not success:
+        return
+
+    socket_path, = arguments
+
+    service = SimulationService.from_json_files(
+        "./tfl_stations.json", "./tfl_connections.json",
+        snapshot_filename="./tfl.snapshot")
+    try:
+        if socket_path is None:
+            serve_stream(service, sys.stdin, sys.stdout)
+        else:
+            server = JobsServer(socket_path, service)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.server_close()
+                os.remove(socket_path)
+    finally:
+        service.close()
+
+
+def get_arguments():
+    if len(sys.argv) > 2:
+        print 'Too many arguments - only put the socket to listen on, or ' \
+            'nothing to read jobs from the standard input'
+        return False, []
+
+    socket_path = sys.argv[1] if len(sys.argv) > 1 else None
+
+    return True, [socket_path]
+
+if __name__ == '__main__':
+    main()
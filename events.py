@@ -0,0 +1,173 @@
+import sys
+import json
+import struct
+
+
+class EventSink(object):
+    """
+    Receives what happens during a game, instead of the game printing it.
+
+    Games skip building the per-pair events altogether when `enabled` is
+    false, so a sink that doesn't care about them costs close to nothing.
+    """
+    enabled = True
+
+    def pair_found(self, step, pair_id, station_id, station_name):
+        pass
+
+    def station_closed(self, step, station_id, station_name):
+        pass
+
+    def step_completed(self, step, roaming_pairs_count):
+        pass
+
+    def run_finished(self, steps_count, cats_count, cats_found,
+                     cats_unreachable=0):
+        pass
+
+    def flush(self):
+        pass
+
+
+class NullEventSink(EventSink):
+    enabled = False
+
+
+class BufferedEventSink(EventSink):
+    """
+    Collects chunks of output, and only writes them to the stream when
+    enough of them have gathered, or when the run finishes.
+    """
+    def __init__(self, stream=None, buffer_size=1000):
+        if stream is None:
+            stream = sys.stdout
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.buffer = []
+
+    def write(self, chunk):
+        self.buffer.append(chunk)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.stream.write(''.join(self.buffer))
+            self.buffer = []
+        self.stream.flush()
+
+    def run_finished(self, steps_count, cats_count, cats_found,
+                     cats_unreachable=0):
+        self.flush()
+
+
+class TextEventSink(BufferedEventSink):
+    """
+    The human-readable output of the game.
+    """
+    def write_line(self, line):
+        if isinstance(line, unicode):
+            line = line.encode('utf-8')
+        self.write(line + '\n')
+
+    def pair_found(self, step, pair_id, station_id, station_name):
+        self.write_line(u'Owner %s found cat %s - %s is now closed' % (
+            pair_id, pair_id, station_name))
+
+    def run_finished(self, steps_count, cats_count, cats_found,
+                     cats_unreachable=0):
+        self.write_line('Total number of cats: %s' % cats_count)
+        self.write_line('Number of cats found: %s' % cats_found)
+        self.write_line('Number of cats unreachable: %s' % cats_unreachable)
+        self.write_line('Number of cats still roaming: %s' % (
+            cats_count - cats_found - cats_unreachable))
+        super(TextEventSink, self).run_finished(
+            steps_count, cats_count, cats_found, cats_unreachable)
+
+
+class JsonLinesEventSink(BufferedEventSink):
+    """
+    One JSON object per event and per line, for later analysis.
+    """
+    def write_event(self, event, **data):
+        data['event'] = event
+        self.write(json.dumps(data, sort_keys=True, separators=(',', ':'))
+                   + '\n')
+
+    def pair_found(self, step, pair_id, station_id, station_name):
+        self.write_event('pair_found', step=step, pair_id=pair_id,
+                         station_id=station_id)
+
+    def station_closed(self, step, station_id, station_name):
+        self.write_event('station_closed', step=step, station_id=station_id)
+
+    def step_completed(self, step, roaming_pairs_count):
+        self.write_event('step_completed', step=step,
+                         roaming_pairs_count=roaming_pairs_count)
+
+    def run_finished(self, steps_count, cats_count, cats_found,
+                     cats_unreachable=0):
+        self.write_event('run_finished', steps_count=steps_count,
+                         cats_count=cats_count, cats_found=cats_found,
+                         cats_unreachable=cats_unreachable)
+        super(JsonLinesEventSink, self).run_finished(
+            steps_count, cats_count, cats_found, cats_unreachable)
+
+
+class BinaryEventSink(BufferedEventSink):
+    """
+    Fixed-size little-endian records: an event code, and four integers,
+    whose meaning depends on the event. Use `read_binary_events` to read them
+    back.
+    """
+    RECORD = struct.Struct('<Bqqqq')
+
+    PAIR_FOUND = 1
+    STATION_CLOSED = 2
+    STEP_COMPLETED = 3
+    RUN_FINISHED = 4
+
+    EVENTS_NAMES_AND_FIELDS = {
+        PAIR_FOUND: ('pair_found', ('step', 'pair_id', 'station_id')),
+        STATION_CLOSED: ('station_closed', ('step', 'station_id')),
+        STEP_COMPLETED: ('step_completed', ('step', 'roaming_pairs_count')),
+        RUN_FINISHED: ('run_finished',
+                       ('steps_count', 'cats_count', 'cats_found',
+                        'cats_unreachable')),
+    }
+
+    def write_record(self, code, first=0, second=0, third=0, fourth=0):
+        self.write(self.RECORD.pack(code, first, second, third, fourth))
+
+    def pair_found(self, step, pair_id, station_id, station_name):
+        self.write_record(self.PAIR_FOUND, step, pair_id, station_id)
+
+    def station_closed(self, step, station_id, station_name):
+        self.write_record(self.STATION_CLOSED, step, station_id)
+
+    def step_completed(self, step, roaming_pairs_count):
+        self.write_record(self.STEP_COMPLETED, step, roaming_pairs_count)
+
+    def run_finished(self, steps_count, cats_count, cats_found,
+                     cats_unreachable=0):
+        self.write_record(self.RUN_FINISHED, steps_count, cats_count,
+                          cats_found, cats_unreachable)
+        super(BinaryEventSink, self).run_finished(
+            steps_count, cats_count, cats_found, cats_unreachable)
+
+
+def read_binary_events(stream):
+    """
+    Yields the events written by a `BinaryEventSink`, as dicts like the ones
+    of `JsonLinesEventSink`.
+    """
+    record_size = BinaryEventSink.RECORD.size
+    while True:
+        record = stream.read(record_size)
+        if len(record) < record_size:
+            break
+        values = BinaryEventSink.RECORD.unpack(record)
+        event, fields = BinaryEventSink.EVENTS_NAMES_AND_FIELDS[values[0]]
+        data = dict(zip(fields, values[1:]))
+        data['event'] = event
+        yield data
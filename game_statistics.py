@@ -0,0 +1,268 @@
+import math
+
+from events import EventSink
+
+
+class Moments(object):
+    """
+    Count, mean, variance, minimum and maximum of a stream of values, with
+    Welford's update, and Chan's formula to merge two of them.
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        self.squared_deviations_sum = 0.
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.squared_deviations_sum += delta * (value - self.mean)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if not other.count:
+            return
+        if not self.count:
+            self.count = other.count
+            self.mean = other.mean
+            self.squared_deviations_sum = other.squared_deviations_sum
+            self.min, self.max = other.min, other.max
+            return
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.squared_deviations_sum += other.squared_deviations_sum \
+            + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def variance(self):
+        if self.count < 2:
+            return 0.
+        return self.squared_deviations_sum / (self.count - 1)
+
+    @property
+    def standard_deviation(self):
+        return math.sqrt(self.variance)
+
+    def get_summary(self):
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'variance': self.variance,
+            'min': self.min,
+            'max': self.max,
+        }
+
+
+class Histogram(object):
+    """
+    Exact counts of integer values, for values that only span a small range,
+    like the number of cats found in a game.
+    """
+    def __init__(self):
+        self.counts = {}
+
+    def add(self, value, count=1):
+        self.counts[value] = self.counts.get(value, 0) + count
+
+    def merge(self, other):
+        for value, count in other.counts.iteritems():
+            self.add(value, count)
+
+    @property
+    def total(self):
+        return sum(self.counts.itervalues())
+
+    def get_summary(self):
+        return sorted(self.counts.iteritems())
+
+
+class QuantileSketch(object):
+    """
+    Quantiles of a stream of non-negative values, within a relative error of
+    `relative_accuracy`.
+
+    Values are counted in buckets whose bounds grow geometrically, so the
+    number of buckets only grows with the logarithm of the largest value,
+    and two sketches merge by adding their counts.
+    """
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zeros_count = 0
+        self.count = 0
+
+    def add(self, value, count=1):
+        if value < 0:
+            raise ValueError("Sketches only take non-negative values")
+        self.count += count
+        if value == 0:
+            self.zeros_count += count
+            return
+        bucket = int(math.ceil(math.log(value) / self.log_gamma))
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Can't merge sketches with different accuracies")
+        self.count += other.count
+        self.zeros_count += other.zeros_count
+        for bucket, count in other.buckets.iteritems():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+
+    def get_quantile(self, quantile):
+        if not self.count:
+            return None
+
+        rank = quantile * (self.count - 1)
+        seen_count = self.zeros_count
+        if rank < seen_count:
+            return 0
+        for bucket in sorted(self.buckets):
+            seen_count += self.buckets[bucket]
+            if rank < seen_count:
+                # The middle of the bucket, in relative terms
+                return 2 * self.gamma ** bucket / (self.gamma + 1)
+
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def get_summary(self, quantiles=(0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99)):
+        return {
+            str(quantile): self.get_quantile(quantile)
+            for quantile in quantiles
+        }
+
+
+class StationsClosures(object):
+    """
+    How many times each station closed, and its mean rank in the order
+    stations closed in, over all games.
+    """
+    def __init__(self):
+        self.closures_counts = {}
+        self.ranks_sums = {}
+
+    def add(self, station_id, rank):
+        self.closures_counts[station_id] = \
+            self.closures_counts.get(station_id, 0) + 1
+        self.ranks_sums[station_id] = self.ranks_sums.get(station_id, 0) + rank
+
+    def merge(self, other):
+        for station_id, count in other.closures_counts.iteritems():
+            self.closures_counts[station_id] = \
+                self.closures_counts.get(station_id, 0) + count
+            self.ranks_sums[station_id] = self.ranks_sums.get(station_id, 0) \
+                + other.ranks_sums[station_id]
+
+    def get_mean_rank(self, station_id):
+        count = self.closures_counts.get(station_id)
+        if not count:
+            return None
+        return float(self.ranks_sums[station_id]) / count
+
+    def get_summary(self, games_count):
+        return {
+            str(station_id): {
+                'frequency': float(count) / games_count,
+                'mean_rank': self.get_mean_rank(station_id),
+            }
+            for station_id, count in self.closures_counts.iteritems()
+        }
+
+
+class GamesStatistics(object):
+    """
+    Distributions over many games: the step each pair was found at, the
+    number of cats found per game, the number of steps games took, and which
+    stations closed, and when.
+
+    It only keeps summaries, so its size doesn't depend on the number of
+    games, and statistics gathered by different workers merge together.
+    """
+    def __init__(self, relative_accuracy=0.01):
+        self.games_count = 0
+        self.found_steps = QuantileSketch(relative_accuracy)
+        self.found_steps_moments = Moments()
+        self.cats_found = Histogram()
+        self.cats_found_moments = Moments()
+        self.steps_counts = QuantileSketch(relative_accuracy)
+        self.steps_counts_moments = Moments()
+        self.stations_closures = StationsClosures()
+
+    def create_event_sink(self):
+        """
+        An event sink to pass to a single game, that adds what happens in it
+        to these statistics.
+        """
+        return StatisticsEventSink(self)
+
+    def add_found_step(self, step):
+        self.found_steps.add(step)
+        self.found_steps_moments.add(step)
+
+    def add_game(self, steps_count, cats_found):
+        self.games_count += 1
+        self.cats_found.add(cats_found)
+        self.cats_found_moments.add(cats_found)
+        self.steps_counts.add(steps_count)
+        self.steps_counts_moments.add(steps_count)
+
+    def merge(self, other):
+        self.games_count += other.games_count
+        self.found_steps.merge(other.found_steps)
+        self.found_steps_moments.merge(other.found_steps_moments)
+        self.cats_found.merge(other.cats_found)
+        self.cats_found_moments.merge(other.cats_found_moments)
+        self.steps_counts.merge(other.steps_counts)
+        self.steps_counts_moments.merge(other.steps_counts_moments)
+        self.stations_closures.merge(other.stations_closures)
+
+        return self
+
+    def get_summary(self):
+        return {
+            'games_count': self.games_count,
+            'found_steps': {
+                'moments': self.found_steps_moments.get_summary(),
+                'quantiles': self.found_steps.get_summary(),
+            },
+            'cats_found': {
+                'moments': self.cats_found_moments.get_summary(),
+                'histogram': self.cats_found.get_summary(),
+            },
+            'steps_counts': {
+                'moments': self.steps_counts_moments.get_summary(),
+                'quantiles': self.steps_counts.get_summary(),
+            },
+            'stations_closures': self.stations_closures.get_summary(
+                self.games_count),
+        }
+
+
+class StatisticsEventSink(EventSink):
+    def __init__(self, statistics):
+        self.statistics = statistics
+        self.closed_count = 0
+
+    def pair_found(self, step, pair_id, station_id, station_name):
+        self.statistics.add_found_step(step)
+
+    def station_closed(self, step, station_id, station_name):
+        self.statistics.stations_closures.add(station_id, self.closed_count)
+        self.closed_count += 1
+
+    def run_finished(self, steps_count, cats_count, cats_found,
+                     cats_unreachable=0):
+        self.statistics.add_game(steps_count, cats_found)
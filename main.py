@@ -1,18 +1,220 @@
+import os
 import sys
 import json
-from random import sample, choice
+import mmap
+import struct
+import hashlib
+import binascii
+from array import array
+from itertools import izip
+from collections import deque
+from random import Random
+
+from events import TextEventSink
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def iterate_json_array(f, chunk_size=64 * 1024):
+    """
+    Yields the items of the JSON array in file `f` one at a time, reading it
+    in chunks, so that the whole array is never in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, at_end = '', 0, False
+    expecting = '['
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n':
+            position += 1
+        if position == len(buffer) \
+                or (expecting == 'item' and buffer[position] not in ',]'):
+            item = None
+            if position < len(buffer):
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except ValueError:
+                    pass
+                else:
+                    # A number at the end of the buffer may go on in the next
+                    # chunk
+                    if end == len(buffer) and not at_end:
+                        item = None
+            if item is None:
+                if at_end:
+                    raise ValueError("Unexpected end of JSON array")
+                chunk = f.read(chunk_size)
+                at_end = not chunk
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            yield item
+            position, expecting = end, ','
+            continue
+
+        character = buffer[position]
+        position += 1
+        if expecting == '[':
+            if character != '[':
+                raise ValueError("Expected a JSON array")
+            expecting = 'first item'
+        elif character == ']' and expecting in ('first item', ','):
+            return
+        elif character == ',' and expecting == ',':
+            expecting = 'item'
+        elif expecting == 'first item':
+            position -= 1
+            expecting = 'item'
+        else:
+            raise ValueError("Unexpected %r in JSON array" % character)
+
+
+def iterate_stations_pairs_ids(filename):
+    """
+    Yields the (cat station id, owner station id) pairs of a JSON file
+    holding an array of them, like `[[1, 2], [3, 4]]`, without loading the
+    whole file, to start games on fixed pairs with `FindTheCatGame.start`.
+    """
+    with open(filename, 'rb') as f:
+        for cat_station_id, owner_station_id in iterate_json_array(f):
+            yield cat_station_id, owner_station_id
+
+
+def draw_stations_indexes_pairs(random, stations_count, pairs_count):
+    """
+    The stations indexes of the cat and the owner of every pair, which
+    always start on different stations, from the floats `random` returns.
+
+    They're drawn exactly like `rng.sample(xrange(stations_count), 2)`
+    would for every pair, so seeded games place their pairs as they always
+    have, but without the overhead of a call to `sample` per pair.
+    """
+    if stations_count < 2:
+        raise ValueError("Need at least 2 stations to place pairs")
+
+    cats_indexes = array('l', [0]) * pairs_count
+    owners_indexes = array('l', [0]) * pairs_count
+    if stations_count <= 21:
+        # `sample` picks from a list of the population, and swaps the last
+        # item into the place of the first one picked
+        last_index = stations_count - 1
+        for pair_id in xrange(pairs_count):
+            cat_index = int(random() * stations_count)
+            owner_index = int(random() * last_index)
+            if owner_index == cat_index:
+                owner_index = last_index
+            cats_indexes[pair_id] = cat_index
+            owners_indexes[pair_id] = owner_index
+    else:
+        # `sample` draws again until it gets an item not picked yet
+        for pair_id in xrange(pairs_count):
+            cat_index = int(random() * stations_count)
+            owner_index = int(random() * stations_count)
+            while owner_index == cat_index:
+                owner_index = int(random() * stations_count)
+            cats_indexes[pair_id] = cat_index
+            owners_indexes[pair_id] = owner_index
+
+    return cats_indexes, owners_indexes
+
+
+class LoadReport(object):
+    """
+    Collects the problems found while loading stations, and reports the first
+    few of each kind to `stream` as they are found.
+    """
+    def __init__(self, stream=None, max_reported=10):
+        if stream is None:
+            stream = sys.stderr
+        self.stream = stream
+        self.max_reported = max_reported
+        self.duplicate_stations = 0
+        self.dangling_connections = 0
+        self.self_loops = 0
+        self.duplicate_connections = 0
+
+    def report(self, count, message):
+        if count <= self.max_reported:
+            self.stream.write(message + '\n')
+
+    def duplicate_station(self, _id):
+        self.duplicate_stations += 1
+        self.report(self.duplicate_stations,
+                    'Station %s is defined more than once' % _id)
+
+    def dangling_connection(self, first_id, second_id):
+        self.dangling_connections += 1
+        self.report(self.dangling_connections,
+                    'Connection %s - %s is to an unknown station' % (
+                        first_id, second_id))
+
+    def self_loop(self, _id):
+        self.self_loops += 1
+        self.report(self.self_loops,
+                    'Connection %s - %s is to the station itself' % (_id, _id))
 
 
 class Stations(object):
     @classmethod
-    def from_json_files(cls, stations_filename, connections_filename):
+    def from_json_files(cls, stations_filename, connections_filename,
+                        snapshot_filename=None):
+        """
+        If a `snapshot_filename` is given, the stations are loaded from it, as
+        long as it was saved from the same JSON files. Otherwise, they are
+        loaded from the JSON files, and the snapshot is (re)created.
+        """
+        if snapshot_filename is not None:
+            sources_hash = cls.hash_json_files(stations_filename,
+                                               connections_filename)
+            try:
+                graph = StationsGraph.load_snapshot(
+                    snapshot_filename, sources_hash=sources_hash)
+            except (IOError, SnapshotError):
+                pass
+            else:
+                return cls.from_graph(graph)
+
+        graph = StationsGraph.from_json_files(stations_filename,
+                                              connections_filename)
+        if snapshot_filename is not None:
+            try:
+                graph.save_snapshot(snapshot_filename, sources_hash)
+            except (IOError, OSError):
+                # The snapshot is only a cache, of the graph we have anyway
+                pass
+
+        return cls.from_graph(graph)
+
+    @classmethod
+    def hash_json_files(cls, stations_filename, connections_filename):
+        sources_hash = hashlib.sha1()
+        for filename in (stations_filename, connections_filename):
+            file_hash = hashlib.sha1()
+            with open(filename, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), ''):
+                    file_hash.update(chunk)
+            sources_hash.update(file_hash.digest())
+
+        return sources_hash.digest()
+
+    @classmethod
+    def from_graph(cls, graph):
+        """
+        The connections of the stations are only built from the graph when
+        they are first needed.
+        """
         stations = cls()
-        stations.load_from_json_files(stations_filename, connections_filename)
+        for _id, name in zip(graph.ids, graph.names):
+            Station(_id, name, stations, lazy_connections=True)
+        stations._graph = graph
+        stations.has_lazy_connections = True
 
         return stations
 
     def __init__(self):
         self.stations_by_id = {}
+        self._graph = None
+        self.has_lazy_connections = False
 
     @property
     def stations_count(self):
@@ -34,6 +236,30 @@ class Stations(object):
 
     def add_station(self, station):
         self.stations_by_id[station._id] = station
+        self.invalidate_graph()
+
+    @property
+    def graph(self):
+        if self._graph is None:
+            self._graph = StationsGraph.from_stations(self)
+
+        return self._graph
+
+    def invalidate_graph(self):
+        if self.has_lazy_connections:
+            # These were going to be built from the graph we're dropping
+            self.has_lazy_connections = False
+            for station in self.iterate_stations:
+                station.connections
+        self._graph = None
+
+    def get_neighbours_ids(self, _id):
+        graph = self.graph
+        return [
+            graph.id_of(neighbour_index)
+            for neighbour_index
+            in graph.get_neighbours_indexes(graph.index_of(_id))
+        ]
 
     def load_from_json_files(self, stations_filename, connections_filename):
         self.load_stations_from_json_file(stations_filename)
@@ -66,93 +292,754 @@ class Stations(object):
 
 
 class Station(object):
-    def __init__(self, _id, name, stations):
+    __slots__ = ('_id', 'name', 'stations', '_connections')
+
+    def __init__(self, _id, name, stations, lazy_connections=False):
         self._id = _id
         self.name = name
         self.stations = stations
         self.stations.add_station(self)
-        self.connections = set()
+        if lazy_connections:
+            self._connections = None
+        else:
+            self._connections = set()
 
     def __repr__(self):
         return '<Station %s>' % self._id
 
+    @property
+    def connections(self):
+        if self._connections is None:
+            self._connections = {
+                self.stations.by_id(_id)
+                for _id in self.stations.get_neighbours_ids(self._id)
+            }
+
+        return self._connections
+
     def connect_with(self, station):
         if station in self.connections:
             return
 
         self.connections.add(station)
+        self.stations.invalidate_graph()
         station.connect_with(self)
 
 
+class StationsGraph(object):
+    """
+    An immutable, integer-indexed snapshot of the connections of `Stations`.
+
+    Stations get dense indices in the order of their ids, and the neighbours
+    of the station at `index` are
+    `neighbours_indexes[offsets[index]:offsets[index + 1]]`, in index order.
+    It holds no references to `Station` objects, so a single instance can be
+    shared by any number of games.
+    """
+    SNAPSHOT_MAGIC = 'FTCSNAP\0'
+    SNAPSHOT_VERSION = 2
+    SNAPSHOT_HEADER = struct.Struct('<8sIBc20s20sQQQ')
+    SNAPSHOT_HEADER_SIZE = 96
+    MISSING_HASH = '\0' * 20
+
+    @classmethod
+    def from_stations(cls, stations):
+        ids = sorted(stations.stations_by_id)
+        index_by_id = {
+            _id: index
+            for index, _id in enumerate(ids)
+        }
+
+        offsets = array('l', [0])
+        neighbours_indexes = array('l')
+        for _id in ids:
+            station = stations.by_id(_id)
+            neighbours_indexes.extend(sorted(
+                index_by_id[connected_station._id]
+                for connected_station in station.connections
+            ))
+            offsets.append(len(neighbours_indexes))
+        names = [
+            stations.by_id(_id).name
+            for _id in ids
+        ]
+
+        return cls(ids, offsets, neighbours_indexes, names)
+
+    @classmethod
+    def from_edges(cls, ids, edges, names=None):
+        """
+        `edges` are pairs of indexes in `ids`, which must be sorted. Each edge
+        only needs to be given in one direction.
+        """
+        neighbours_sets = [set() for _ in ids]
+        for first_index, second_index in edges:
+            if first_index != second_index:
+                neighbours_sets[first_index].add(second_index)
+                neighbours_sets[second_index].add(first_index)
+
+        offsets = array('l', [0])
+        neighbours_indexes = array('l')
+        for neighbours_set in neighbours_sets:
+            neighbours_indexes.extend(sorted(neighbours_set))
+            offsets.append(len(neighbours_indexes))
+
+        return cls(ids, offsets, neighbours_indexes, names)
+
+    @classmethod
+    def from_json_files(cls, stations_filename, connections_filename,
+                        report=None):
+        """
+        Builds the graph straight from the JSON files, without `Station`
+        objects, streaming through the connections twice: once to count the
+        degree of each station, and once to put the neighbours in place. So
+        memory peaks at about the size of the finished graph.
+        """
+        if report is None:
+            report = LoadReport()
+
+        names_by_id = {}
+        with open(stations_filename, 'rb') as f:
+            for _id_str, name in iterate_json_array(f):
+                _id = int(_id_str)
+                if _id in names_by_id:
+                    report.duplicate_station(_id)
+                names_by_id[_id] = name
+        ids = sorted(names_by_id)
+        names = [
+            names_by_id.pop(_id)
+            for _id in ids
+        ]
+        index_by_id = {
+            _id: index
+            for index, _id in enumerate(ids)
+        }
+
+        degrees = array('l', [0]) * len(ids)
+        for first_index, second_index in cls.iterate_json_connections(
+                connections_filename, index_by_id, report):
+            degrees[first_index] += 1
+            degrees[second_index] += 1
+
+        offsets = array('l', [0])
+        for degree in degrees:
+            offsets.append(offsets[-1] + degree)
+        del degrees
+        neighbours_indexes = array('l', [0]) * offsets[-1]
+        next_positions = offsets[:-1]
+        for first_index, second_index in cls.iterate_json_connections(
+                connections_filename, index_by_id):
+            neighbours_indexes[next_positions[first_index]] = second_index
+            next_positions[first_index] += 1
+            neighbours_indexes[next_positions[second_index]] = first_index
+            next_positions[second_index] += 1
+        del next_positions
+
+        # Sort and deduplicate each row in place, moving it down over the
+        # duplicates of the previous rows
+        position = 0
+        for index in xrange(len(ids)):
+            row = sorted(set(
+                neighbours_indexes[offsets[index]:offsets[index + 1]]))
+            offsets[index] = position
+            neighbours_indexes[position:position + len(row)] = \
+                array('l', row)
+            position += len(row)
+        report.duplicate_connections += (offsets[-1] - position) / 2
+        offsets[-1] = position
+        del neighbours_indexes[position:]
+
+        return cls(ids, offsets, neighbours_indexes, names)
+
+    @classmethod
+    def iterate_json_connections(cls, connections_filename, index_by_id,
+                                 report=None):
+        """
+        The pairs of indexes of the connections in the file, skipping (and
+        reporting, if there's a `report`) the ones that are to unknown
+        stations or to the station itself.
+        """
+        with open(connections_filename, 'rb') as f:
+            for first_id_str, second_id_str in iterate_json_array(f):
+                first_id, second_id = int(first_id_str), int(second_id_str)
+                first_index = index_by_id.get(first_id)
+                second_index = index_by_id.get(second_id)
+                if first_index is None or second_index is None:
+                    if report is not None:
+                        report.dangling_connection(first_id, second_id)
+                    continue
+                if first_index == second_index:
+                    if report is not None:
+                        report.self_loop(first_id)
+                    continue
+                yield first_index, second_index
+
+    def __init__(self, ids, offsets, neighbours_indexes, names=None):
+        self.ids = array('l', ids)
+        self.offsets = offsets
+        self.neighbours_indexes = neighbours_indexes
+        if names is None:
+            names = map(str, self.ids)
+        self.names = names
+        self.index_by_id = {
+            _id: index
+            for index, _id in enumerate(self.ids)
+        }
+        self._components_ids = None
+        self._blocks_ids = None
+        self._shared_blocks_ids = None
+        self._blocks_components_ids = set()
+        self._blocks_count = 0
+        self._content_hash = None
+
+    @property
+    def stations_count(self):
+        return len(self.ids)
+
+    def index_of(self, _id):
+        return self.index_by_id[_id]
+
+    def id_of(self, index):
+        return self.ids[index]
+
+    def get_neighbours_indexes(self, index):
+        return self.neighbours_indexes[
+            self.offsets[index]:self.offsets[index + 1]]
+
+    def get_degree(self, index):
+        return self.offsets[index + 1] - self.offsets[index]
+
+    def get_content_hash(self):
+        """
+        A hash of the ids and connections of the stations, which tells apart
+        graphs that games would play differently on.
+        """
+        if self._content_hash is None:
+            content_hash = hashlib.sha1()
+            for values in (self.ids, self.offsets, self.neighbours_indexes):
+                values = array('l', values)
+                content_hash.update(struct.pack('<Q', len(values)))
+                content_hash.update(values.tostring())
+            self._content_hash = content_hash.hexdigest()
+
+        return self._content_hash
+
+    def save_snapshot(self, filename, sources_hash):
+        """
+        A binary snapshot is the header, with the hash of the sources and the
+        content hash of the graph, followed by the arrays of ids, offsets,
+        neighbours indexes and names offsets, in native byte order, and then
+        the UTF-8 encoded names. It's written to a temporary file first, so
+        that readers never see half a snapshot.
+        """
+        encoded_names = [
+            name.encode('utf-8') if isinstance(name, unicode) else name
+            for name in self.names
+        ]
+        names_offsets = array('l', [0])
+        for encoded_name in encoded_names:
+            names_offsets.append(names_offsets[-1] + len(encoded_name))
+        header = self.SNAPSHOT_HEADER.pack(
+            self.SNAPSHOT_MAGIC, self.SNAPSHOT_VERSION, self.ids.itemsize,
+            sys.byteorder[0], sources_hash,
+            binascii.unhexlify(self.get_content_hash()), self.stations_count,
+            len(self.neighbours_indexes), names_offsets[-1])
+
+        temporary_filename = '%s.%s.tmp' % (filename, os.getpid())
+        try:
+            with open(temporary_filename, 'wb') as f:
+                f.write(header.ljust(self.SNAPSHOT_HEADER_SIZE, '\0'))
+                for values in (self.ids, self.offsets,
+                               self.neighbours_indexes, names_offsets):
+                    f.write(array('l', values).tostring())
+                f.write(''.join(encoded_names))
+            os.rename(temporary_filename, filename)
+        except:
+            if os.path.exists(temporary_filename):
+                os.remove(temporary_filename)
+            raise
+
+    @classmethod
+    def load_snapshot(cls, filename, sources_hash=None):
+        """
+        The snapshot is memory-mapped, and the arrays are copied straight out
+        of it. If a `sources_hash` is given, it must match the one the snapshot
+        was saved with.
+        """
+        with open(filename, 'rb') as f:
+            try:
+                snapshot = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError("Snapshot %s is empty" % filename)
+        try:
+            return cls.load_snapshot_from_buffer(snapshot, sources_hash)
+        finally:
+            snapshot.close()
+
+    @classmethod
+    def get_snapshot_layout(cls, snapshot, sources_hash=None):
+        """
+        Checks the header of the snapshot in the buffer, and returns the
+        hash of its sources, the content hash of its graph, the position and
+        length of each of its arrays, and the position and size of its names.
+        """
+        if len(snapshot) < cls.SNAPSHOT_HEADER_SIZE:
+            raise SnapshotError("Snapshot is truncated")
+        magic, version, item_size, byte_order, snapshot_sources_hash, \
+            content_hash, stations_count, neighbours_count, names_size = \
+            cls.SNAPSHOT_HEADER.unpack_from(snapshot)
+        if magic != cls.SNAPSHOT_MAGIC:
+            raise SnapshotError("Not a stations snapshot")
+        if version != cls.SNAPSHOT_VERSION:
+            raise SnapshotError("Unsupported snapshot version %s" % version)
+        if item_size != array('l').itemsize or byte_order != sys.byteorder[0]:
+            raise SnapshotError("Snapshot was saved on another platform")
+        if sources_hash is not None and sources_hash != snapshot_sources_hash:
+            raise SnapshotError("Snapshot is out of date")
+
+        arrays_positions = []
+        position = cls.SNAPSHOT_HEADER_SIZE
+        for length in (stations_count, stations_count + 1, neighbours_count,
+                       stations_count + 1):
+            arrays_positions.append((position, length))
+            position += length * item_size
+        if len(snapshot) != position + names_size:
+            raise SnapshotError("Snapshot is truncated")
+
+        return snapshot_sources_hash, content_hash, arrays_positions, \
+            (position, names_size)
+
+    @classmethod
+    def load_snapshot_from_buffer(cls, snapshot, sources_hash=None):
+        _, _, arrays_positions, (names_position, names_size) = \
+            cls.get_snapshot_layout(snapshot, sources_hash)
+
+        arrays = []
+        for position, length in arrays_positions:
+            values = array('l')
+            values.fromstring(
+                snapshot[position:position + length * values.itemsize])
+            arrays.append(values)
+        ids, offsets, neighbours_indexes, names_offsets = arrays
+        names_blob = snapshot[names_position:names_position + names_size]
+        names = [
+            names_blob[start:end].decode('utf-8')
+            for start, end in zip(names_offsets, names_offsets[1:])
+        ]
+
+        return cls(ids, offsets, neighbours_indexes, names)
+
+    def get_component_id(self, index):
+        """
+        The connected component of the station, labelled by the lowest index
+        in it. A component is only searched the first time one of its
+        stations is asked about, so games only pay for the components their
+        pairs are in.
+        """
+        if self._components_ids is None:
+            self._components_ids = array('l', [-1]) * self.stations_count
+        components_ids = self._components_ids
+        if components_ids[index] == -1:
+            components_ids[index] = index
+            members = [index]
+            for member_index in members:
+                for neighbour_index in self.get_neighbours_indexes(
+                        member_index):
+                    if components_ids[neighbour_index] == -1:
+                        components_ids[neighbour_index] = index
+                        members.append(neighbour_index)
+            component_id = min(members)
+            for member_index in members:
+                components_ids[member_index] = component_id
+
+        return components_ids[index]
+
+    def get_components_ids(self):
+        """
+        The connected component of each station, by index, as
+        `get_component_id` labels them.
+        """
+        for index in xrange(self.stations_count):
+            self.get_component_id(index)
+
+        return self._components_ids
+
+    def get_blocks_ids(self):
+        """
+        The biconnected block of each station, by index, or -1 for the
+        stations in more than one block (the ones whose removal disconnects
+        their component) and for the stations without connections.
+        """
+        for index in xrange(self.stations_count):
+            self.get_station_blocks_ids(index)
+
+        return self._blocks_ids
+
+    def get_station_blocks_ids(self, index):
+        """
+        Like components, blocks are only found in the components asked about.
+        """
+        component_id = self.get_component_id(index)
+        if component_id not in self._blocks_components_ids:
+            self.find_blocks(component_id)
+        block_id = self._blocks_ids[index]
+        if block_id != -1:
+            return [block_id]
+
+        return self._shared_blocks_ids.get(index, [])
+
+    def find_blocks(self, root_index):
+        """
+        Hopcroft and Tarjan's depth-first search, in O(stations +
+        connections) of the component of `root_index`. The stack is
+        explicit, since Python's would overflow on long paths.
+        """
+        if self._blocks_ids is None:
+            self._blocks_ids = array('l', [-1]) * self.stations_count
+            self._shared_blocks_ids = {}
+        blocks_ids = self._blocks_ids
+        shared_blocks_ids = self._shared_blocks_ids
+        # Only as big as the component
+        discovery = {}
+        low = {}
+        discovery_time = 0
+        block_id = self._blocks_count
+
+        def add_to_block(index):
+            if index in shared_blocks_ids:
+                shared_blocks_ids[index].append(block_id)
+            elif blocks_ids[index] == -1:
+                blocks_ids[index] = block_id
+            else:
+                shared_blocks_ids[index] = [blocks_ids[index], block_id]
+                blocks_ids[index] = -1
+
+        get_neighbours_indexes = self.get_neighbours_indexes
+        discovery[root_index] = low[root_index] = discovery_time
+        discovery_time += 1
+        visited_indexes = [root_index]
+        path = [(root_index, -1, iter(get_neighbours_indexes(root_index)))]
+        while path:
+            index, parent_index, neighbours_indexes = path[-1]
+            index_low = low[index]
+            for neighbour_index in neighbours_indexes:
+                neighbour_discovery = discovery.get(neighbour_index)
+                if neighbour_discovery is None:
+                    discovery[neighbour_index] = low[neighbour_index] = \
+                        discovery_time
+                    discovery_time += 1
+                    visited_indexes.append(neighbour_index)
+                    path.append((
+                        neighbour_index, index,
+                        iter(get_neighbours_indexes(neighbour_index))))
+                    break
+                if neighbour_discovery < index_low:
+                    index_low = neighbour_discovery
+            else:
+                path.pop()
+                if parent_index != -1:
+                    if index_low < low[parent_index]:
+                        low[parent_index] = index_low
+                    if index_low >= discovery[parent_index]:
+                        # The parent and the stations visited since this one
+                        # make a block
+                        while True:
+                            block_index = visited_indexes.pop()
+                            add_to_block(block_index)
+                            if block_index == index:
+                                break
+                        add_to_block(parent_index)
+                        block_id += 1
+            low[index] = index_low
+
+        self._blocks_count = block_id
+        self._blocks_components_ids.add(self.get_component_id(root_index))
+
+
 class FindTheCatGame(object):
     @classmethod
-    def start_and_run(cls, stations, pairs_count, iteration_count=100000):
-        game = cls(stations)
+    def start_and_run(cls, stations, pairs_count, iteration_count=100000,
+                      rng=None, events=None):
+        game = cls(stations, rng=rng, events=events)
         game.start(pairs_count)
         game.run(iteration_count=iteration_count)
 
-    def __init__(self, stations):
+        return game
+
+    def __init__(self, stations, rng=None, events=None,
+                 track_reachability=True):
         self.stations = stations
+        self.graph = None
+        if rng is None:
+            rng = Random()
+        self.rng = rng
+        if events is None:
+            events = TextEventSink()
+        self.events = events
+        self.track_reachability = track_reachability
 
     def start(self, pairs_count, stations_pairs_ids=None):
+        self.steps_count = 0
         self.initialise_game_stations()
         if stations_pairs_ids is None:
             self.put_random_pairs_on_map(pairs_count)
         else:
-            stations_pairs = [
-                [self.by_id(first_id), self.by_id(second_id)]
-                for first_id, second_id in stations_pairs_ids
-            ]
-            self.put_pairs_on_map(stations_pairs)
+            self.put_pairs_ids_on_map(stations_pairs_ids)
 
-    def run(self, iteration_count=100000):
+    def run(self, iteration_count=100000, checkpointer=None):
         for _ in xrange(iteration_count):
             self.step()
+            if checkpointer is not None:
+                checkpointer.step_completed(self)
             if not self.roaming_pairs_exist:
                 break
 
-        print 'Total number of cats:', self.cats_count
-        print 'Number of cats found:', self.cats_found
+        self.events.run_finished(self.steps_count, self.cats_count,
+                                 self.cats_found, self.cats_unreachable)
+
+    def get_state(self):
+        """
+        Everything the rest of the game depends on, between two steps. The
+        values are the game's own, not copies, so they must be used (or
+        copied) before the game goes on.
+        """
+        state = {
+            'graph_hash': self.graph.get_content_hash(),
+            'track_reachability': self.track_reachability,
+            'steps_count': self.steps_count,
+            'rng_state': self.rng.getstate(),
+            'pairs_count': self.cats_count,
+            'cats_indexes': self.cats_indexes,
+            'owners_indexes': self.owners_indexes,
+            'owners_visited': self.owners_visited_game_stations,
+            'owners_visited_first_bytes': self.owners_visited_first_bytes,
+            'roaming_pairs_ids': self.roaming_pairs_ids,
+            'dormant_cats_pairs_ids': self.dormant_cats_pairs_ids,
+            'dormant_owners_pairs_ids': self.dormant_owners_pairs_ids,
+            'found_pairs_ids': self.found_pairs_ids,
+            'unreachable_pairs_ids': self.unreachable_pairs_ids,
+            'closed_indexes': self.closed_indexes,
+            'dirty_indexes': self.dirty_indexes,
+            'reachability_check_pending': self.reachability_check_pending,
+        }
+        if self.track_reachability:
+            state['components_ids'] = self.components_ids
+            state['next_component_id'] = self.next_component_id
+
+        return state
+
+    def set_state(self, state):
+        """
+        Puts the game back in a state from `get_state`, so that it carries on
+        exactly as it would have from there.
+
+        The sets of pairs ids are built in the same way as when the game
+        starts, so that they are iterated in the same order, and the moves
+        pick the same random numbers.
+        """
+        self.track_reachability = state['track_reachability']
+        self.initialise_game_stations()
+        if state['graph_hash'] != self.graph.get_content_hash():
+            raise ValueError("The state is of a game on other stations")
+        self.steps_count = state['steps_count']
+        self.rng.setstate(state['rng_state'])
+
+        self.pairs_ids = range(state['pairs_count'])
+        self.cats_indexes = array('l', state['cats_indexes'])
+        self.owners_indexes = array('l', state['owners_indexes'])
+        self.owners_visited_game_stations = [
+            bytearray(visited)
+            for visited in state['owners_visited']
+        ]
+        self.owners_visited_first_bytes = array(
+            'l', state['owners_visited_first_bytes'])
+
+        self.found_pairs_ids = set(state['found_pairs_ids'])
+        self.unreachable_pairs_ids = set(state['unreachable_pairs_ids'])
+        self.dormant_cats_pairs_ids = set(state['dormant_cats_pairs_ids'])
+        self.dormant_owners_pairs_ids = set(state['dormant_owners_pairs_ids'])
+        roaming_pairs_ids = set(state['roaming_pairs_ids'])
+        self.roaming_pairs_ids = set(self.pairs_ids)
+        self.moving_cats_pairs_ids = set(self.pairs_ids)
+        self.moving_owners_pairs_ids = set(self.pairs_ids)
+        for pair_id in self.pairs_ids:
+            if pair_id not in roaming_pairs_ids:
+                self.roaming_pairs_ids.discard(pair_id)
+            if pair_id not in roaming_pairs_ids \
+                    or pair_id in self.dormant_cats_pairs_ids:
+                self.moving_cats_pairs_ids.discard(pair_id)
+            if pair_id not in roaming_pairs_ids \
+                    or pair_id in self.dormant_owners_pairs_ids:
+                self.moving_owners_pairs_ids.discard(pair_id)
+
+        self.closed_indexes = set(state['closed_indexes'])
+        self.dirty_indexes = set(state['dirty_indexes'])
+        self.reachability_check_pending = state['reachability_check_pending']
+        if self.track_reachability:
+            self.components_ids = dict(state['components_ids'])
+            self.next_component_id = state['next_component_id']
+            for index in self.closed_indexes:
+                self.broken_blocks_ids.update(
+                    self.graph.get_station_blocks_ids(index))
+
+        # Found pairs left their station when it closed under them
+        for pair_id in self.pairs_ids:
+            if pair_id in self.found_pairs_ids:
+                continue
+            self.get_game_station(self.cats_indexes[pair_id]).cats.add(
+                pair_id)
+            self.get_game_station(self.owners_indexes[pair_id]).owners.add(
+                pair_id)
+
+    def get_roaming_positions(self):
+        """
+        The station indexes of the cat and the owner of each roaming pair, by
+        pair id, to compare games between engines.
+        """
+        return {
+            pair_id: (self.cats_indexes[pair_id], self.owners_indexes[pair_id])
+            for pair_id in self.roaming_pairs_ids
+        }
 
-    def initialise_game_stations(self):
-        self.game_stations = {
-            station._id: GameStation(self, station)
-            for station in self.stations.iterate_stations
+    def get_result(self):
+        return {
+            'cats_count': self.cats_count,
+            'cats_found': self.cats_found,
+            'cats_unreachable': self.cats_unreachable,
+            'cats_roaming': self.roaming_pairs_count,
+            'steps_count': self.steps_count,
         }
 
+    def initialise_game_stations(self):
+        """
+        Game stations are only created the first time a game needs them (see
+        `get_game_station`), and which stations are closed, and which changed
+        component, are kept on the side. So the game only grows with the
+        stations it reaches.
+
+        Tracking reachability needs the components of the graph the pairs
+        are in, and their biconnected blocks from the first closure in them
+        on: the first game to reach a component finds them, in O(stations of
+        the component), and the next games reuse them. Without tracking,
+        starting a game costs the same on any network.
+        """
+        self.graph = self.stations.graph
+        self.game_stations_by_index = {}
+        self.closed_indexes = set()
+        self.dirty_indexes = set()
+        if self.track_reachability:
+            # The components of the stations that changed component since the
+            # start, and the ones of the graph for the rest
+            self.components_ids = {}
+            # Above the ids of the graph, which are stations indexes
+            self.next_component_id = self.graph.stations_count
+            # The biconnected blocks with a closed station. The blocks of the
+            # graph are only found on the first closure
+            self.broken_blocks_ids = set()
+        self.reachability_check_pending = True
+
     @property
     def iterate_game_stations(self):
-        return self.game_stations.itervalues()
+        """
+        Only the game stations that have been used so far.
+        """
+        return self.game_stations_by_index.itervalues()
+
+    def get_game_station(self, index):
+        game_station = self.game_stations_by_index.get(index)
+        if game_station is None:
+            station = self.stations.by_id(self.graph.id_of(index))
+            game_station = GameStation(self, station, index)
+            self.game_stations_by_index[index] = game_station
+
+        return game_station
 
     def by_id(self, _id):
-        return self.game_stations[_id]
+        return self.get_game_station(self.graph.index_of(_id))
 
-    def sample_game_stations(self, count):
-        return sample(self.game_stations.values(), count)
+    def is_open(self, index):
+        return index not in self.closed_indexes
 
-    def put_random_pairs_on_map(self, pairs_count):
-        stations_pairs = self.create_random_station_pairs(pairs_count)
-        self.put_pairs_on_map(stations_pairs)
+    def get_component_id(self, index):
+        component_id = self.components_ids.get(index)
+        if component_id is None:
+            return self.graph.get_component_id(index)
 
-    def create_random_station_pairs(self, pairs_count):
-        return [
-            self.sample_game_stations(count=2)
-            for _ in xrange(pairs_count)
-        ]
+        return component_id
+
+    def put_random_pairs_on_map(self, pairs_count):
+        cats_indexes, owners_indexes = \
+            self.create_random_stations_indexes_pairs(pairs_count)
+        self.put_pairs_indexes_on_map(cats_indexes, owners_indexes)
+
+    def create_random_stations_indexes_pairs(self, pairs_count):
+        return draw_stations_indexes_pairs(
+            self.rng.random, self.graph.stations_count, pairs_count)
+
+    def put_pairs_ids_on_map(self, stations_pairs_ids):
+        """
+        `stations_pairs_ids` can be any iterable of (cat station id, owner
+        station id), like `iterate_stations_pairs_ids` of a file, and is only
+        gone through once.
+        """
+        index_of = self.graph.index_of
+        cats_indexes = array('l')
+        owners_indexes = array('l')
+        for cat_station_id, owner_station_id in stations_pairs_ids:
+            cats_indexes.append(index_of(cat_station_id))
+            owners_indexes.append(index_of(owner_station_id))
+        self.put_pairs_indexes_on_map(cats_indexes, owners_indexes)
 
     def put_pairs_on_map(self, stations_pairs):
-        pairs_count = len(stations_pairs)
+        self.put_pairs_indexes_on_map(
+            array('l', [cat_game_station.index
+                        for cat_game_station, _ in stations_pairs]),
+            array('l', [owner_game_station.index
+                        for _, owner_game_station in stations_pairs]))
+
+    def put_pairs_indexes_on_map(self, cats_indexes, owners_indexes):
+        """
+        Does what `put_cat` and `put_owner` would for every pair, in a single
+        pass: no agent has a previous station to leave yet.
+        """
+        pairs_count = len(cats_indexes)
         self.pairs_ids = range(pairs_count)
         self.roaming_pairs_ids = set(self.pairs_ids)
-
-        self.cats_game_stations = {}
-        self.owners_game_stations = {}
-        self.owners_visited_game_stations = {}
-
-        for pair_id, (cat_game_station, owner_game_station) in \
-                zip(self.pairs_ids, stations_pairs):
-            cat_game_station.put_cat(pair_id)
-            owner_game_station.put_owner(pair_id)
+        self.moving_cats_pairs_ids = set(self.pairs_ids)
+        self.moving_owners_pairs_ids = set(self.pairs_ids)
+        self.dormant_cats_pairs_ids = set()
+        self.dormant_owners_pairs_ids = set()
+        self.found_pairs_ids = set()
+        self.unreachable_pairs_ids = set()
+
+        # The index of the station of each cat and owner, by pair id
+        self.cats_indexes = cats_indexes
+        self.owners_indexes = owners_indexes
+        # Each owner has only visited the station it starts on
+        self.owners_visited_game_stations = [
+            bytearray((1 << (owner_index & 7),))
+            for owner_index in owners_indexes
+        ]
+        self.owners_visited_first_bytes = array('l', [
+            owner_index >> 3
+            for owner_index in owners_indexes
+        ])
+
+        game_stations_by_index = self.game_stations_by_index
+        get_game_station = self.get_game_station
+        mark_dirty = self.dirty_indexes.add
+        for pair_id, cat_index, owner_index in izip(
+                self.pairs_ids, cats_indexes, owners_indexes):
+            cat_game_station = game_stations_by_index.get(cat_index)
+            if cat_game_station is None:
+                cat_game_station = get_game_station(cat_index)
+            cat_game_station.cats.add(pair_id)
+            mark_dirty(cat_index)
+            owner_game_station = game_stations_by_index.get(owner_index)
+            if owner_game_station is None:
+                owner_game_station = get_game_station(owner_index)
+            owner_game_station.owners.add(pair_id)
+            mark_dirty(owner_index)
 
     @property
     def cats_count(self):
@@ -168,74 +1055,354 @@ class FindTheCatGame(object):
 
     @property
     def cats_found(self):
-        return self.cats_count - self.roaming_pairs_count
+        return len(self.found_pairs_ids)
+
+    @property
+    def cats_unreachable(self):
+        return len(self.unreachable_pairs_ids)
+
+    def get_cat_game_station(self, pair_id):
+        return self.game_stations_by_index[self.cats_indexes[pair_id]]
+
+    def get_owner_game_station(self, pair_id):
+        return self.game_stations_by_index[self.owners_indexes[pair_id]]
+
+    def mark_game_station_as_dirty(self, game_station):
+        self.dirty_indexes.add(game_station.index)
 
     def get_matched_pairs_per_station(self):
-        return {
-            game_station: game_station.get_matched_pairs()
-            for game_station in self.iterate_game_stations
-        }
+        """
+        Only the stations that a cat or an owner moved onto since the last
+        check can have new matches: every other match has already been found
+        and its station closed.
+        """
+        matched_pairs_per_station = {}
+        game_stations_by_index = self.game_stations_by_index
+        for index in self.dirty_indexes:
+            game_station = game_stations_by_index[index]
+            matched_pairs = game_station.get_matched_pairs()
+            if matched_pairs:
+                matched_pairs_per_station[game_station] = matched_pairs
+
+        return matched_pairs_per_station
 
     def get_all_matched_pairs(self):
-        matched_pairs_lists = self.get_matched_pairs_per_station().itervalues()
-        return reduce(set.__or__, matched_pairs_lists, set())
+        all_matched_pairs = set()
+        for index in self.dirty_indexes:
+            all_matched_pairs |= \
+                self.game_stations_by_index[index].get_matched_pairs()
+
+        return all_matched_pairs
 
     def step(self):
         self.find_and_close_stations()
         self.move_cats()
         self.move_owners()
+        if self.reachability_check_pending:
+            self.retire_unreachable_pairs()
+        self.events.step_completed(self.steps_count, self.roaming_pairs_count)
+        self.steps_count += 1
 
     def find_and_close_stations(self):
         matched_pairs_per_station = self.get_matched_pairs_per_station()
+        self.dirty_indexes = set()
+        events = self.events
         for game_station, matched_pairs \
                 in matched_pairs_per_station.iteritems():
-            if not matched_pairs:
+            station = game_station.station
+            if events.enabled:
+                for pair_id in matched_pairs:
+                    events.pair_found(self.steps_count, pair_id, station._id,
+                                      station.name)
+
+            game_station.close()
+            events.station_closed(self.steps_count, station._id, station.name)
+            self.stop_roaming(matched_pairs)
+            self.found_pairs_ids |= matched_pairs
+            self.reachability_check_pending = True
+
+    def split_component(self, closed_game_station):
+        """
+        Closing a station can split its component in pieces.
+
+        It can't if the station is in a single biconnected block of the
+        graph, and no other station of that block closed yet: the rest of
+        the block still connects all its open neighbours. That takes no
+        search at all, which matters for the first closure on a long cycle.
+
+        Otherwise, we search from each of its open neighbours in lockstep,
+        merging searches that meet, until at most one group of searches is
+        still going: every other group has then explored a whole new
+        component, and gets a new id, and the biggest piece keeps the old
+        id. When the station splits its component, the work is proportional
+        to the size of the smaller pieces. When it doesn't, the searches go
+        on until they meet, which can take the whole component, on a cycle
+        that already has a closed station.
+        """
+        if not self.track_reachability:
+            return
+
+        index = closed_game_station.index
+        blocks_ids = self.graph.get_station_blocks_ids(index)
+        block_was_intact = len(blocks_ids) == 1 \
+            and blocks_ids[0] not in self.broken_blocks_ids
+        self.broken_blocks_ids.update(blocks_ids)
+        if block_was_intact:
+            return
+
+        get_neighbours_indexes = self.graph.get_neighbours_indexes
+        closed_indexes = self.closed_indexes
+        starts = [
+            neighbour_index
+            for neighbour_index in get_neighbours_indexes(index)
+            if neighbour_index not in closed_indexes
+        ]
+        if len(starts) < 2:
+            return
+
+        searches_ids = range(len(starts))
+        groups = list(searches_ids)
+
+        def find_group(search_id):
+            while groups[search_id] != search_id:
+                groups[search_id] = groups[groups[search_id]]
+                search_id = groups[search_id]
+            return search_id
+
+        search_by_index = {
+            start: search_id
+            for search_id, start in enumerate(starts)
+        }
+        queues = [deque([start]) for start in starts]
+        members = [[start] for start in starts]
+        active_searches_ids = set(searches_ids)
+        while len({
+            find_group(search_id)
+            for search_id in active_searches_ids
+        }) > 1:
+            for search_id in list(active_searches_ids):
+                queue = queues[search_id]
+                index = queue.popleft()
+                for neighbour_index in get_neighbours_indexes(index):
+                    if neighbour_index in closed_indexes:
+                        continue
+                    other_search_id = search_by_index.get(neighbour_index)
+                    if other_search_id is None:
+                        search_by_index[neighbour_index] = search_id
+                        queue.append(neighbour_index)
+                        members[search_id].append(neighbour_index)
+                    else:
+                        groups[find_group(other_search_id)] = \
+                            find_group(search_id)
+                if not queue:
+                    active_searches_ids.remove(search_id)
+
+        if active_searches_ids:
+            remaining_group = find_group(next(iter(active_searches_ids)))
+        else:
+            remaining_group = find_group(0)
+        new_components_ids = {}
+        for search_id in searches_ids:
+            group = find_group(search_id)
+            if group == remaining_group:
                 continue
+            if group not in new_components_ids:
+                new_components_ids[group] = self.next_component_id
+                self.next_component_id += 1
+            component_id = new_components_ids[group]
+            for index in members[search_id]:
+                self.components_ids[index] = component_id
+
+    def get_reachable_components_ids(self, game_station):
+        """
+        An agent on an open station stays in its component. One on a closed
+        station (that closed under it) can still step into the component of
+        any of its open neighbours.
+        """
+        if game_station.is_open:
+            return {self.get_component_id(game_station.index)}
 
-            for pair_id in matched_pairs:
-                print 'Owner', pair_id, 'found cat', pair_id, '-', \
-                    game_station.station.name, 'is now closed'
+        return {
+            self.get_component_id(neighbour_game_station.index)
+            for neighbour_game_station in game_station.open_neighbours_list
+        }
 
-            game_station.close()
-            self.roaming_pairs_ids -= matched_pairs
+    def is_pair_reachable(self, pair_id):
+        cat_index = self.cats_indexes[pair_id]
+        owner_index = self.owners_indexes[pair_id]
+        if cat_index not in self.closed_indexes \
+                and owner_index not in self.closed_indexes:
+            return self.get_component_id(cat_index) \
+                == self.get_component_id(owner_index)
+
+        return bool(
+            self.get_reachable_components_ids(
+                self.get_cat_game_station(pair_id))
+            & self.get_reachable_components_ids(
+                self.get_owner_game_station(pair_id)))
+
+    def retire_unreachable_pairs(self):
+        """
+        Pairs whose cat and owner can never meet stop roaming. This only needs
+        to run after stations close, once the agents have moved off them.
+        """
+        self.reachability_check_pending = False
+        if not self.track_reachability:
+            return
+
+        unreachable_pairs_ids = {
+            pair_id
+            for pair_id in self.roaming_pairs_ids
+            if not self.is_pair_reachable(pair_id)
+        }
+        self.stop_roaming(unreachable_pairs_ids)
+        self.unreachable_pairs_ids |= unreachable_pairs_ids
+
+    def stop_roaming(self, pairs_ids):
+        """
+        Pairs are discarded one at a time, because bulk removals can shrink
+        the sets, which reorders them: this way, the moving sets are always
+        iterated in the order of the pairs ids, whatever happened before (see
+        `set_state`).
+        """
+        for pair_id in pairs_ids:
+            self.roaming_pairs_ids.discard(pair_id)
+            self.moving_cats_pairs_ids.discard(pair_id)
+            self.moving_owners_pairs_ids.discard(pair_id)
+            self.dormant_cats_pairs_ids.discard(pair_id)
+            self.dormant_owners_pairs_ids.discard(pair_id)
+
+    def make_cats_dormant(self, pairs_ids):
+        """
+        A cat on a station without open neighbours can never move again,
+        since stations never reopen, so we stop trying to move it. It can
+        still be found, if its owner walks onto it.
+        """
+        for pair_id in pairs_ids:
+            self.moving_cats_pairs_ids.discard(pair_id)
+        self.dormant_cats_pairs_ids.update(pairs_ids)
+        self.retire_frozen_pairs(pairs_ids)
+
+    def make_owners_dormant(self, pairs_ids):
+        for pair_id in pairs_ids:
+            self.moving_owners_pairs_ids.discard(pair_id)
+        self.dormant_owners_pairs_ids.update(pairs_ids)
+        self.retire_frozen_pairs(pairs_ids)
+
+    def retire_frozen_pairs(self, pairs_ids):
+        """
+        Once both the cat and the owner of a pair are dormant on different
+        stations, they can never meet. That only takes knowing which agents
+        have no open neighbours, so it's done whether reachability is
+        tracked or not.
+        """
+        frozen_pairs_ids = {
+            pair_id
+            for pair_id in pairs_ids
+            if pair_id in self.dormant_cats_pairs_ids
+            and pair_id in self.dormant_owners_pairs_ids
+            and self.cats_indexes[pair_id] != self.owners_indexes[pair_id]
+        }
+        self.stop_roaming(frozen_pairs_ids)
+        self.unreachable_pairs_ids |= frozen_pairs_ids
 
     def move_cats(self):
-        for pair_id in self.roaming_pairs_ids:
-            possible_game_stations = self.get_cat_possible_moves(pair_id)
+        random = self.rng.random
+        get_possible_moves_list = self.get_cat_possible_moves_list
+        stuck_pairs_ids = []
+        for pair_id in self.moving_cats_pairs_ids:
+            possible_game_stations = get_possible_moves_list(pair_id)
             if not possible_game_stations:
+                stuck_pairs_ids.append(pair_id)
                 continue
 
-            next_game_station = choice(list(possible_game_stations))
-            next_game_station.put_cat(pair_id)
+            # What `rng.choice` does, without calling it for every move
+            possible_game_stations[
+                int(random() * len(possible_game_stations))].put_cat(pair_id)
+
+        if stuck_pairs_ids:
+            self.make_cats_dormant(stuck_pairs_ids)
 
     def get_cat_possible_moves(self, pair_id):
-        cat_game_station = self.cats_game_stations[pair_id]
-        open_neighbours = cat_game_station.open_neighbours
+        return set(self.get_cat_possible_moves_list(pair_id))
+
+    def get_cat_possible_moves_list(self, pair_id):
+        cat_game_station = self.get_cat_game_station(pair_id)
 
-        return open_neighbours
+        return cat_game_station.open_neighbours_list
 
     def move_owners(self):
-        for pair_id in self.roaming_pairs_ids:
-            possible_game_stations = self.get_owner_possible_moves(pair_id)
+        random = self.rng.random
+        get_possible_moves_list = self.get_owner_possible_moves_list
+        stuck_pairs_ids = []
+        for pair_id in self.moving_owners_pairs_ids:
+            possible_game_stations = get_possible_moves_list(pair_id)
             if not possible_game_stations:
+                stuck_pairs_ids.append(pair_id)
                 continue
 
-            next_game_station = choice(list(possible_game_stations))
-            next_game_station.put_owner(pair_id)
+            possible_game_stations[
+                int(random() * len(possible_game_stations))].put_owner(
+                    pair_id)
+
+        if stuck_pairs_ids:
+            self.make_owners_dormant(stuck_pairs_ids)
 
     def get_owner_possible_moves(self, pair_id):
-            owner_game_station = self.owners_game_stations[pair_id]
-            open_neighbours = owner_game_station.open_neighbours
-            if not open_neighbours:
-                open_neighbours
+        return set(self.get_owner_possible_moves_list(pair_id))
 
-            visited_neighbours = self.owners_visited_game_stations[pair_id]
-            not_visited_open_neighbours = open_neighbours - visited_neighbours
+    def get_owner_possible_moves_list(self, pair_id):
+        owner_game_station = self.get_owner_game_station(pair_id)
+        open_neighbours = owner_game_station.open_neighbours_list
 
-            if not_visited_open_neighbours:
-                return not_visited_open_neighbours
-            else:
-                return open_neighbours
+        not_visited_open_neighbours = \
+            self.get_owner_not_visited_game_stations(pair_id, open_neighbours)
+
+        if not_visited_open_neighbours:
+            return not_visited_open_neighbours
+        else:
+            return open_neighbours
+
+    def mark_owner_visited(self, pair_id, game_station):
+        """
+        The stations an owner has visited are a bitset, indexed by station
+        index, that only spans from the lowest to the highest index visited so
+        far: `owners_visited_first_bytes` is the byte it starts at.
+        """
+        visited = self.owners_visited_game_stations[pair_id]
+        byte_index = game_station.visited_byte_index
+        if not visited:
+            self.owners_visited_first_bytes[pair_id] = byte_index
+        first_byte = self.owners_visited_first_bytes[pair_id]
+        if byte_index < first_byte:
+            visited[0:0] = bytearray(first_byte - byte_index)
+            self.owners_visited_first_bytes[pair_id] = first_byte = byte_index
+        position = byte_index - first_byte
+        if position >= len(visited):
+            visited.extend(bytearray(position + 1 - len(visited)))
+        visited[position] |= game_station.visited_bit
+
+    def has_owner_visited(self, pair_id, game_station):
+        visited = self.owners_visited_game_stations[pair_id]
+        position = game_station.visited_byte_index \
+            - self.owners_visited_first_bytes[pair_id]
+
+        return 0 <= position < len(visited) \
+            and bool(visited[position] & game_station.visited_bit)
+
+    def get_owner_not_visited_game_stations(self, pair_id, game_stations):
+        visited = self.owners_visited_game_stations[pair_id]
+        visited_length = len(visited)
+        first_byte = self.owners_visited_first_bytes[pair_id]
+
+        return [
+            game_station
+            for game_station in game_stations
+            if not 0 <= game_station.visited_byte_index - first_byte
+            < visited_length
+            or not visited[game_station.visited_byte_index - first_byte]
+            & game_station.visited_bit
+        ]
 
 
 class GameStation(object):
@@ -243,53 +1410,81 @@ class GameStation(object):
     We are using a differnt class for GameStation, because so that we can have
     more than one instances of FindTheCatGame at any point. The reason we want
     that, is separation of concerns.
+
+    There can be a lot of them, so they have `__slots__`, and the game refers
+    to them by index rather than by reference in its per-step state.
     """
-    def __init__(self, game, station):
+    __slots__ = (
+        'game', 'station', 'index', 'visited_byte_index', 'visited_bit',
+        '_neighbours', '_open_neighbours_list', 'cats', 'owners',
+    )
+
+    def __init__(self, game, station, index):
         self.game = game
         self.station = station
-        self.is_open = True
+        self.index = index
+        self.visited_byte_index = index >> 3
+        self.visited_bit = 1 << (index & 7)
+        self._neighbours = None
+        self._open_neighbours_list = None
         self.cats = set()
         self.owners = set()
 
     def __repr__(self):
         return '<GameStation %s>' % self.station._id
 
+    @property
+    def is_open(self):
+        return self.index not in self.game.closed_indexes
+
     def put_cat(self, pair_id):
         self.remove_cat_from_previous_game_station(pair_id)
         self.cats.add(pair_id)
-        self.game.cats_game_stations[pair_id] = self
+        self.game.cats_indexes[pair_id] = self.index
+        self.game.mark_game_station_as_dirty(self)
 
     def put_owner(self, pair_id):
         self.remove_owner_from_previous_game_station(pair_id)
         self.owners.add(pair_id)
-        self.game.owners_game_stations[pair_id] = self
-        self.game.owners_visited_game_stations\
-            .setdefault(pair_id, set())\
-            .add(self)
+        self.game.owners_indexes[pair_id] = self.index
+        self.game.mark_game_station_as_dirty(self)
+        self.game.mark_owner_visited(pair_id, self)
 
     def remove_cat(self, pair_id):
         if pair_id in self.cats:
             self.cats.remove(pair_id)
 
     def remove_cat_from_previous_game_station(self, pair_id):
-        previous_game_station = self.game.cats_game_stations.get(pair_id)
-        if previous_game_station:
-            previous_game_station.remove_cat(pair_id)
+        previous_index = self.game.cats_indexes[pair_id]
+        if previous_index != -1:
+            self.game.game_stations_by_index[previous_index].remove_cat(
+                pair_id)
 
     def remove_owner(self, pair_id):
         if pair_id in self.owners:
             self.owners.remove(pair_id)
 
     def remove_owner_from_previous_game_station(self, pair_id):
-        previous_game_station = self.game.owners_game_stations.get(pair_id)
-        if previous_game_station:
-            previous_game_station.remove_owner(pair_id)
+        previous_index = self.game.owners_indexes[pair_id]
+        if previous_index != -1:
+            self.game.game_stations_by_index[previous_index].remove_owner(
+                pair_id)
 
     def get_matched_pairs(self):
         return self.cats & self.owners
 
     def close(self):
-        self.is_open = False
+        if self.is_open:
+            self.game.closed_indexes.add(self.index)
+            # Neighbours that weren't used yet will leave this one out of
+            # their open neighbours when they are
+            game_stations_by_index = self.game.game_stations_by_index
+            for neighbour_index \
+                    in self.game.graph.get_neighbours_indexes(self.index):
+                game_station = game_stations_by_index.get(neighbour_index)
+                if game_station is not None:
+                    game_station.remove_open_neighbour(self)
+            self.game.split_component(self)
         self.remove_matched_pairs()
 
     def remove_matched_pairs(self):
@@ -299,18 +1494,43 @@ class GameStation(object):
 
     @property
     def neighbours(self):
-        return {
-            self.game.game_stations[station._id]
-            for station in self.station.connections
-        }
+        if self._neighbours is None:
+            get_game_station = self.game.get_game_station
+            self._neighbours = frozenset(
+                get_game_station(neighbour_index)
+                for neighbour_index
+                in self.game.graph.get_neighbours_indexes(self.index)
+            )
+
+        return self._neighbours
 
     @property
     def open_neighbours(self):
-        return {
-            game_station
-            for game_station in self.neighbours
-            if game_station.is_open
-        }
+        return set(self.open_neighbours_list)
+
+    @property
+    def open_neighbours_list(self):
+        """
+        The open neighbours, in graph order. It's kept up to date as stations
+        close, so that picking a random move doesn't need to build anything.
+        """
+        if self._open_neighbours_list is None:
+            get_game_station = self.game.get_game_station
+            closed_indexes = self.game.closed_indexes
+            self._open_neighbours_list = [
+                get_game_station(neighbour_index)
+                for neighbour_index
+                in self.game.graph.get_neighbours_indexes(self.index)
+                if neighbour_index not in closed_indexes
+            ]
+
+        return self._open_neighbours_list
+
+    def remove_open_neighbour(self, game_station):
+        if self._open_neighbours_list is None:
+            return
+
+        self._open_neighbours_list.remove(game_station)
 
     def move_cat_to(self, pair_id, game_station):
         self.remove_cat(pair_id)
@@ -329,7 +1549,8 @@ def main():
     pairs_count, = arguments
 
     stations = Stations.from_json_files("./tfl_stations.json",
-                                        "./tfl_connections.json")
+                                        "./tfl_connections.json",
+                                        snapshot_filename="./tfl.snapshot")
     FindTheCatGame.start_and_run(stations, pairs_count=pairs_count)
 
 
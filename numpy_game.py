@@ -0,0 +1,745 @@
+import numpy
+
+from main import draw_stations_indexes_pairs
+from events import TextEventSink
+
+
+class NumpyFindTheCatGame(object):
+    """
+    A vectorised alternative to `FindTheCatGame`, for games with a lot of
+    pairs.
+
+    Instead of objects per station and per agent, positions, roaming flags
+    and open stations are NumPy arrays, indexed by pair id and by station
+    index in the `StationsGraph`. Each step is a handful of batched
+    operations over all the roaming pairs at once.
+
+    It follows the same rules as `FindTheCatGame`: cats move to a random open
+    neighbour, owners prefer the open neighbours they haven't visited yet,
+    and a station closes as soon as an owner finds their cat on it. Like it,
+    it retires the pairs whose cat and owner can't reach each other anymore,
+    unless `track_reachability` is false, and the stations an owner visited
+    are a bitset that only spans the indexes it visited.
+
+    Neighbours are looked up in the offsets and neighbours indexes of the
+    graph, so that memory and time depend on the number of connections, not
+    on the highest degree.
+    """
+    @classmethod
+    def start_and_run(cls, stations, pairs_count, iteration_count=100000,
+                      random_state=None, events=None,
+                      track_reachability=True):
+        game = cls(stations, random_state=random_state, events=events,
+                   track_reachability=track_reachability)
+        game.start(pairs_count)
+        game.run(iteration_count=iteration_count)
+
+        return game
+
+    def __init__(self, stations, random_state=None, events=None,
+                 track_reachability=True):
+        self.stations = stations
+        self.graph = stations.graph
+        if random_state is None:
+            random_state = numpy.random.RandomState()
+        self.random_state = random_state
+        if events is None:
+            events = TextEventSink()
+        self.events = events
+        self.track_reachability = track_reachability
+        self.offsets = numpy.array(self.graph.offsets, dtype=numpy.intp)
+        self.neighbours_indexes = numpy.array(self.graph.neighbours_indexes,
+                                              dtype=numpy.intp)
+
+    @property
+    def stations_count(self):
+        return self.graph.stations_count
+
+    def start(self, pairs_count, stations_pairs_ids=None):
+        self.steps_count = 0
+        self.stations_open = numpy.ones(self.stations_count, dtype=bool)
+        # Like in `FindTheCatGame`, pairs in different components of the
+        # network are retired after the first step
+        self.reachability_check_pending = self.track_reachability
+        self.components_labels = None
+        self.closed_stations = []
+        if stations_pairs_ids is None:
+            cats_stations, owners_stations = \
+                self.create_random_stations_pairs(pairs_count)
+        else:
+            index_of = self.graph.index_of
+            stations_pairs = numpy.array([
+                [index_of(first_id), index_of(second_id)]
+                for first_id, second_id in stations_pairs_ids
+            ], dtype=numpy.intp).reshape(-1, 2)
+            cats_stations, owners_stations = stations_pairs.T
+        self.put_pairs_on_map(cats_stations, owners_stations)
+
+    def run(self, iteration_count=100000):
+        for _ in xrange(iteration_count):
+            self.step()
+            if not self.roaming_pairs_exist:
+                break
+
+        self.events.run_finished(self.steps_count, self.cats_count,
+                                 self.cats_found, self.cats_unreachable)
+
+    def create_random_stations_pairs(self, pairs_count):
+        """
+        Like `FindTheCatGame.create_random_stations_indexes_pairs`: the
+        cat and the owner of a pair always start on different stations.
+
+        With a `RandomStream` instead of a `RandomState`, the pairs are drawn
+        the same way `FindTheCatGame` draws them, from the same stream.
+        """
+        if not isinstance(self.random_state, numpy.random.RandomState):
+            return draw_stations_indexes_pairs(
+                self.random_state.random, self.stations_count, pairs_count)
+        if self.stations_count < 2:
+            raise ValueError("Need at least 2 stations to place pairs")
+        cats_stations = self.random_state.randint(
+            0, self.stations_count, size=pairs_count)
+        owners_stations = self.random_state.randint(
+            0, self.stations_count - 1, size=pairs_count)
+        owners_stations += owners_stations >= cats_stations
+
+        return cats_stations, owners_stations
+
+    def put_pairs_on_map(self, cats_stations, owners_stations):
+        self.pairs_ids = numpy.arange(len(cats_stations))
+        self.cats_stations = numpy.array(cats_stations, dtype=numpy.intp)
+        self.owners_stations = numpy.array(owners_stations, dtype=numpy.intp)
+        self.roaming = numpy.ones(self.cats_count, dtype=bool)
+        self.unreachable = numpy.zeros(self.cats_count, dtype=bool)
+        # The cats that had no open neighbours to move to in this step
+        self.cats_stuck = numpy.zeros(self.cats_count, dtype=bool)
+
+        self.owners_visited = VisitedBitsets(self.owners_stations,
+                                             self.stations_count)
+
+    @property
+    def cats_count(self):
+        return len(self.pairs_ids)
+
+    @property
+    def roaming_pairs_ids(self):
+        return numpy.flatnonzero(self.roaming)
+
+    @property
+    def roaming_pairs_exist(self):
+        return bool(self.roaming.any())
+
+    @property
+    def roaming_pairs_count(self):
+        return int(numpy.count_nonzero(self.roaming))
+
+    @property
+    def cats_unreachable(self):
+        return int(numpy.count_nonzero(self.unreachable))
+
+    @property
+    def cats_found(self):
+        return self.cats_count - self.roaming_pairs_count \
+            - self.cats_unreachable
+
+    def get_result(self):
+        return {
+            'cats_count': self.cats_count,
+            'cats_found': self.cats_found,
+            'cats_unreachable': self.cats_unreachable,
+            'cats_roaming': self.roaming_pairs_count,
+            'steps_count': self.steps_count,
+        }
+
+    def get_roaming_positions(self):
+        roaming_pairs_ids = self.roaming_pairs_ids
+
+        return dict(zip(
+            roaming_pairs_ids.tolist(),
+            zip(self.cats_stations[roaming_pairs_ids].tolist(),
+                self.owners_stations[roaming_pairs_ids].tolist())))
+
+    def get_all_matched_pairs(self):
+        roaming_pairs_ids = self.roaming_pairs_ids
+        matches = self.cats_stations[roaming_pairs_ids] \
+            == self.owners_stations[roaming_pairs_ids]
+
+        return roaming_pairs_ids[matches]
+
+    def step(self):
+        self.find_and_close_stations()
+        self.move_cats()
+        self.move_owners()
+        if self.reachability_check_pending:
+            self.retire_unreachable_pairs()
+        self.events.step_completed(self.steps_count, self.roaming_pairs_count)
+        self.steps_count += 1
+
+    def find_and_close_stations(self):
+        matched_pairs_ids = self.get_all_matched_pairs()
+        if not matched_pairs_ids.size:
+            return
+
+        matched_stations = self.cats_stations[matched_pairs_ids]
+        self.roaming[matched_pairs_ids] = False
+        self.stations_open[matched_stations] = False
+        if self.track_reachability:
+            self.reachability_check_pending = True
+            self.closed_stations.append(matched_stations)
+
+        events = self.events
+        if events.enabled:
+            for pair_id, station_index in zip(matched_pairs_ids.tolist(),
+                                              matched_stations.tolist()):
+                station = self.stations.by_id(self.graph.id_of(station_index))
+                events.pair_found(self.steps_count, pair_id, station._id,
+                                  station.name)
+        for station_index in numpy.unique(matched_stations).tolist():
+            station = self.stations.by_id(self.graph.id_of(station_index))
+            events.station_closed(self.steps_count, station._id, station.name)
+
+    def label_components(self, stations_indexes):
+        """
+        Labels each of the open stations, which must be whole components of
+        open stations, with the smallest index in its component, by
+        propagating labels to neighbours and following labels to their own
+        labels until nothing changes.
+        """
+        neighbours, rows = get_neighbours(
+            self.offsets, self.neighbours_indexes, stations_indexes)
+        open_neighbours = self.stations_open[neighbours]
+        propagate_labels(self.components_labels, stations_indexes,
+                         neighbours[open_neighbours], rows[open_neighbours])
+
+    def retire_unreachable_pairs(self):
+        """
+        Pairs whose cat and owner can never meet stop roaming. Like in
+        `FindTheCatGame`, this runs once the agents have moved, after
+        stations closed.
+
+        An agent can reach the component of its station, if it's open, and
+        the ones of the open neighbours of its station. Only the components
+        the stations closed since the last check were in can have split, so
+        after the first check, only they are labelled again, and only the
+        pairs with an agent that could reach one of them are checked.
+        """
+        self.reachability_check_pending = False
+        pairs_ids = self.roaming_pairs_ids
+        pairs_count = len(pairs_ids)
+        if not pairs_count:
+            return
+
+        stations_count = self.stations_count
+        # The cats and then the owners, as the rows of the same arrays
+        stations_indexes = numpy.concatenate([
+            self.cats_stations[pairs_ids], self.owners_stations[pairs_ids]])
+        neighbours, neighbours_rows = get_neighbours(
+            self.offsets, self.neighbours_indexes, stations_indexes)
+        agents_rows = numpy.concatenate([
+            numpy.arange(len(stations_indexes)), neighbours_rows])
+        reachable_stations = numpy.concatenate([stations_indexes, neighbours])
+
+        checked = numpy.ones(pairs_count, dtype=bool)
+        if self.components_labels is None:
+            self.components_labels = numpy.full(
+                stations_count, stations_count, dtype=numpy.intp)
+            self.label_components(numpy.flatnonzero(self.stations_open))
+        else:
+            labels = self.components_labels
+            closed_stations = numpy.concatenate(self.closed_stations)
+            split_labels = numpy.unique(labels[closed_stations])
+            split_labels = split_labels[split_labels < stations_count]
+            checked[:] = False
+            checked[agents_rows[numpy.in1d(labels[reachable_stations],
+                                           split_labels)] % pairs_count] = True
+            kept = checked[agents_rows % pairs_count]
+            agents_rows = agents_rows[kept]
+            reachable_stations = reachable_stations[kept]
+
+            labels[closed_stations] = stations_count
+            self.label_components(
+                numpy.flatnonzero(numpy.in1d(labels, split_labels)))
+        self.closed_stations = []
+
+        labels = self.components_labels[reachable_stations]
+        open_components = labels < stations_count
+        agents_rows = agents_rows[open_components]
+        keys = (agents_rows % pairs_count) * stations_count \
+            + labels[open_components]
+        cats = agents_rows < pairs_count
+        reachable_keys = numpy.intersect1d(keys[cats], keys[~cats])
+        reachable = numpy.zeros(pairs_count, dtype=bool)
+        reachable[reachable_keys // stations_count] = True
+
+        unreachable_pairs_ids = pairs_ids[checked & ~reachable]
+        self.roaming[unreachable_pairs_ids] = False
+        self.unreachable[unreachable_pairs_ids] = True
+
+    def get_open_neighbours(self, stations_indexes):
+        """
+        The neighbours of all the stations, one after the other, the row of
+        their station in `stations_indexes`, and which ones are open.
+        """
+        neighbours, rows = get_neighbours(
+            self.offsets, self.neighbours_indexes, stations_indexes)
+
+        return neighbours, rows, self.stations_open[neighbours]
+
+    def move_cats(self):
+        roaming_pairs_ids = self.roaming_pairs_ids
+        cats_stations = self.cats_stations[roaming_pairs_ids]
+        neighbours, rows, open_neighbours = self.get_open_neighbours(
+            cats_stations)
+        self.cats_stuck[roaming_pairs_ids] = numpy.bincount(
+            rows[open_neighbours], minlength=len(cats_stations)) == 0
+
+        self.cats_stations[roaming_pairs_ids] = pick_neighbours(
+            self.random_state, cats_stations, neighbours, rows,
+            open_neighbours)
+
+    def move_owners(self):
+        roaming_pairs_ids = self.roaming_pairs_ids
+        owners_stations = self.owners_stations[roaming_pairs_ids]
+        neighbours, rows, open_neighbours = self.get_open_neighbours(
+            owners_stations)
+
+        not_visited_open_neighbours = open_neighbours \
+            & ~self.owners_visited.contains(roaming_pairs_ids[rows], neighbours)
+        any_not_visited = numpy.bincount(
+            rows[not_visited_open_neighbours],
+            minlength=len(owners_stations)) > 0
+        possible_moves = numpy.where(any_not_visited[rows],
+                                     not_visited_open_neighbours,
+                                     open_neighbours)
+
+        next_owners_stations = pick_neighbours(
+            self.random_state, owners_stations, neighbours, rows,
+            possible_moves)
+        self.owners_stations[roaming_pairs_ids] = next_owners_stations
+        self.owners_visited.add(roaming_pairs_ids, next_owners_stations)
+
+        owners_stuck = numpy.bincount(
+            rows[open_neighbours], minlength=len(owners_stations)) == 0
+        self.retire_frozen_pairs(roaming_pairs_ids[owners_stuck])
+
+    def retire_frozen_pairs(self, pairs_ids):
+        """
+        Like `FindTheCatGame.retire_frozen_pairs`, whether reachability is
+        tracked or not: the pairs whose owner and cat both had nowhere to
+        move in this step, and aren't on the same station, can never meet.
+        Stations never reopen, so they're the ones `FindTheCatGame` finds
+        dormant.
+        """
+        frozen_pairs_ids = pairs_ids[
+            self.cats_stuck[pairs_ids]
+            & (self.cats_stations[pairs_ids]
+               != self.owners_stations[pairs_ids])]
+        self.roaming[frozen_pairs_ids] = False
+        self.unreachable[frozen_pairs_ids] = True
+
+
+class NumpyFindTheCatGames(object):
+    """
+    Many independent games over the same stations, played in lockstep.
+
+    The agents of all the games are the rows of the same arrays, game after
+    game, and the open stations are one row per game, so a single `step()`
+    advances every game at once. Only the roaming pairs take part in a step,
+    so games that are over cost nothing.
+
+    Like in `NumpyFindTheCatGame`, neighbours are looked up in the offsets
+    and neighbours indexes of the graph, and owners remember the stations
+    they visited in `VisitedBitsets`, one row per pair of each game, so that
+    memory grows with the stations owners actually visited rather than with
+    games x pairs x stations.
+
+    Like `FindTheCatGame`, each game retires its pairs whose cat and owner
+    can't reach each other anymore, so that no game keeps going until the
+    last iteration with pairs that will never meet.
+    """
+    @classmethod
+    def start_and_run(cls, stations, games_count, pairs_count,
+                      iteration_count=100000, random_state=None):
+        games = cls(stations, random_state=random_state)
+        games.start(games_count, pairs_count)
+        games.run(iteration_count=iteration_count)
+
+        return games
+
+    def __init__(self, stations, random_state=None):
+        self.stations = stations
+        self.graph = stations.graph
+        if random_state is None:
+            random_state = numpy.random.RandomState()
+        self.random_state = random_state
+        self.offsets = numpy.array(self.graph.offsets, dtype=numpy.intp)
+        self.neighbours_indexes = numpy.array(self.graph.neighbours_indexes,
+                                              dtype=numpy.intp)
+
+    @property
+    def stations_count(self):
+        return self.graph.stations_count
+
+    def start(self, games_count, pairs_count):
+        if self.stations_count < 2:
+            raise ValueError("Need at least 2 stations to place pairs")
+        self.games_count = games_count
+        self.pairs_count = pairs_count
+        self.steps_count = 0
+        self.steps_counts = numpy.zeros(games_count, dtype=numpy.intp)
+        self.stations_open = numpy.ones((games_count, self.stations_count),
+                                        dtype=bool)
+
+        agents_count = games_count * pairs_count
+        self.agents_games = numpy.repeat(numpy.arange(games_count),
+                                         pairs_count)
+        self.cats_stations = self.random_state.randint(
+            0, self.stations_count, size=agents_count)
+        self.owners_stations = self.random_state.randint(
+            0, self.stations_count - 1, size=agents_count)
+        self.owners_stations += self.owners_stations >= self.cats_stations
+        self.roaming = numpy.ones(agents_count, dtype=bool)
+        self.roaming_agents = numpy.arange(agents_count)
+        self.unreachable = numpy.zeros(agents_count, dtype=bool)
+
+        self.owners_visited = VisitedBitsets(self.owners_stations,
+                                             self.stations_count)
+
+    def run(self, iteration_count=100000):
+        for _ in xrange(iteration_count):
+            self.step()
+            if not self.roaming_pairs_exist:
+                break
+
+        # The games still going ran for all the iterations
+        self.steps_counts[self.get_roaming_pairs_counts() > 0] = \
+            self.steps_count
+
+    @property
+    def roaming_pairs_exist(self):
+        return bool(self.roaming_agents.size)
+
+    def get_roaming_pairs_counts(self):
+        return numpy.bincount(self.agents_games[self.roaming],
+                              minlength=self.games_count)
+
+    def get_cats_unreachable(self):
+        return numpy.bincount(self.agents_games[self.unreachable],
+                              minlength=self.games_count)
+
+    def get_cats_found(self):
+        return self.pairs_count - self.get_roaming_pairs_counts() \
+            - self.get_cats_unreachable()
+
+    def get_result(self, game_index):
+        cats_roaming = int(self.get_roaming_pairs_counts()[game_index])
+        cats_unreachable = int(self.get_cats_unreachable()[game_index])
+
+        return {
+            'cats_count': self.pairs_count,
+            'cats_found': self.pairs_count - cats_roaming - cats_unreachable,
+            'cats_unreachable': cats_unreachable,
+            'cats_roaming': cats_roaming,
+            'steps_count': int(self.steps_counts[game_index]),
+        }
+
+    def step(self):
+        closing_games = self.find_and_close_stations()
+        if closing_games.size:
+            self.retire_unreachable_pairs(closing_games)
+        self.move_cats()
+        self.move_owners()
+        self.steps_count += 1
+
+    def stop_roaming(self, agents):
+        """
+        `roaming_agents` only changes here, and so does which games are over,
+        which ran for the step that's going on.
+        """
+        self.roaming[agents] = False
+        self.roaming_agents = numpy.flatnonzero(self.roaming)
+
+        games = numpy.unique(self.agents_games[agents])
+        roaming_pairs_counts = numpy.bincount(
+            self.agents_games[self.roaming_agents],
+            minlength=self.games_count)
+        self.steps_counts[games[roaming_pairs_counts[games] == 0]] = \
+            self.steps_count + 1
+
+    def find_and_close_stations(self):
+        roaming_agents = self.roaming_agents
+        matched_agents = roaming_agents[
+            self.cats_stations[roaming_agents]
+            == self.owners_stations[roaming_agents]]
+        if not matched_agents.size:
+            return matched_agents
+        self.stations_open[self.agents_games[matched_agents],
+                           self.cats_stations[matched_agents]] = False
+        self.stop_roaming(matched_agents)
+
+        return numpy.unique(self.agents_games[matched_agents])
+
+    def retire_unreachable_pairs(self, games):
+        """
+        Like `NumpyFindTheCatGame.retire_unreachable_pairs`, for all the
+        given games at once: their stations are labelled together, each as
+        its row among the games times `stations_count` plus its index, so
+        that the components of different games never mix.
+        """
+        stations_count = self.stations_count
+        games_rows = numpy.full(self.games_count, -1, dtype=numpy.intp)
+        games_rows[games] = numpy.arange(len(games))
+        roaming_agents = self.roaming_agents
+        agents = roaming_agents[
+            games_rows[self.agents_games[roaming_agents]] >= 0]
+        if not agents.size:
+            return
+
+        nodes_count = len(games) * stations_count
+        nodes = numpy.flatnonzero(self.stations_open[games])
+        neighbours, rows = get_neighbours(
+            self.offsets, self.neighbours_indexes, nodes % stations_count)
+        neighbours_games_rows = nodes[rows] // stations_count
+        open_neighbours = self.stations_open[games[neighbours_games_rows],
+                                             neighbours]
+        neighbours_nodes = neighbours_games_rows * stations_count + neighbours
+        labels = numpy.full(nodes_count, nodes_count, dtype=numpy.intp)
+        propagate_labels(labels, nodes, neighbours_nodes[open_neighbours],
+                         rows[open_neighbours])
+
+        agents_count = len(agents)
+        # The cats and then the owners, as the rows of the same arrays
+        stations_indexes = numpy.concatenate([
+            self.cats_stations[agents], self.owners_stations[agents]])
+        neighbours, neighbours_rows = get_neighbours(
+            self.offsets, self.neighbours_indexes, stations_indexes)
+        agents_rows = numpy.concatenate([
+            numpy.arange(len(stations_indexes)), neighbours_rows])
+        reachable_stations = numpy.concatenate([stations_indexes, neighbours])
+        reachable_labels = labels[
+            games_rows[self.agents_games[agents]][agents_rows % agents_count]
+            * stations_count + reachable_stations]
+
+        open_components = reachable_labels < nodes_count
+        agents_rows = agents_rows[open_components]
+        keys = (agents_rows % agents_count) * nodes_count \
+            + reachable_labels[open_components]
+        cats = agents_rows < agents_count
+        reachable_keys = numpy.intersect1d(keys[cats], keys[~cats])
+        reachable = numpy.zeros(agents_count, dtype=bool)
+        reachable[reachable_keys // nodes_count] = True
+
+        unreachable_agents = agents[~reachable]
+        if unreachable_agents.size:
+            self.unreachable[unreachable_agents] = True
+            self.stop_roaming(unreachable_agents)
+
+    def get_open_neighbours(self, agents, stations_indexes):
+        """
+        Like `NumpyFindTheCatGame.get_open_neighbours`, with the open
+        stations of the game of each agent.
+        """
+        neighbours, rows = get_neighbours(
+            self.offsets, self.neighbours_indexes, stations_indexes)
+        open_neighbours = self.stations_open[self.agents_games[agents][rows],
+                                             neighbours]
+
+        return neighbours, rows, open_neighbours
+
+    def move_cats(self):
+        roaming_agents = self.roaming_agents
+        cats_stations = self.cats_stations[roaming_agents]
+        neighbours, rows, open_neighbours = self.get_open_neighbours(
+            roaming_agents, cats_stations)
+
+        self.cats_stations[roaming_agents] = pick_neighbours(
+            self.random_state, cats_stations, neighbours, rows,
+            open_neighbours)
+
+    def move_owners(self):
+        roaming_agents = self.roaming_agents
+        owners_stations = self.owners_stations[roaming_agents]
+        neighbours, rows, open_neighbours = self.get_open_neighbours(
+            roaming_agents, owners_stations)
+
+        not_visited_open_neighbours = open_neighbours \
+            & ~self.owners_visited.contains(roaming_agents[rows], neighbours)
+        any_not_visited = numpy.bincount(
+            rows[not_visited_open_neighbours],
+            minlength=len(owners_stations)) > 0
+        possible_moves = numpy.where(any_not_visited[rows],
+                                     not_visited_open_neighbours,
+                                     open_neighbours)
+
+        next_owners_stations = pick_neighbours(
+            self.random_state, owners_stations, neighbours, rows,
+            possible_moves)
+        self.owners_stations[roaming_agents] = next_owners_stations
+        self.owners_visited.add(roaming_agents, next_owners_stations)
+
+
+class VisitedBitsets(object):
+    """
+    A bitset of the stations visited per row, for the owners of the games.
+
+    The bitsets are the rows of one `uint8` array, all as wide as the widest
+    one needs to be, with the byte each one starts at in `first_bytes`: a
+    row is shifted when it gets a lower index, and all of them grow when one
+    needs more room. Once they would be half as wide as all the stations,
+    they span all of them instead, from the first byte, and never shift
+    again.
+    """
+    def __init__(self, first_indexes, bits_count):
+        self.bits_count = bits_count
+        self.bytes = numpy.zeros((len(first_indexes), 1), dtype=numpy.uint8)
+        self.first_bytes = numpy.asarray(first_indexes, dtype=numpy.intp) >> 3
+        self.add(numpy.arange(len(first_indexes)), first_indexes)
+
+    @property
+    def nbytes(self):
+        return self.bytes.nbytes + self.first_bytes.nbytes
+
+    def contains(self, rows, indexes):
+        """
+        Whether the bitset of each of the rows has the index next to it,
+        with broadcasting.
+        """
+        width = self.bytes.shape[1]
+        positions = (indexes >> 3) - self.first_bytes[rows]
+        in_window = (positions >= 0) & (positions < width)
+        visited_bytes = self.bytes[rows, positions.clip(0, width - 1)]
+
+        return in_window & ((visited_bytes >> (indexes & 7)) & 1 > 0)
+
+    def add(self, rows, indexes):
+        if not rows.size:
+            return
+
+        bytes_indexes = indexes >> 3
+        first_bytes = self.first_bytes[rows]
+        width = self.bytes.shape[1]
+        next_first_bytes = numpy.minimum(first_bytes, bytes_indexes)
+        needed_width = int((
+            numpy.maximum(first_bytes + width, bytes_indexes + 1)
+            - next_first_bytes).max())
+        if needed_width > width:
+            self.widen(needed_width)
+            first_bytes = self.first_bytes[rows]
+            next_first_bytes = numpy.minimum(first_bytes, bytes_indexes)
+
+        shifts = first_bytes - next_first_bytes
+        shifted = numpy.flatnonzero(shifts)
+        if shifted.size:
+            shift_rows(self.bytes, self.bytes, rows[shifted], shifts[shifted])
+            self.first_bytes[rows] = next_first_bytes
+
+        self.bytes[rows, bytes_indexes - next_first_bytes] |= \
+            (1 << (indexes & 7)).astype(numpy.uint8)
+
+    def widen(self, needed_width):
+        rows_count = len(self.first_bytes)
+        bytes_count = (self.bits_count + 7) >> 3
+        width = min(max(needed_width, 2 * self.bytes.shape[1]), bytes_count)
+        if 2 * width <= bytes_count:
+            visited_bytes = numpy.zeros((rows_count, width),
+                                        dtype=numpy.uint8)
+            visited_bytes[:, :self.bytes.shape[1]] = self.bytes
+        else:
+            visited_bytes = numpy.zeros((rows_count, bytes_count),
+                                        dtype=numpy.uint8)
+            shift_rows(self.bytes, visited_bytes, numpy.arange(rows_count),
+                       self.first_bytes)
+            self.first_bytes[:] = 0
+        self.bytes = visited_bytes
+
+
+def get_neighbours(offsets, neighbours_indexes, stations_indexes):
+    """
+    The neighbours of all the stations, one after the other and each in
+    graph order, with the row of their station in `stations_indexes`.
+    """
+    starts = offsets[stations_indexes]
+    degrees = offsets[stations_indexes + 1] - starts
+    rows = numpy.repeat(numpy.arange(len(stations_indexes)), degrees)
+    positions = numpy.arange(rows.size) \
+        + numpy.repeat(starts - (numpy.cumsum(degrees) - degrees), degrees)
+
+    return neighbours_indexes[positions], rows
+
+
+def pick_neighbours(random_state, stations_indexes, neighbours, rows,
+                    possible_moves):
+    """
+    Pick uniformly one of the possible moves for each agent, in one go,
+    among its neighbours as `get_neighbours` gives them. Agents without any
+    possible move stay where they are, and don't use up a random draw.
+    """
+    next_stations_indexes = stations_indexes.copy()
+    possible_positions = numpy.flatnonzero(possible_moves)
+    possible_rows = rows[possible_positions]
+    possible_moves_counts = numpy.bincount(possible_rows,
+                                           minlength=len(stations_indexes))
+    movable = numpy.flatnonzero(possible_moves_counts)
+    if not movable.size:
+        return next_stations_indexes
+
+    ranks = numpy.zeros(len(stations_indexes), dtype=numpy.intp)
+    ranks[movable] = (random_state.random_sample(movable.size)
+                      * possible_moves_counts[movable]).astype(numpy.intp)
+    # The rank of each possible move among the ones of its row
+    first_positions = numpy.cumsum(possible_moves_counts) \
+        - possible_moves_counts
+    possible_ranks = numpy.arange(possible_positions.size) \
+        - first_positions[possible_rows]
+    next_stations_indexes[movable] = neighbours[
+        possible_positions[possible_ranks == ranks[possible_rows]]]
+
+    return next_stations_indexes
+
+
+def shift_rows(source, target, rows, shifts):
+    """
+    Copies the rows of `source` to the same rows of `target`, each moved
+    right by its shift, and cleared before it. The rows are copied by
+    groups with the same shift, as slices, so that this needs no more
+    memory than the rows themselves.
+    """
+    order = numpy.argsort(shifts, kind='mergesort')
+    rows = rows[order]
+    shifts = shifts[order]
+    groups_starts = numpy.flatnonzero(numpy.diff(shifts)) + 1
+    for group_rows, shift in zip(numpy.split(rows, groups_starts),
+                                 shifts[numpy.append(0, groups_starts)]):
+        shift = int(shift)
+        copied_count = min(source.shape[1], target.shape[1] - shift)
+        if copied_count > 0:
+            target[group_rows, shift:shift + copied_count] = \
+                source[group_rows, :copied_count]
+        target[group_rows, :min(shift, target.shape[1])] = 0
+
+
+def propagate_labels(labels, nodes, neighbours, rows):
+    """
+    Labels each of the nodes, which must be whole components, with the
+    smallest node in its component, given their neighbours in the same
+    components and the row of their node in `nodes`, by propagating labels
+    to neighbours and following labels to their own labels until nothing
+    changes.
+    """
+    labels[nodes] = nodes
+    if not neighbours.size:
+        return
+
+    neighbours_counts = numpy.bincount(rows, minlength=len(nodes))
+    connected = neighbours_counts > 0
+    connected_nodes = nodes[connected]
+    segments_starts = (numpy.cumsum(neighbours_counts)
+                       - neighbours_counts)[connected]
+    while True:
+        previous_labels = labels[nodes]
+        labels[connected_nodes] = numpy.minimum(
+            labels[connected_nodes],
+            numpy.minimum.reduceat(labels[neighbours], segments_starts))
+        labels[nodes] = labels[labels[nodes]]
+        if (labels[nodes] == previous_labels).all():
+            return
@@ -0,0 +1,273 @@
+import sys
+import json
+import time
+import resource
+from random import Random
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from main import Stations, FindTheCatGame
+from events import NullEventSink
+
+
+# The best clock there is for measuring short durations
+timer = getattr(time, 'perf_counter', time.time)
+
+
+class GameProfiler(object):
+    """
+    Times the phases of each step of a `FindTheCatGame`, and counts what
+    happens in them.
+
+    It wraps the phase methods of the one game it's attached to, and only
+    while it's attached, so games that aren't profiled run exactly the same
+    code as before.
+
+    If `sample_memory` is set, memory is sampled every
+    `memory_sample_interval` steps: with `tracemalloc` when it's available,
+    and the peak resident set size of the process otherwise.
+    """
+    PHASES = (
+        'find_and_close_stations', 'move_cats', 'move_owners',
+        'retire_unreachable_pairs',
+    )
+    COUNTERS = (
+        'pairs_found', 'stations_closed', 'pairs_retired', 'cats_moved',
+        'owners_moved', 'cats_stuck', 'owners_stuck', 'candidate_moves',
+    )
+
+    def __init__(self, sample_memory=False, memory_sample_interval=100,
+                 keep_steps=True):
+        self.sample_memory = sample_memory
+        self.memory_sample_interval = memory_sample_interval
+        self.keep_steps = keep_steps
+        self.game = None
+
+        self.phases = {
+            phase: {'calls': 0, 'total_seconds': 0., 'max_seconds': 0.}
+            for phase in self.PHASES
+        }
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.steps = []
+        self.steps_count = 0
+        self.total_seconds = 0.
+        self.memory_samples = []
+        self.current_step = None
+
+    def attach(self, game):
+        if self.game is not None:
+            raise ValueError("Profiler is already attached to a game")
+        self.game = game
+        game.step = self.wrap_step(game.step)
+        game.find_and_close_stations = self.wrap_phase(
+            'find_and_close_stations', game.find_and_close_stations,
+            self.count_found)
+        game.move_cats = self.wrap_phase(
+            'move_cats', game.move_cats, self.count_cats_moves)
+        game.move_owners = self.wrap_phase(
+            'move_owners', game.move_owners, self.count_owners_moves)
+        game.retire_unreachable_pairs = self.wrap_phase(
+            'retire_unreachable_pairs', game.retire_unreachable_pairs, None)
+        if self.sample_memory and tracemalloc is not None \
+                and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        return self
+
+    def detach(self):
+        for name in ('step',) + self.PHASES:
+            del self.game.__dict__[name]
+        self.game = None
+
+    def wrap_step(self, step):
+        def profiled_step():
+            self.current_step = {
+                'step': self.game.steps_count,
+                'phases': {},
+                'counters': dict.fromkeys(self.COUNTERS, 0),
+            }
+            cats_unreachable = self.game.cats_unreachable
+            start = timer()
+            step()
+            seconds = timer() - start
+            self.add_to_counter(
+                'pairs_retired',
+                self.game.cats_unreachable - cats_unreachable)
+
+            self.current_step['seconds'] = seconds
+            self.total_seconds += seconds
+            self.steps_count += 1
+            if self.keep_steps:
+                self.steps.append(self.current_step)
+            if self.sample_memory \
+                    and self.current_step['step'] \
+                    % self.memory_sample_interval == 0:
+                self.memory_samples.append(
+                    self.get_memory_sample(self.current_step['step']))
+            self.current_step = None
+
+        return profiled_step
+
+    def wrap_phase(self, phase, method, count):
+        """
+        `count` is called before the phase runs, and returns what to call
+        once it has, to count what it did.
+        """
+        def profiled_phase(*args, **kwargs):
+            after = count() if count is not None else None
+            start = timer()
+            result = method(*args, **kwargs)
+            seconds = timer() - start
+            if after is not None:
+                after()
+
+            phase_stats = self.phases[phase]
+            phase_stats['calls'] += 1
+            phase_stats['total_seconds'] += seconds
+            phase_stats['max_seconds'] = max(phase_stats['max_seconds'],
+                                             seconds)
+            if self.current_step is not None:
+                self.current_step['phases'][phase] = \
+                    self.current_step['phases'].get(phase, 0.) + seconds
+
+            return result
+
+        return profiled_phase
+
+    def add_to_counter(self, counter, value):
+        self.counters[counter] += value
+        if self.current_step is not None:
+            self.current_step['counters'][counter] += value
+
+    def count_found(self):
+        game = self.game
+        cats_found = game.cats_found
+        closed_count = len(game.closed_indexes)
+
+        def after():
+            self.add_to_counter('pairs_found', game.cats_found - cats_found)
+            self.add_to_counter('stations_closed',
+                                len(game.closed_indexes) - closed_count)
+
+        return after
+
+    def count_cats_moves(self):
+        return self.count_moves(
+            self.game.moving_cats_pairs_ids,
+            self.game.get_cat_possible_moves_list, 'cats_moved', 'cats_stuck')
+
+    def count_owners_moves(self):
+        return self.count_moves(
+            self.game.moving_owners_pairs_ids,
+            self.game.get_owner_possible_moves_list, 'owners_moved',
+            'owners_stuck')
+
+    def count_moves(self, moving_pairs_ids, get_possible_moves_list,
+                    moved_counter, stuck_counter):
+        """
+        Agents that don't move become dormant, and leave the moving set.
+        """
+        moving_count = len(moving_pairs_ids)
+        self.add_to_counter('candidate_moves', sum(
+            len(get_possible_moves_list(pair_id))
+            for pair_id in moving_pairs_ids
+        ))
+
+        def after():
+            moved_count = len(moving_pairs_ids)
+            self.add_to_counter(moved_counter, moved_count)
+            self.add_to_counter(stuck_counter, moving_count - moved_count)
+
+        return after
+
+    def get_memory_sample(self, step):
+        if tracemalloc is not None:
+            current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+            return {
+                'step': step,
+                'current_bytes': current_bytes,
+                'peak_bytes': peak_bytes,
+            }
+
+        return {
+            'step': step,
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+    def get_report(self):
+        report = {
+            'steps_count': self.steps_count,
+            'total_seconds': self.total_seconds,
+            'phases': self.phases,
+            'counters': self.counters,
+        }
+        if self.keep_steps:
+            report['steps'] = self.steps
+        if self.sample_memory:
+            report['memory'] = self.memory_samples
+
+        return report
+
+    def write_report(self, stream):
+        json.dump(self.get_report(), stream, sort_keys=True, indent=2)
+        stream.write('\n')
+
+
+def profile_game(stations, pairs_count, seed=None, iteration_count=100000,
+                 sample_memory=False):
+    game = FindTheCatGame(stations, rng=Random(seed), events=NullEventSink())
+    profiler = GameProfiler(sample_memory=sample_memory).attach(game)
+    game.start(pairs_count)
+    game.run(iteration_count=iteration_count)
+    profiler.detach()
+
+    return game, profiler
+
+
+def main():
+    success, arguments = get_arguments()
+    if not success:
+        return
+
+    pairs_count, report_filename = arguments
+
+    stations = Stations.from_json_files("./tfl_stations.json",
+                                        "./tfl_connections.json",
+                                        snapshot_filename="./tfl.snapshot")
+    _, profiler = profile_game(stations, pairs_count, sample_memory=True)
+    if report_filename is None:
+        profiler.write_report(sys.stdout)
+    else:
+        with open(report_filename, 'w') as f:
+            profiler.write_report(f)
+
+
+def get_arguments():
+    if len(sys.argv) < 2:
+        print 'Please put the number of pairs'
+        return False, []
+
+    if len(sys.argv) > 3:
+        print 'Too many arguments - only put the number of pairs, and ' \
+            'optionally the report file'
+        return False, []
+
+    try:
+        pairs_count = int(sys.argv[1])
+    except ValueError:
+        print 'Please enter a positive numeric value for the number of pairs'
+        return False, []
+
+    if pairs_count < 1:
+        print 'Please enter a positive numeric value for the number of pairs'
+        return False, []
+
+    report_filename = sys.argv[2] if len(sys.argv) > 2 else None
+
+    return True, [pairs_count, report_filename]
+
+if __name__ == '__main__':
+    main()
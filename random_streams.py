@@ -0,0 +1,97 @@
+from itertools import chain, islice
+
+import numpy
+
+
+class RandomStream(object):
+    """
+    Uniform floats in [0, 1), generated by NumPy in blocks of `block_size`,
+    and handed out one at a time by `random`, or many at once by
+    `random_sample`.
+
+    `random` is the `next` of an iterator over the blocks, so a draw costs
+    about as much as a list lookup, and no Python code runs between two
+    blocks. `random_sample` slices the block itself, and skips the iterator
+    past what it took.
+
+    It has the parts of `random.Random` the games use, and the
+    `random_sample` of `numpy.random.RandomState`, so that it can be the
+    only source of randomness of either engine: a `FindTheCatGame` and a
+    `NumpyFindTheCatGame` given streams with the same seed play the same
+    game, as long as both track reachability or neither does.
+    """
+    def __init__(self, seed=None, block_size=64 * 1024):
+        self.block_size = block_size
+        self.random_state = numpy.random.RandomState(seed)
+        self.start_draws(self.random_state.get_state(), 0, 0)
+
+    def start_draws(self, block_state, draws_before_block, position):
+        self.random_state.set_state(block_state)
+        self.block_state = block_state
+        self.draws_before_block = draws_before_block
+        self.next_block_first_draw = draws_before_block
+        self.block = None
+        self.block_iterator = None
+        self.draws = chain.from_iterable(self.iterate_blocks())
+        self.random = self.draws.next
+        if position:
+            for _ in islice(self.draws, position):
+                pass
+
+    def iterate_blocks(self):
+        while True:
+            self.block_state = self.random_state.get_state()
+            self.draws_before_block = self.next_block_first_draw
+            self.next_block_first_draw += self.block_size
+            self.block = self.random_state.random_sample(self.block_size)
+            self.block_iterator = iter(self.block.tolist())
+            yield self.block_iterator
+
+    @property
+    def draws_used(self):
+        if self.block_iterator is None:
+            return self.draws_before_block
+        return self.next_block_first_draw \
+            - self.block_iterator.__length_hint__()
+
+    def random_sample(self, size):
+        samples = []
+        while size > 0:
+            if self.block_iterator is None \
+                    or not self.block_iterator.__length_hint__():
+                # Moves on to the next block, by taking its first draw, which
+                # is in the slice below
+                self.random()
+                taken_count = 1
+            else:
+                taken_count = 0
+            position = self.draws_used - self.draws_before_block \
+                - taken_count
+            sample = self.block[position:position + size]
+            # Skips the rest of the slice without any Python code per draw
+            skipped_count = len(sample) - taken_count
+            next(islice(self.block_iterator, skipped_count, skipped_count),
+                 None)
+            samples.append(sample)
+            size -= len(sample)
+
+        if len(samples) == 1:
+            return samples[0].copy()
+        return numpy.concatenate(samples) if samples else numpy.empty(0)
+
+    def choice(self, seq):
+        # The same as `random.Random.choice`
+        return seq[int(self.random() * len(seq))]
+
+    def getstate(self):
+        """
+        The state of the generator before the current block, and how far in
+        the block the draws are.
+        """
+        return (self.block_size, self.block_state, self.draws_before_block,
+                self.draws_used - self.draws_before_block)
+
+    def setstate(self, state):
+        block_size, block_state, draws_before_block, position = state
+        self.block_size = block_size
+        self.start_draws(block_state, draws_before_block, position)
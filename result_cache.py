@@ -0,0 +1,260 @@
+import json
+import time
+import sqlite3
+import multiprocessing
+
+from batch import run_game
+
+
+class ResultCache(object):
+    """
+    Results of seeded games, on disk, keyed by the content hash of the graph
+    and the parameters of the run, so that the same game is never run twice.
+
+    It's an SQLite database, so any number of processes can use the same
+    file at once: writes wait for each other, and reads don't block them.
+    When there are more than `max_entries` results, the ones used the least
+    recently are dropped, a hundredth of the cache at a time.
+
+    So that hits don't write, the time a result was last used is only
+    updated once it's more than `touch_interval` seconds old. Each cache
+    counts the results it adds, and only counts the rows again once that
+    goes over `max_entries`, so results other processes add can go over it
+    for a while.
+
+    `RESULTS_VERSION` is part of every key, and is to be bumped whenever the
+    rules of the game change what a seeded game does. So is the name of what
+    summarised the game along with its result, if anything did, see
+    `get_summary_name`.
+    """
+    RESULTS_VERSION = 1
+    # The version of the tables, in the database's `user_version`: caches
+    # with older tables are emptied
+    SCHEMA_VERSION = 3
+
+    def __init__(self, filename, max_entries=100000, timeout=60.,
+                 touch_interval=60.):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self.connection = sqlite3.connect(filename, timeout=timeout,
+                                          isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.create_tables()
+        self.known_entries_count = self.entries_count
+
+    def create_tables(self):
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            schema_version, = connection.execute(
+                'PRAGMA user_version').fetchone()
+            if schema_version != self.SCHEMA_VERSION:
+                connection.execute('DROP TABLE IF EXISTS results')
+            # Seeds are text: SQLite integers stop at 2 ** 63, and bigger
+            # ones would be rounded to the same REAL
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                ' results_version INTEGER NOT NULL,'
+                ' graph_hash TEXT NOT NULL,'
+                ' pairs_count INTEGER NOT NULL,'
+                ' seed TEXT NOT NULL,'
+                ' iteration_count INTEGER NOT NULL,'
+                ' summary_name TEXT NOT NULL,'
+                ' result TEXT NOT NULL,'
+                ' last_used REAL NOT NULL,'
+                ' PRIMARY KEY (results_version, graph_hash, pairs_count,'
+                '  seed, iteration_count, summary_name))')
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS results_last_used'
+                ' ON results (last_used)')
+            connection.execute(
+                'PRAGMA user_version = %d' % self.SCHEMA_VERSION)
+        except:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def close(self):
+        self.connection.close()
+
+    def get_key(self, graph_hash, pairs_count, seed, iteration_count,
+                summary_name):
+        return (self.RESULTS_VERSION, graph_hash, pairs_count, str(seed),
+                iteration_count, summary_name)
+
+    def get(self, graph_hash, pairs_count, seed, iteration_count,
+            summary_name=''):
+        key = self.get_key(graph_hash, pairs_count, seed, iteration_count,
+                           summary_name)
+        row = self.connection.execute(
+            'SELECT result, last_used FROM results WHERE results_version = ?'
+            ' AND graph_hash = ? AND pairs_count = ? AND seed = ?'
+            ' AND iteration_count = ? AND summary_name = ?', key).fetchone()
+        if row is None:
+            return None
+
+        result, last_used = row
+        now = time.time()
+        if now - last_used > self.touch_interval:
+            self.connection.execute(
+                'UPDATE results SET last_used = ? WHERE results_version = ?'
+                ' AND graph_hash = ? AND pairs_count = ? AND seed = ?'
+                ' AND iteration_count = ? AND summary_name = ?', (now,) + key)
+
+        return json.loads(result)
+
+    def put(self, graph_hash, pairs_count, seed, iteration_count, result,
+            summary_name=''):
+        key = self.get_key(graph_hash, pairs_count, seed, iteration_count,
+                           summary_name)
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                'INSERT OR REPLACE INTO results'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                key + (json.dumps(result, sort_keys=True), time.time()))
+            # Replaced results are counted too, which only makes the next
+            # count come sooner
+            self.known_entries_count += 1
+            if self.known_entries_count > self.max_entries:
+                self.evict()
+        except:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def evict(self):
+        entries_count = self.entries_count
+        if entries_count > self.max_entries:
+            kept_entries_count = self.max_entries - self.max_entries // 100
+            self.connection.execute(
+                'DELETE FROM results WHERE rowid IN (SELECT rowid FROM'
+                ' results ORDER BY last_used, rowid LIMIT ?)',
+                (entries_count - kept_entries_count,))
+            entries_count = kept_entries_count
+        self.known_entries_count = entries_count
+
+    @property
+    def entries_count(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM results').fetchone()[0]
+
+
+def get_summary_name(summarise):
+    """
+    What tells apart the results cached with the summaries of `summarise`,
+    a module level function, from the others.
+    """
+    if summarise is None:
+        return ''
+
+    return '%s.%s' % (summarise.__module__, summarise.__name__)
+
+
+def run_cached_game(stations, pairs_count, seed, iteration_count, cache,
+                    summarise=None):
+    """
+    The result of the game, from the cache if it ran before with the same
+    `summarise`. Otherwise it's run and cached, along with what `summarise`
+    returns for the game, if given, under `summary`.
+    """
+    graph_hash = stations.graph.get_content_hash()
+    summary_name = get_summary_name(summarise)
+    result = cache.get(graph_hash, pairs_count, seed, iteration_count,
+                       summary_name)
+    if result is not None:
+        return result, False
+
+    game = run_game(stations, pairs_count, seed,
+                    iteration_count=iteration_count)
+    result = game.get_result()
+    if summarise is not None:
+        result['summary'] = summarise(game)
+    cache.put(graph_hash, pairs_count, seed, iteration_count, result,
+              summary_name)
+
+    return result, True
+
+
+# The stations and cache of a sweep worker process, set once when the pool
+# starts
+worker_stations = None
+worker_cache = None
+worker_summarise = None
+
+
+def initialise_worker(stations, cache_filename, max_entries, summarise):
+    global worker_stations, worker_cache, worker_summarise
+    worker_stations = stations
+    worker_cache = ResultCache(cache_filename, max_entries=max_entries)
+    worker_summarise = summarise
+
+
+def run_worker_cell(cell):
+    pairs_count, seed, iteration_count = cell
+    result, _ = run_cached_game(worker_stations, pairs_count, seed,
+                                iteration_count, worker_cache,
+                                summarise=worker_summarise)
+
+    return cell, result
+
+
+class Sweep(object):
+    """
+    Runs a game for every combination of pairs counts and seeds, skipping
+    the ones already in the cache. Workers write their results to the cache
+    as soon as they have them, so an interrupted sweep loses nothing.
+    """
+    def __init__(self, stations, cache_filename, max_entries=100000,
+                 processes=None, summarise=None):
+        self.stations = stations
+        self.cache_filename = cache_filename
+        self.max_entries = max_entries
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        # Must be a module level function, if there are several processes
+        self.summarise = summarise
+        self.computed_cells_count = 0
+
+    def run(self, pairs_counts, seeds, iteration_count=100000):
+        cells = [
+            (pairs_count, seed, iteration_count)
+            for pairs_count in pairs_counts
+            for seed in seeds
+        ]
+
+        graph_hash = self.stations.graph.get_content_hash()
+        summary_name = get_summary_name(self.summarise)
+        cache = ResultCache(self.cache_filename, max_entries=self.max_entries)
+        results = {}
+        missing_cells = []
+        try:
+            for cell in cells:
+                pairs_count, seed, iteration_count = cell
+                result = cache.get(graph_hash, pairs_count, seed,
+                                   iteration_count, summary_name)
+                if result is None:
+                    missing_cells.append(cell)
+                else:
+                    results[(pairs_count, seed)] = result
+        finally:
+            cache.close()
+
+        self.computed_cells_count = len(missing_cells)
+        if missing_cells:
+            pool = multiprocessing.Pool(
+                self.processes, initializer=initialise_worker,
+                initargs=(self.stations, self.cache_filename,
+                          self.max_entries, self.summarise))
+            try:
+                for (pairs_count, seed, _), result in pool.imap_unordered(
+                        run_worker_cell, missing_cells):
+                    results[(pairs_count, seed)] = result
+            finally:
+                pool.close()
+                pool.join()
+
+        return results
@@ -0,0 +1,577 @@
+import sys
+import multiprocessing
+from array import array
+from collections import deque
+from random import Random
+
+from main import Stations, FindTheCatGame, draw_stations_indexes_pairs
+from events import NullEventSink
+
+
+MASK_64 = (1 << 64) - 1
+
+
+def get_move_draw(seed, step, agent_id):
+    """
+    A float in [0, 1) that only depends on the seed, the step and the agent
+    (`2 * pair_id` for a cat, `2 * pair_id + 1` for an owner), mixed with the
+    finaliser of SplitMix64. Moves don't depend on the order agents move in,
+    so it doesn't matter which process moves which agent.
+    """
+    z = (seed + agent_id * 0x9E3779B97F4A7C15
+         + step * 0xD1B54A32D192ED03) & MASK_64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK_64
+    z ^= z >> 31
+
+    return (z >> 11) * (1. / (1 << 53))
+
+
+def partition_by_index_range(graph, regions_count):
+    """
+    The region of each station, by index: consecutive ranges of indexes of
+    about the same size.
+    """
+    stations_count = graph.stations_count
+    return array('l', [
+        index * regions_count // stations_count
+        for index in xrange(stations_count)
+    ])
+
+
+def partition_by_breadth_first_order(graph, regions_count):
+    """
+    Like `partition_by_index_range`, but over the order a breadth-first
+    search visits the stations in, so that regions are mostly made of
+    stations close to each other, and few agents cross between regions.
+    """
+    stations_count = graph.stations_count
+    regions_ids = array('l', [-1]) * stations_count
+    visited_count = 0
+    for start_index in xrange(stations_count):
+        if regions_ids[start_index] != -1:
+            continue
+        regions_ids[start_index] = visited_count * regions_count \
+            // stations_count
+        visited_count += 1
+        indexes_to_visit = deque([start_index])
+        while indexes_to_visit:
+            index = indexes_to_visit.popleft()
+            for neighbour_index in graph.get_neighbours_indexes(index):
+                if regions_ids[neighbour_index] == -1:
+                    regions_ids[neighbour_index] = visited_count \
+                        * regions_count // stations_count
+                    visited_count += 1
+                    indexes_to_visit.append(neighbour_index)
+
+    return regions_ids
+
+
+PARTITIONERS = {
+    'index_range': partition_by_index_range,
+    'breadth_first': partition_by_breadth_first_order,
+}
+
+
+class Region(object):
+    """
+    The agents on the stations of one region, and which stations are closed
+    in the whole network, which is all it takes to move them.
+
+    Owners take the stations they visited with them when they go to another
+    region, as the same windowed bitset as `FindTheCatGame` uses.
+    """
+    def __init__(self, graph, regions_ids, region_id, seed):
+        self.offsets = graph.offsets
+        self.neighbours_indexes = graph.neighbours_indexes
+        self.regions_ids = regions_ids
+        self.region_id = region_id
+        self.seed = seed
+        self.closed = bytearray(graph.stations_count)
+        self.cats_indexes = {}
+        self.owners_indexes = {}
+        self.owners_visited = {}
+        self.owners_visited_first_bytes = {}
+
+    def add_agents(self, cats, owners):
+        for pair_id, index in cats:
+            self.cats_indexes[pair_id] = index
+        for pair_id, index, first_byte, visited in owners:
+            self.owners_indexes[pair_id] = index
+            self.owners_visited[pair_id] = bytearray(visited)
+            self.owners_visited_first_bytes[pair_id] = first_byte
+
+    def remove_pairs(self, pairs_ids):
+        for pair_id in pairs_ids:
+            self.cats_indexes.pop(pair_id, None)
+            if self.owners_indexes.pop(pair_id, None) is not None:
+                del self.owners_visited[pair_id]
+                del self.owners_visited_first_bytes[pair_id]
+
+    def find_matches(self, cats, owners, retired_pairs_ids):
+        """
+        Takes in the agents that came from other regions, and takes the
+        retired pairs off the map, and returns the pairs whose cat and owner
+        are on the same station, with the station, after taking them off the
+        map too. Both agents of a pair on the same station are always in the
+        same region.
+        """
+        self.add_agents(cats, owners)
+        self.remove_pairs(retired_pairs_ids)
+        cats_indexes = self.cats_indexes
+        matches = sorted(
+            (pair_id, index)
+            for pair_id, index in self.owners_indexes.iteritems()
+            if cats_indexes.get(pair_id) == index
+        )
+        self.remove_pairs(pair_id for pair_id, _ in matches)
+
+        return matches
+
+    def get_open_neighbours(self, index):
+        closed = self.closed
+        return [
+            neighbour_index
+            for neighbour_index in self.neighbours_indexes[
+                self.offsets[index]:self.offsets[index + 1]]
+            if not closed[neighbour_index]
+        ]
+
+    def move_agents(self, step, closed_indexes):
+        """
+        Closes the stations closed in this step, in every region, and moves
+        the agents. The ones that left the region are returned, by the region
+        they went to, along with the cats and the owners that had nowhere to
+        move, and the stations they're stuck on, by pair id.
+        """
+        for index in closed_indexes:
+            self.closed[index] = 1
+
+        seed = self.seed
+        regions_ids = self.regions_ids
+        region_id = self.region_id
+        emigrants = {}
+        stuck_cats_indexes = {}
+        stuck_owners_indexes = {}
+
+        cats_indexes = self.cats_indexes
+        for pair_id, index in cats_indexes.items():
+            possible_moves = self.get_open_neighbours(index)
+            if not possible_moves:
+                stuck_cats_indexes[pair_id] = index
+                continue
+            index = possible_moves[int(get_move_draw(
+                seed, step, 2 * pair_id) * len(possible_moves))]
+            if regions_ids[index] == region_id:
+                cats_indexes[pair_id] = index
+            else:
+                del cats_indexes[pair_id]
+                emigrants.setdefault(regions_ids[index], ([], []))[0].append(
+                    (pair_id, index))
+
+        owners_indexes = self.owners_indexes
+        for pair_id, index in owners_indexes.items():
+            possible_moves = self.get_open_neighbours(index)
+            if not possible_moves:
+                stuck_owners_indexes[pair_id] = index
+                continue
+            visited = self.owners_visited[pair_id]
+            first_byte = self.owners_visited_first_bytes[pair_id]
+            not_visited_moves = [
+                move
+                for move in possible_moves
+                if not has_visited(visited, first_byte, move)
+            ]
+            if not_visited_moves:
+                possible_moves = not_visited_moves
+            index = possible_moves[int(get_move_draw(
+                seed, step, 2 * pair_id + 1) * len(possible_moves))]
+            first_byte = mark_visited(visited, first_byte, index)
+            if regions_ids[index] == region_id:
+                owners_indexes[pair_id] = index
+                self.owners_visited_first_bytes[pair_id] = first_byte
+            else:
+                del owners_indexes[pair_id]
+                del self.owners_visited[pair_id]
+                del self.owners_visited_first_bytes[pair_id]
+                emigrants.setdefault(regions_ids[index], ([], []))[1].append(
+                    (pair_id, index, first_byte, str(visited)))
+
+        return emigrants, stuck_cats_indexes, stuck_owners_indexes
+
+    def get_agents(self, cats, owners, retired_pairs_ids):
+        self.add_agents(cats, owners)
+        self.remove_pairs(retired_pairs_ids)
+        return self.cats_indexes, self.owners_indexes
+
+
+def has_visited(visited, first_byte, index):
+    position = (index >> 3) - first_byte
+    return 0 <= position < len(visited) \
+        and bool(visited[position] & (1 << (index & 7)))
+
+
+def mark_visited(visited, first_byte, index):
+    """
+    Returns the byte the bitset now starts at.
+    """
+    byte_index = index >> 3
+    if byte_index < first_byte:
+        visited[0:0] = bytearray(first_byte - byte_index)
+        first_byte = byte_index
+    position = byte_index - first_byte
+    if position >= len(visited):
+        visited.extend(bytearray(position + 1 - len(visited)))
+    visited[position] |= 1 << (index & 7)
+
+    return first_byte
+
+
+class LocalRegion(object):
+    """
+    A region run in this process, with the same interface as
+    `RegionProcess`.
+    """
+    def __init__(self, region):
+        self.region = region
+        self.result = None
+
+    def send(self, method, *args):
+        self.result = getattr(self.region, method)(*args)
+
+    def receive(self):
+        return self.result
+
+    def stop(self):
+        pass
+
+
+def serve_region(connection, region):
+    while True:
+        method, args = connection.recv()
+        if method is None:
+            break
+        connection.send(getattr(region, method)(*args))
+    connection.close()
+
+
+class RegionProcess(object):
+    """
+    A region run in its own process. Calls are sent to all the regions
+    before any of the results are received, so that they run in parallel.
+    """
+    def __init__(self, region):
+        self.connection, child_connection = multiprocessing.Pipe()
+        # The region, graph included, is inherited when the process forks
+        self.process = multiprocessing.Process(
+            target=serve_region, args=(child_connection, region))
+        self.process.daemon = True
+        self.process.start()
+        child_connection.close()
+
+    def send(self, method, *args):
+        self.connection.send((method, args))
+
+    def receive(self):
+        return self.connection.recv()
+
+    def stop(self):
+        self.connection.send((None, ()))
+        self.process.join()
+        self.connection.close()
+
+
+class ShardedFindTheCatGame(object):
+    """
+    A single game split between regions of the network, each with its own
+    worker process that only moves the agents on its stations.
+
+    A step takes two rounds between this process and the workers: first,
+    the agents that crossed into a region in the previous step are handed
+    to it, and each region finds its matches; then the stations those
+    closed are sent to every region, which moves its agents, and returns the
+    ones that crossed into other regions.
+
+    Moves are drawn with `get_move_draw`, so the game is the same whatever
+    the number of regions, and the same as a `HashedMovesFindTheCatGame`
+    with the same seed. Reachability isn't tracked: pairs that can't meet
+    roam until the last iteration, unless both their cat and their owner are
+    stuck on stations without open neighbours, which the regions report
+    after moving their agents, and which is all it takes to retire them.
+    """
+    @classmethod
+    def start_and_run(cls, stations, pairs_count, regions_count, seed=0,
+                      iteration_count=100000, partition='breadth_first',
+                      use_processes=True, events=None):
+        game = cls(stations, regions_count, seed=seed, partition=partition,
+                   use_processes=use_processes, events=events)
+        try:
+            game.start(pairs_count)
+            game.run(iteration_count=iteration_count)
+        finally:
+            game.stop()
+
+        return game
+
+    def __init__(self, stations, regions_count, seed=0,
+                 partition='breadth_first', use_processes=True, events=None):
+        self.stations = stations
+        if events is None:
+            events = NullEventSink()
+        self.events = events
+        self.graph = stations.graph
+        self.regions_count = regions_count
+        self.seed = seed
+        self.use_processes = use_processes
+        self.regions_ids = PARTITIONERS[partition](self.graph, regions_count)
+        self.regions = []
+
+    def start(self, pairs_count, stations_pairs_ids=None):
+        if stations_pairs_ids is None:
+            cats_indexes, owners_indexes = draw_stations_indexes_pairs(
+                Random(self.seed).random, self.graph.stations_count,
+                pairs_count)
+        else:
+            index_of = self.graph.index_of
+            cats_indexes = array('l')
+            owners_indexes = array('l')
+            for cat_station_id, owner_station_id in stations_pairs_ids:
+                cats_indexes.append(index_of(cat_station_id))
+                owners_indexes.append(index_of(owner_station_id))
+
+        self.pairs_count = len(cats_indexes)
+        self.steps_count = 0
+        self.found_steps = {}
+        self.unreachable_pairs_ids = set()
+        # Taken off the map by the regions with the next call
+        self.retired_pairs_ids = []
+        self.incoming_agents = [([], []) for _ in xrange(self.regions_count)]
+        for pair_id, (cat_index, owner_index) in enumerate(
+                zip(cats_indexes, owners_indexes)):
+            cats, owners = self.incoming_agents[self.regions_ids[cat_index]]
+            cats.append((pair_id, cat_index))
+            cats, owners = self.incoming_agents[self.regions_ids[owner_index]]
+            owners.append((pair_id, owner_index, owner_index >> 3,
+                           chr(1 << (owner_index & 7))))
+
+        for region_id in xrange(self.regions_count):
+            region = Region(self.graph, self.regions_ids, region_id,
+                            self.seed)
+            if self.use_processes:
+                self.regions.append(RegionProcess(region))
+            else:
+                self.regions.append(LocalRegion(region))
+
+    def stop(self):
+        for region in self.regions:
+            region.stop()
+        self.regions = []
+
+    def run(self, iteration_count=100000):
+        for _ in xrange(iteration_count):
+            self.step()
+            if not self.roaming_pairs_exist:
+                break
+
+        self.events.run_finished(self.steps_count, self.cats_count,
+                                 self.cats_found, self.cats_unreachable)
+
+    def step(self):
+        for region, (cats, owners) in zip(self.regions,
+                                          self.incoming_agents):
+            region.send('find_matches', cats, owners, self.retired_pairs_ids)
+        self.retired_pairs_ids = []
+        matches = []
+        for region in self.regions:
+            matches.extend(region.receive())
+        closed_indexes = sorted({index for _, index in matches})
+        self.add_matches(sorted(matches), closed_indexes)
+
+        for region in self.regions:
+            region.send('move_agents', self.steps_count, closed_indexes)
+        self.incoming_agents = [([], []) for _ in xrange(self.regions_count)]
+        stuck_cats_indexes = {}
+        stuck_owners_indexes = {}
+        for region in self.regions:
+            emigrants, region_stuck_cats_indexes, \
+                region_stuck_owners_indexes = region.receive()
+            for region_id, (cats, owners) in emigrants.iteritems():
+                self.incoming_agents[region_id][0].extend(cats)
+                self.incoming_agents[region_id][1].extend(owners)
+            stuck_cats_indexes.update(region_stuck_cats_indexes)
+            stuck_owners_indexes.update(region_stuck_owners_indexes)
+        self.retire_frozen_pairs(stuck_cats_indexes, stuck_owners_indexes)
+
+        self.events.step_completed(self.steps_count, self.roaming_pairs_count)
+        self.steps_count += 1
+
+    def retire_frozen_pairs(self, stuck_cats_indexes, stuck_owners_indexes):
+        """
+        Like in `FindTheCatGame`, pairs whose cat and owner are both stuck,
+        on different stations, can never meet. Stations never reopen, so the
+        agents stuck in this step are the ones it has as dormant.
+        """
+        frozen_pairs_ids = sorted(
+            pair_id
+            for pair_id, index in stuck_owners_indexes.iteritems()
+            if stuck_cats_indexes.get(pair_id, index) != index
+        )
+        self.unreachable_pairs_ids.update(frozen_pairs_ids)
+        self.retired_pairs_ids.extend(frozen_pairs_ids)
+
+    def add_matches(self, matches, closed_indexes):
+        events = self.events
+        for pair_id, index in matches:
+            self.found_steps[pair_id] = self.steps_count
+            if events.enabled:
+                station = self.stations.by_id(self.graph.id_of(index))
+                events.pair_found(self.steps_count, pair_id, station._id,
+                                  station.name)
+        for index in closed_indexes:
+            station = self.stations.by_id(self.graph.id_of(index))
+            events.station_closed(self.steps_count, station._id, station.name)
+
+    def get_roaming_positions(self):
+        cats_indexes, owners_indexes = self.get_agents_indexes()
+
+        return {
+            pair_id: (cat_index, owners_indexes[pair_id])
+            for pair_id, cat_index in cats_indexes.iteritems()
+        }
+
+    def get_agents_indexes(self):
+        """
+        The station index of every cat and owner still on the map, by pair
+        id.
+        """
+        for region, (cats, owners) in zip(self.regions,
+                                          self.incoming_agents):
+            region.send('get_agents', cats, owners, self.retired_pairs_ids)
+        self.retired_pairs_ids = []
+        self.incoming_agents = [([], []) for _ in xrange(self.regions_count)]
+        cats_indexes, owners_indexes = {}, {}
+        for region in self.regions:
+            region_cats_indexes, region_owners_indexes = region.receive()
+            cats_indexes.update(region_cats_indexes)
+            owners_indexes.update(region_owners_indexes)
+
+        return cats_indexes, owners_indexes
+
+    @property
+    def cats_count(self):
+        return self.pairs_count
+
+    @property
+    def cats_found(self):
+        return len(self.found_steps)
+
+    @property
+    def cats_unreachable(self):
+        return len(self.unreachable_pairs_ids)
+
+    @property
+    def roaming_pairs_count(self):
+        return self.pairs_count - self.cats_found - self.cats_unreachable
+
+    @property
+    def roaming_pairs_exist(self):
+        return bool(self.roaming_pairs_count)
+
+    def get_result(self):
+        return {
+            'cats_count': self.cats_count,
+            'cats_found': self.cats_found,
+            'cats_unreachable': self.cats_unreachable,
+            'cats_roaming': self.roaming_pairs_count,
+            'steps_count': self.steps_count,
+        }
+
+
+class HashedMovesFindTheCatGame(FindTheCatGame):
+    """
+    A `FindTheCatGame` that moves its agents with `get_move_draw`, like a
+    `ShardedFindTheCatGame` does: given the same seed, the two play the same
+    game, which makes this the single process reference of sharded games.
+    """
+    def __init__(self, stations, seed=0, events=None):
+        super(HashedMovesFindTheCatGame, self).__init__(
+            stations, rng=Random(seed), events=events,
+            track_reachability=False)
+        self.seed = seed
+
+    def move_cats(self):
+        stuck_pairs_ids = []
+        for pair_id in self.moving_cats_pairs_ids:
+            possible_game_stations = self.get_cat_possible_moves_list(pair_id)
+            if not possible_game_stations:
+                stuck_pairs_ids.append(pair_id)
+                continue
+
+            possible_game_stations[int(get_move_draw(
+                self.seed, self.steps_count, 2 * pair_id)
+                * len(possible_game_stations))].put_cat(pair_id)
+
+        if stuck_pairs_ids:
+            self.make_cats_dormant(stuck_pairs_ids)
+
+    def move_owners(self):
+        stuck_pairs_ids = []
+        for pair_id in self.moving_owners_pairs_ids:
+            possible_game_stations = self.get_owner_possible_moves_list(
+                pair_id)
+            if not possible_game_stations:
+                stuck_pairs_ids.append(pair_id)
+                continue
+
+            possible_game_stations[int(get_move_draw(
+                self.seed, self.steps_count, 2 * pair_id + 1)
+                * len(possible_game_stations))].put_owner(pair_id)
+
+        if stuck_pairs_ids:
+            self.make_owners_dormant(stuck_pairs_ids)
+
+
+def main():
+    success, arguments = get_arguments()
+    if not success:
+        return
+
+    pairs_count, regions_count = arguments
+
+    stations = Stations.from_json_files("./tfl_stations.json",
+                                        "./tfl_connections.json",
+                                        snapshot_filename="./tfl.snapshot")
+    game = ShardedFindTheCatGame.start_and_run(stations, pairs_count,
+                                               regions_count)
+
+    print 'Total number of cats:', game.cats_count
+    print 'Number of cats found:', game.cats_found
+    print 'Number of steps:', game.steps_count
+
+
+def get_arguments():
+    if len(sys.argv) < 3:
+        print 'Please put the number of pairs and the number of regions'
+        return False, []
+
+    if len(sys.argv) > 3:
+        print 'Too many arguments - only put the number of pairs and the ' \
+            'number of regions'
+        return False, []
+
+    try:
+        pairs_count, regions_count = map(int, sys.argv[1:3])
+    except ValueError:
+        print 'Please enter numeric values for the number of pairs and the ' \
+            'number of regions'
+        return False, []
+
+    if pairs_count < 1 or regions_count < 1:
+        print 'Please enter positive numeric values for the number of ' \
+            'pairs and the number of regions'
+        return False, []
+
+    return True, [pairs_count, regions_count]
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+import os
+import mmap
+import struct
+import binascii
+from array import array
+from bisect import bisect_left
+
+from main import StationsGraph, SnapshotError
+
+
+SHARED_MEMORY_DIRECTORY = '/dev/shm'
+
+
+def get_shared_graph_filename(graph, directory=SHARED_MEMORY_DIRECTORY):
+    return os.path.join(directory,
+                        'find-the-cat-%s.graph' % graph.get_content_hash())
+
+
+def export_graph(graph, filename=None):
+    """
+    Writes the graph, as a snapshot, to a file in shared memory for
+    `attach_graph` to map, and returns its name. The name only depends on
+    the content of the graph, so exporting the same graph again reuses the
+    file, once its header says it has the same content hash. There are no
+    sources to hash.
+    """
+    if filename is None:
+        filename = get_shared_graph_filename(graph)
+    try:
+        attach_graph(filename, content_hash=graph.get_content_hash())
+    except (IOError, SnapshotError):
+        graph.save_snapshot(filename, StationsGraph.MISSING_HASH)
+
+    return filename
+
+
+def attach_graph(filename, content_hash=None):
+    """
+    Maps the snapshot in the file, which must have the content hash of its
+    graph in its header, and the given one, if any.
+    """
+    return SharedStationsGraph(filename, content_hash=content_hash)
+
+
+def attach_stations(filename, content_hash=None):
+    return SharedStations(attach_graph(filename, content_hash=content_hash))
+
+
+def remove_graph(filename):
+    """
+    Graphs already attached stay mapped until they're garbage collected.
+    """
+    os.remove(filename)
+
+
+class SharedArray(object):
+    """
+    A read-only view of native longs in a buffer, indexed like the `array`
+    it stands for, without copying it.
+    """
+    ITEM = struct.Struct('l')
+
+    def __init__(self, buffer, position, length):
+        self.buffer = buffer
+        self.position = position
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            values = array('l')
+            if stop > start:
+                values.fromstring(self.buffer[
+                    self.position + start * self.ITEM.size:
+                    self.position + stop * self.ITEM.size])
+            if step != 1:
+                values = values[::step]
+            return values
+
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("SharedArray index out of range")
+        return self.ITEM.unpack_from(
+            self.buffer, self.position + index * self.ITEM.size)[0]
+
+    def __iter__(self, chunk_length=64 * 1024):
+        for start in xrange(0, self.length, chunk_length):
+            for value in self[start:start + chunk_length]:
+                yield value
+
+
+class SharedNames(object):
+    """
+    A read-only view of the names in a snapshot, decoded when they're read.
+    """
+    def __init__(self, buffer, names_offsets, position):
+        self.buffer = buffer
+        self.names_offsets = names_offsets
+        self.position = position
+
+    def __len__(self):
+        return len(self.names_offsets) - 1
+
+    def __getitem__(self, index):
+        start, end = self.names_offsets[index:index + 2]
+        return self.buffer[self.position + start:
+                           self.position + end].decode('utf-8')
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self[index]
+
+
+class SharedStationsGraph(StationsGraph):
+    """
+    A `StationsGraph` whose arrays are views of a snapshot mapped read-only
+    in memory, so any number of processes can attach to the same one, and
+    share its pages.
+
+    Ids are sorted, so indexes are looked up by bisection, instead of in a
+    dict of every id. It pickles as the name of its file and its content
+    hash, and attaches to it again when unpickled, if it still holds the
+    same graph.
+    """
+    OFFSETS_PAIR = struct.Struct('2l')
+
+    def __init__(self, filename, content_hash=None):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            try:
+                self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError("Snapshot %s is empty" % filename)
+        self.sources_hash, snapshot_content_hash, arrays_positions, \
+            (names_position, _) = self.get_snapshot_layout(self.buffer)
+        if snapshot_content_hash == self.MISSING_HASH:
+            raise SnapshotError("Snapshot %s has no content hash" % filename)
+        if content_hash is not None \
+                and binascii.unhexlify(content_hash) != snapshot_content_hash:
+            raise SnapshotError("Snapshot %s is of another graph" % filename)
+
+        self.ids, self.offsets, self.neighbours_indexes, names_offsets = [
+            SharedArray(self.buffer, position, length)
+            for position, length in arrays_positions
+        ]
+        self.names = SharedNames(self.buffer, names_offsets, names_position)
+        self._components_ids = None
+        self._blocks_ids = None
+        self._shared_blocks_ids = None
+        self._blocks_components_ids = set()
+        self._blocks_count = 0
+        self._content_hash = binascii.hexlify(snapshot_content_hash)
+
+    def __reduce__(self):
+        return attach_graph, (self.filename, self._content_hash)
+
+    def index_of(self, _id):
+        index = bisect_left(self.ids, _id)
+        if index == len(self.ids) or self.ids[index] != _id:
+            raise KeyError(_id)
+        return index
+
+    def get_neighbours_indexes(self, index):
+        start, end = self.OFFSETS_PAIR.unpack_from(
+            self.buffer,
+            self.offsets.position + index * SharedArray.ITEM.size)
+        return self.neighbours_indexes[start:end]
+
+    def get_degree(self, index):
+        start, end = self.OFFSETS_PAIR.unpack_from(
+            self.buffer,
+            self.offsets.position + index * SharedArray.ITEM.size)
+        return end - start
+
+
+class SharedStation(object):
+    """
+    What games need of a `Station`, read from a shared graph when asked for.
+    """
+    __slots__ = ('_id', 'index', 'stations')
+
+    def __init__(self, _id, index, stations):
+        self._id = _id
+        self.index = index
+        self.stations = stations
+
+    def __repr__(self):
+        return '<Station %s>' % self._id
+
+    @property
+    def name(self):
+        return self.stations.graph.names[self.index]
+
+    @property
+    def connections(self):
+        return {
+            self.stations.by_id(_id)
+            for _id in self.stations.get_neighbours_ids(self._id)
+        }
+
+
+class SharedStations(object):
+    """
+    A read-only `Stations` over a `SharedStationsGraph`: stations are only
+    created when they're asked for, so attaching costs next to nothing,
+    whatever the size of the network.
+    """
+    def __init__(self, graph):
+        self.graph = graph
+        self.stations_by_id = {}
+
+    def __reduce__(self):
+        return attach_stations, (self.graph.filename,
+                                 self.graph.get_content_hash())
+
+    @property
+    def stations_count(self):
+        return self.graph.stations_count
+
+    def by_id(self, _id):
+        station = self.stations_by_id.get(_id)
+        if station is None:
+            station = SharedStation(_id, self.graph.index_of(_id), self)
+            self.stations_by_id[_id] = station
+
+        return station
+
+    @property
+    def iterate_stations(self):
+        for _id in self.graph.ids:
+            yield self.by_id(_id)
+
+    @property
+    def stations_list(self):
+        return list(self.iterate_stations)
+
+    def get_neighbours_ids(self, _id):
+        graph = self.graph
+        return [
+            graph.id_of(neighbour_index)
+            for neighbour_index
+            in graph.get_neighbours_indexes(graph.index_of(_id))
+        ]
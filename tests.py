@@ -1,6 +1,33 @@
-from unittest import TestCase, main as unittest_main
+import os
+import json
+import socket
+import shutil
+import tempfile
+import threading
+from random import Random
+from StringIO import StringIO
+from cPickle import dumps, loads
+from unittest import TestCase, skipIf, main as unittest_main
 
 import main
+import batch
+import events
+import benchmark
+import checkpoint
+import profiling
+import shared_graph
+import sharded
+import daemon
+import game_statistics
+import result_cache
+import verification
+
+try:
+    import numpy_game
+    import random_streams
+except ImportError:
+    numpy_game = None
+    random_streams = None
 
 
 class StationsFactory(object):
@@ -85,17 +112,19 @@ class GameFactory(object):
     )
 
     @classmethod
-    def create_game(cls, stations=None):
+    def create_game(cls, stations=None, event_sink=None):
         if not stations:
             stations = StationsFactory\
                 .create_stations_with_json_stations_and_connections()
+        if event_sink is None:
+            event_sink = events.NullEventSink()
 
-        return main.FindTheCatGame(stations)
+        return main.FindTheCatGame(stations, events=event_sink)
 
     @classmethod
     def create_and_start_game(cls, stations=None, pairs_count=None,
-                              stations_pairs_ids=None):
-        game = cls.create_game(stations=stations)
+                              stations_pairs_ids=None, event_sink=None):
+        game = cls.create_game(stations=stations, event_sink=event_sink)
         if pairs_count is None:
             pairs_count = cls.PAIRS_COUNT
             if stations_pairs_ids is None:
@@ -156,6 +185,217 @@ class TestConnections(TestCase):
         self.assertNotIn(station_2, station_3.connections)
 
 
+class TestStationsGraph(TestCase):
+    def setUp(self):
+        self.stations = StationsFactory\
+            .create_stations_with_json_stations_and_connections()
+
+    def test_stations_get_dense_indexes_in_the_order_of_their_ids(self):
+        graph = self.stations.graph
+
+        self.assertEquals(graph.stations_count, self.stations.stations_count)
+        self.assertEquals(list(graph.ids), sorted(StationsFactory.STATIONS_IDS))
+        for index, _id in enumerate(sorted(StationsFactory.STATIONS_IDS)):
+            self.assertEquals(graph.index_of(_id), index)
+            self.assertEquals(graph.id_of(index), _id)
+
+    def test_graph_neighbours_match_connections(self):
+        for station in self.stations.iterate_stations:
+            self.assertEquals(
+                set(self.stations.get_neighbours_ids(station._id)),
+                {
+                    connected_station._id
+                    for connected_station in station.connections
+                })
+
+    def test_graph_is_shared_until_stations_change(self):
+        graph = self.stations.graph
+        self.assertIs(self.stations.graph, graph)
+
+        station_2 = self.stations.by_id(StationsFactory.STATION_2_ID)
+        station_3 = self.stations.by_id(StationsFactory.STATION_3_ID)
+        station_2.connect_with(station_3)
+        self.assertIsNot(self.stations.graph, graph)
+        self.assertIn(StationsFactory.STATION_3_ID,
+                      self.stations.get_neighbours_ids(
+                          StationsFactory.STATION_2_ID))
+
+    def test_games_share_the_stations_graph(self):
+        game, _ = GameFactory.create_and_start_game(stations=self.stations)
+        other_game, _ = GameFactory.create_and_start_game(
+            stations=self.stations)
+
+        self.assertIs(game.graph, self.stations.graph)
+        self.assertIs(other_game.graph, self.stations.graph)
+
+
+class TestStreamingLoader(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.stations_filename = os.path.join(self.directory, 'stations.json')
+        self.connections_filename = os.path.join(self.directory,
+                                                 'connections.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load_graph(self, stations_json, connections_json, report=None):
+        with open(self.stations_filename, 'w') as f:
+            json.dump(stations_json, f)
+        with open(self.connections_filename, 'w') as f:
+            json.dump(connections_json, f, indent=2)
+
+        return main.StationsGraph.from_json_files(
+            self.stations_filename, self.connections_filename, report=report)
+
+    def test_iterating_json_array_in_small_chunks(self):
+        text = ' [ ["1", "London Bridge"], [22, 333] ,[] ] '
+        for chunk_size in (1, 2, 3, 1000):
+            self.assertEquals(
+                list(main.iterate_json_array(StringIO(text),
+                                             chunk_size=chunk_size)),
+                json.loads(text))
+
+    def test_iterating_invalid_json_array(self):
+        for text in ('', '{}', '[1 2]', '[1,]', '[1, 2'):
+            with self.assertRaises(ValueError):
+                list(main.iterate_json_array(StringIO(text), chunk_size=2))
+
+    def test_graph_matches_the_one_of_the_loaded_stations(self):
+        graph = self.load_graph(StationsFactory.STATIONS_JSON,
+                                StationsFactory.CONNECTIONS_JSON)
+        expected_graph = StationsFactory\
+            .create_stations_with_json_stations_and_connections().graph
+
+        self.assertEquals(list(graph.ids), list(expected_graph.ids))
+        self.assertEquals(list(graph.offsets), list(expected_graph.offsets))
+        self.assertEquals(list(graph.neighbours_indexes),
+                          list(expected_graph.neighbours_indexes))
+        self.assertEquals(graph.names, expected_graph.names)
+
+    def test_bad_connections_are_reported_and_skipped(self):
+        report = main.LoadReport(stream=StringIO())
+        graph = self.load_graph(
+            StationsFactory.STATIONS_JSON,
+            StationsFactory.CONNECTIONS_JSON + [
+                [StationsFactory.STATION_2_ID_STR,
+                 StationsFactory.STATION_1_ID_STR],
+                [StationsFactory.STATION_3_ID_STR,
+                 StationsFactory.STATION_3_ID_STR],
+                [StationsFactory.STATION_3_ID_STR, "99"],
+            ],
+            report=report)
+
+        self.assertEquals(report.duplicate_connections, 1)
+        self.assertEquals(report.self_loops, 1)
+        self.assertEquals(report.dangling_connections, 1)
+        self.assertIn('99', report.stream.getvalue())
+        self.assertEquals(len(graph.neighbours_indexes),
+                          2 * len(StationsFactory.CONNECTIONS_JSON))
+        self.assertEquals(
+            graph.get_degree(graph.index_of(StationsFactory.STATION_3_ID)), 0)
+
+
+class TestSnapshot(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.stations_filename = os.path.join(self.directory, 'stations.json')
+        self.connections_filename = os.path.join(self.directory,
+                                                 'connections.json')
+        self.snapshot_filename = os.path.join(self.directory, 'snapshot')
+        self.write_json_files(StationsFactory.STATIONS_JSON,
+                              StationsFactory.CONNECTIONS_JSON)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_json_files(self, stations_json, connections_json):
+        with open(self.stations_filename, 'w') as f:
+            json.dump(stations_json, f)
+        with open(self.connections_filename, 'w') as f:
+            json.dump(connections_json, f)
+
+    def load_stations(self):
+        return main.Stations.from_json_files(
+            self.stations_filename, self.connections_filename,
+            snapshot_filename=self.snapshot_filename)
+
+    def test_snapshot_round_trip(self):
+        graph = StationsFactory\
+            .create_stations_with_json_stations_and_connections().graph
+        graph.save_snapshot(self.snapshot_filename, 'a' * 20)
+        loaded_graph = main.StationsGraph.load_snapshot(
+            self.snapshot_filename, sources_hash='a' * 20)
+
+        self.assertEquals(list(loaded_graph.ids), list(graph.ids))
+        self.assertEquals(list(loaded_graph.offsets), list(graph.offsets))
+        self.assertEquals(list(loaded_graph.neighbours_indexes),
+                          list(graph.neighbours_indexes))
+        self.assertEquals(loaded_graph.names, graph.names)
+
+    def test_loading_creates_the_snapshot_then_uses_it(self):
+        self.load_stations()
+        self.assertTrue(os.path.exists(self.snapshot_filename))
+
+        stations = self.load_stations()
+        self.assertTrue(stations.has_lazy_connections)
+        station_1 = stations.by_id(StationsFactory.STATION_1_ID)
+        self.assertEquals(station_1.name, StationsFactory.STATION_1_NAME)
+        self.assertEquals(station_1.connections, {
+            stations.by_id(StationsFactory.STATION_2_ID),
+            stations.by_id(StationsFactory.STATION_4_ID),
+        })
+
+    def test_loading_without_a_writable_snapshot_uses_the_json_files(self):
+        self.snapshot_filename = os.path.join(self.directory, 'missing',
+                                              'snapshot')
+        stations = self.load_stations()
+
+        self.assertFalse(os.path.exists(self.snapshot_filename))
+        self.assertEquals(
+            stations.by_id(StationsFactory.STATION_1_ID).name,
+            StationsFactory.STATION_1_NAME)
+
+    def test_snapshot_is_ignored_when_the_json_files_change(self):
+        self.load_stations()
+        self.write_json_files(
+            StationsFactory.STATIONS_JSON,
+            StationsFactory.CONNECTIONS_JSON + [[
+                StationsFactory.STATION_2_ID_STR,
+                StationsFactory.STATION_3_ID_STR,
+            ]])
+
+        stations = self.load_stations()
+        self.assertIn(StationsFactory.STATION_3_ID,
+                      stations.get_neighbours_ids(StationsFactory.STATION_2_ID))
+        self.assertIn(StationsFactory.STATION_3_ID,
+                      self.load_stations().get_neighbours_ids(
+                          StationsFactory.STATION_2_ID))
+
+    def test_invalid_snapshot_is_rejected(self):
+        with open(self.snapshot_filename, 'wb') as f:
+            f.write('not a snapshot' * 10)
+
+        with self.assertRaises(main.SnapshotError):
+            main.StationsGraph.load_snapshot(self.snapshot_filename)
+        self.assertEquals(self.load_stations().stations_count,
+                          len(StationsFactory.STATIONS_JSON))
+
+    def test_connecting_stations_loaded_from_a_snapshot(self):
+        self.load_stations()
+        stations = self.load_stations()
+        station_2 = stations.by_id(StationsFactory.STATION_2_ID)
+        station_3 = stations.by_id(StationsFactory.STATION_3_ID)
+        station_2.connect_with(station_3)
+
+        self.assertEquals(
+            set(stations.get_neighbours_ids(StationsFactory.STATION_2_ID)),
+            {StationsFactory.STATION_1_ID, StationsFactory.STATION_3_ID})
+        self.assertEquals(
+            set(stations.get_neighbours_ids(StationsFactory.STATION_1_ID)),
+            {StationsFactory.STATION_2_ID, StationsFactory.STATION_4_ID})
+
+
 class TestGame(TestCase):
     def test_creating_game(self):
         game = GameFactory.create_game()
@@ -163,6 +403,75 @@ class TestGame(TestCase):
     def test_starting_game(self):
         game, pairs_count = GameFactory.create_and_start_game()
 
+    def test_game_stations_are_only_created_when_used(self):
+        game, _ = GameFactory.create_and_start_game(stations_pairs_ids=[
+            [StationsFactory.STATION_2_ID, StationsFactory.STATION_3_ID],
+        ], pairs_count=1)
+
+        self.assertEquals(
+            {
+                game_station.station._id
+                for game_station in game.iterate_game_stations
+            },
+            {StationsFactory.STATION_2_ID, StationsFactory.STATION_3_ID})
+        self.assertIs(game.by_id(StationsFactory.STATION_2_ID),
+                      game.by_id(StationsFactory.STATION_2_ID))
+
+    def test_random_pairs_are_placed_like_samples_of_two_stations(self):
+        for size in (4, 25, 400):
+            stations = main.Stations.from_graph(
+                benchmark.create_grid_graph(size, Random(0)))
+            game = main.FindTheCatGame(stations, rng=Random(3),
+                                       events=events.NullEventSink())
+            game.initialise_game_stations()
+            cats_indexes, owners_indexes = \
+                game.create_random_stations_indexes_pairs(200)
+
+            rng = Random(3)
+            self.assertEquals(zip(cats_indexes, owners_indexes), [
+                tuple(rng.sample(xrange(stations.graph.stations_count), 2))
+                for _ in xrange(200)
+            ])
+
+    def test_pairs_can_be_read_from_a_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'pairs.json')
+            with open(filename, 'w') as f:
+                json.dump([
+                    [StationsFactory.STATION_2_ID,
+                     StationsFactory.STATION_3_ID],
+                    [StationsFactory.STATION_4_ID,
+                     StationsFactory.STATION_4_ID],
+                ], f)
+            game, _ = GameFactory.create_and_start_game(
+                stations_pairs_ids=main.iterate_stations_pairs_ids(filename),
+                pairs_count=2)
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEquals(game.cats_count, 2)
+        self.assertEquals(game.get_cat_game_station(0).station._id,
+                          StationsFactory.STATION_2_ID)
+        self.assertEquals(game.get_owner_game_station(1).station._id,
+                          StationsFactory.STATION_4_ID)
+        self.assertTrue(game.has_owner_visited(
+            0, game.by_id(StationsFactory.STATION_3_ID)))
+        self.assertFalse(game.has_owner_visited(
+            0, game.by_id(StationsFactory.STATION_2_ID)))
+        self.assertEquals(game.by_id(StationsFactory.STATION_4_ID).cats, {1})
+
+    def test_closing_a_station_before_its_neighbours_are_used(self):
+        game, _ = GameFactory.create_and_start_game(stations_pairs_ids=[
+            [StationsFactory.STATION_1_ID, StationsFactory.STATION_1_ID],
+        ], pairs_count=1)
+        game.find_and_close_stations()
+        self.assertEquals(len(game.game_stations_by_index), 1)
+
+        station_2 = game.by_id(StationsFactory.STATION_2_ID)
+        self.assertFalse(game.by_id(StationsFactory.STATION_1_ID).is_open)
+        self.assertEquals(station_2.open_neighbours_list, [])
+
 
 class TestGameMatching(TestCase):
     def setUp(self):
@@ -214,6 +523,27 @@ class TestGameMatching(TestCase):
         self.game.find_and_close_stations()
         self.assertTrue(a_station_without_matches.is_open)
 
+    def test_finding_matches_clears_the_dirty_game_stations(self):
+        # Fixures sanity check
+        self.assertNotEquals(self.game.dirty_indexes, set())
+
+        self.game.find_and_close_stations()
+        self.assertEquals(self.game.dirty_indexes, set())
+
+    def test_moving_a_cat_marks_its_game_station_as_dirty(self):
+        self.game.find_and_close_stations()
+        a_game_station = self.game.by_id(StationsFactory.STATION_4_ID)
+        a_game_station.put_cat(GameFactory.UNMATCHED_PAIRS_ON_START[0])
+
+        self.assertEquals(self.game.dirty_indexes, {a_game_station.index})
+
+    def test_moving_an_owner_marks_its_game_station_as_dirty(self):
+        self.game.find_and_close_stations()
+        a_game_station = self.game.by_id(StationsFactory.STATION_4_ID)
+        a_game_station.put_owner(GameFactory.UNMATCHED_PAIRS_ON_START[0])
+
+        self.assertEquals(self.game.dirty_indexes, {a_game_station.index})
+
 
 class TestVisiting(TestCase):
     def setUp(self):
@@ -221,7 +551,7 @@ class TestVisiting(TestCase):
 
     def test_possible_cat_moves_in_just_started_game(self):
         a_pair_id = 0
-        cat_game_station = self.game.cats_game_stations[a_pair_id]
+        cat_game_station = self.game.get_cat_game_station(a_pair_id)
         # Fixures sanity check
         self.assertEquals(cat_game_station.station._id,
                           StationsFactory.STATION_1_ID)
@@ -239,7 +569,7 @@ class TestVisiting(TestCase):
 
     def test_possible_cat_moves_dont_contain_game_station_after_closing(self):
         a_pair_id = 0
-        cat_game_station = self.game.cats_game_stations[a_pair_id]
+        cat_game_station = self.game.get_cat_game_station(a_pair_id)
         # Fixures sanity check
         self.assertEquals(cat_game_station.station._id,
                           StationsFactory.STATION_1_ID)
@@ -254,7 +584,7 @@ class TestVisiting(TestCase):
 
     def test_possible_owner_moves_in_just_started_game(self):
         a_pair_id = 5
-        owner_game_station = self.game.owners_game_stations[a_pair_id]
+        owner_game_station = self.game.get_owner_game_station(a_pair_id)
         # Fixures sanity check
         self.assertEquals(owner_game_station.station._id,
                           StationsFactory.STATION_1_ID)
@@ -272,7 +602,7 @@ class TestVisiting(TestCase):
 
     def test_possible_owner_moves_dont_contain_game_station_after_closing(self):
         a_pair_id = 5
-        owner_game_station = self.game.owners_game_stations[a_pair_id]
+        owner_game_station = self.game.get_owner_game_station(a_pair_id)
         # Fixures sanity check
         self.assertEquals(owner_game_station.station._id,
                           StationsFactory.STATION_1_ID)
@@ -287,7 +617,7 @@ class TestVisiting(TestCase):
 
     def test_possible_owner_moves_dont_contain_game_station_after_visiting(self):
         a_pair_id = 5
-        owner_game_station = self.game.owners_game_stations[a_pair_id]
+        owner_game_station = self.game.get_owner_game_station(a_pair_id)
         # Fixures sanity check
         self.assertEquals(owner_game_station.station._id,
                           StationsFactory.STATION_1_ID)
@@ -301,7 +631,7 @@ class TestVisiting(TestCase):
 
     def test_possible_owner_moves_contain_game_station_after_visiting_all_neighbours(self):
         a_pair_id = 5
-        owner_game_station = self.game.owners_game_stations[a_pair_id]
+        owner_game_station = self.game.get_owner_game_station(a_pair_id)
         # Fixures sanity check
         self.assertEquals(owner_game_station.station._id,
                           StationsFactory.STATION_1_ID)
@@ -312,18 +642,1668 @@ class TestVisiting(TestCase):
         self.assertIn(a_neighbour_game_station,
                       self.game.get_owner_possible_moves(a_pair_id))
 
+    def test_open_neighbours_list_is_in_graph_order(self):
+        a_game_station = self.game.by_id(StationsFactory.STATION_1_ID)
+
+        self.assertEquals(a_game_station.open_neighbours_list, [
+            self.game.by_id(StationsFactory.STATION_2_ID),
+            self.game.by_id(StationsFactory.STATION_4_ID),
+        ])
+
+    def test_closing_a_game_station_removes_it_from_open_neighbours_lists(self):
+        a_game_station = self.game.by_id(StationsFactory.STATION_1_ID)
+        a_neighbour_game_station = \
+            self.game.by_id(StationsFactory.STATION_2_ID)
+        # Fixures sanity check
+        self.assertIn(a_neighbour_game_station,
+                      a_game_station.open_neighbours_list)
+
+        a_neighbour_game_station.close()
+        a_neighbour_game_station.close()
+        self.assertEquals(a_game_station.open_neighbours_list, [
+            self.game.by_id(StationsFactory.STATION_4_ID),
+        ])
+
+    def test_cats_without_open_neighbours_stay_put(self):
+        a_pair_id = 0
+        cat_game_station = self.game.get_cat_game_station(a_pair_id)
+        for a_neighbour_game_station in cat_game_station.neighbours:
+            a_neighbour_game_station.close()
+        self.game.move_cats()
+
+        self.assertIs(self.game.get_cat_game_station(a_pair_id),
+                      cat_game_station)
+
+    def test_moving_owners_prefers_not_visited_stations(self):
+        a_pair_id = 5
+        owner_game_station = self.game.get_owner_game_station(a_pair_id)
+        visited_game_station = self.game.by_id(StationsFactory.STATION_2_ID)
+        visited_game_station.put_owner(a_pair_id)
+
+        for _ in xrange(10):
+            owner_game_station.put_owner(a_pair_id)
+            self.game.move_owners()
+            self.assertEquals(self.game.get_owner_game_station(a_pair_id),
+                              self.game.by_id(StationsFactory.STATION_4_ID))
+            self.game.owners_visited_game_stations[a_pair_id] = bytearray()
+            visited_game_station.put_owner(a_pair_id)
+
+    def test_owners_visit_their_starting_station(self):
+        a_pair_id = 5
+        owner_game_station = self.game.get_owner_game_station(a_pair_id)
+
+        self.assertTrue(self.game.has_owner_visited(a_pair_id,
+                                                    owner_game_station))
+        for game_station in owner_game_station.neighbours:
+            self.assertFalse(self.game.has_owner_visited(a_pair_id,
+                                                         game_station))
+
+    def test_owners_visited_bitset_only_spans_the_visited_indexes(self):
+        a_pair_id = 5
+        # Fixures sanity check
+        self.assertEquals(
+            self.game.get_owner_game_station(a_pair_id).station._id,
+            StationsFactory.STATION_1_ID)
+        self.assertEquals(
+            self.game.owners_visited_game_stations[a_pair_id],
+            bytearray([0b1]))
+
+        self.game.by_id(StationsFactory.STATION_4_ID).put_owner(a_pair_id)
+        self.assertEquals(
+            self.game.owners_visited_game_stations[a_pair_id],
+            bytearray([0b1001]))
+
+    def test_owners_visited_bitset_grows_down_to_lower_indexes(self):
+        stations = main.Stations()
+        for _id in xrange(24):
+            stations.create_station(_id, str(_id))
+        game, _ = GameFactory.create_and_start_game(
+            stations=stations, pairs_count=1, stations_pairs_ids=[[0, 20]])
+        a_pair_id = 0
+        self.assertEquals(game.owners_visited_first_bytes[a_pair_id], 2)
+
+        for _id in (3, 17):
+            game.by_id(_id).put_owner(a_pair_id)
+        self.assertEquals(game.owners_visited_first_bytes[a_pair_id], 0)
+        self.assertEquals(game.owners_visited_game_stations[a_pair_id],
+                          bytearray([0b1000, 0, 0b10010]))
+        for _id in (3, 17, 20):
+            self.assertTrue(game.has_owner_visited(a_pair_id, game.by_id(_id)))
+        self.assertFalse(game.has_owner_visited(a_pair_id, game.by_id(16)))
+
     def test_removing_a_cat_from_a_station_it_doesnt_exist_is_a_noop(self):
         a_pair_id = 0
-        cat_game_station = self.game.cats_game_stations[a_pair_id]
+        cat_game_station = self.game.get_cat_game_station(a_pair_id)
         cat_game_station.remove_cat(a_pair_id)
         cat_game_station.remove_cat(a_pair_id)
 
     def test_removing_an_owner_from_a_station_it_doesnt_exist_is_a_noop(self):
         a_pair_id = 0
-        owner_game_station = self.game.owners_game_stations[a_pair_id]
+        owner_game_station = self.game.get_owner_game_station(a_pair_id)
         owner_game_station.remove_owner(a_pair_id)
         owner_game_station.remove_owner(a_pair_id)
 
 
+class TestReachability(TestCase):
+    def setUp(self):
+        self.stations = StationsFactory\
+            .create_stations_with_json_stations_and_connections()
+        self.game, self.pairs_count = GameFactory.create_and_start_game(
+            stations=self.stations)
+
+    def get_component_id(self, _id):
+        return self.game.get_component_id(
+            self.stations.graph.index_of(_id))
+
+    def test_graph_components(self):
+        graph = self.stations.graph
+        station_3_index = graph.index_of(StationsFactory.STATION_3_ID)
+        self.assertEquals(list(graph.get_components_ids()), [
+            0 if _id != StationsFactory.STATION_3_ID else station_3_index
+            for _id in graph.ids
+        ])
+
+    def test_graph_blocks(self):
+        graph = main.StationsGraph.from_edges(
+            range(7), [(0, 1), (1, 2), (2, 3), (3, 1), (3, 4)])
+
+        self.assertEquals(list(graph.get_blocks_ids()),
+                          [2, -1, 1, -1, 0, -1, -1])
+        self.assertEquals(graph.get_station_blocks_ids(1), [1, 2])
+        self.assertEquals(graph.get_station_blocks_ids(2), [1])
+        self.assertEquals(graph.get_station_blocks_ids(5), [])
+
+    def test_only_the_components_of_the_pairs_are_searched(self):
+        stations = main.Stations.from_graph(main.StationsGraph.from_edges(
+            range(1000), [(index, index + 1) for index in xrange(0, 1000, 2)]))
+        neighbours_lookups = set()
+        get_neighbours_indexes = stations.graph.get_neighbours_indexes
+
+        def count_neighbours_lookups(index):
+            neighbours_lookups.add(index)
+            return get_neighbours_indexes(index)
+
+        stations.graph.get_neighbours_indexes = count_neighbours_lookups
+        game = main.FindTheCatGame(stations, events=events.NullEventSink())
+        game.start(1, stations_pairs_ids=[(4, 5)])
+        game.run(iteration_count=10)
+
+        self.assertEquals(neighbours_lookups, {4, 5})
+
+    def test_first_closure_on_a_long_cycle_needs_no_search(self):
+        stations_count = 100000
+        stations = main.Stations.from_graph(main.StationsGraph.from_edges(
+            range(stations_count),
+            [
+                (index, (index + 1) % stations_count)
+                for index in xrange(stations_count)
+            ]))
+        game = main.FindTheCatGame(stations, events=events.NullEventSink())
+        game.start(1, stations_pairs_ids=[(0, stations_count // 2)])
+        stations.graph.get_blocks_ids()
+        neighbours_lookups = []
+        get_neighbours_indexes = stations.graph.get_neighbours_indexes
+
+        def count_neighbours_lookups(index):
+            neighbours_lookups.append(index)
+            return get_neighbours_indexes(index)
+
+        stations.graph.get_neighbours_indexes = count_neighbours_lookups
+        game.by_id(stations_count // 4).close()
+        # The ones of the closed station only
+        self.assertEquals(neighbours_lookups, [stations_count // 4])
+        self.assertTrue(game.is_pair_reachable(0))
+
+        game.by_id(3 * stations_count // 4).close()
+        self.assertFalse(game.is_pair_reachable(0))
+
+    def test_closing_a_station_splits_its_component(self):
+        # Fixures sanity check
+        self.assertEquals(self.get_component_id(StationsFactory.STATION_2_ID),
+                          self.get_component_id(StationsFactory.STATION_4_ID))
+
+        self.game.by_id(StationsFactory.STATION_1_ID).close()
+        self.assertNotEquals(
+            self.get_component_id(StationsFactory.STATION_2_ID),
+            self.get_component_id(StationsFactory.STATION_4_ID))
+        self.assertNotEquals(
+            self.get_component_id(StationsFactory.STATION_3_ID),
+            self.get_component_id(StationsFactory.STATION_4_ID))
+
+    def test_closing_a_leaf_station_keeps_the_component(self):
+        component_id = self.get_component_id(StationsFactory.STATION_1_ID)
+        self.game.by_id(StationsFactory.STATION_2_ID).close()
+
+        self.assertEquals(self.get_component_id(StationsFactory.STATION_1_ID),
+                          component_id)
+        self.assertEquals(self.get_component_id(StationsFactory.STATION_4_ID),
+                          component_id)
+
+    def test_pairs_in_different_components_are_unreachable(self):
+        a_pair_id = 2
+        # Fixures sanity check
+        self.assertEquals(
+            [
+                self.game.get_cat_game_station(a_pair_id).station._id,
+                self.game.get_owner_game_station(a_pair_id).station._id,
+            ],
+            [StationsFactory.STATION_1_ID, StationsFactory.STATION_3_ID])
+
+        self.assertFalse(self.game.is_pair_reachable(a_pair_id))
+        self.assertTrue(self.game.is_pair_reachable(0))
+
+    def test_agents_on_a_closed_station_can_reach_its_open_neighbours(self):
+        a_pair_id = 0
+        self.game.by_id(StationsFactory.STATION_1_ID).close()
+        # The cat is on station 1, the owner on station 2
+        self.assertTrue(self.game.is_pair_reachable(a_pair_id))
+
+        self.game.by_id(StationsFactory.STATION_4_ID).put_owner(a_pair_id)
+        self.assertTrue(self.game.is_pair_reachable(a_pair_id))
+
+        self.game.by_id(StationsFactory.STATION_4_ID).close()
+        self.assertFalse(self.game.is_pair_reachable(a_pair_id))
+
+    def test_run_ends_when_no_reachable_pairs_remain(self):
+        self.game.run(iteration_count=100)
+
+        self.assertEquals(self.game.steps_count, 1)
+        self.assertEquals(self.game.cats_found,
+                          len(GameFactory.MATCHED_PAIRS_ON_START))
+        self.assertEquals(
+            self.game.cats_unreachable,
+            self.pairs_count - len(GameFactory.MATCHED_PAIRS_ON_START))
+        self.assertEquals(self.game.get_result(), {
+            'cats_count': self.pairs_count,
+            'cats_found': len(GameFactory.MATCHED_PAIRS_ON_START),
+            'cats_unreachable':
+                self.pairs_count - len(GameFactory.MATCHED_PAIRS_ON_START),
+            'cats_roaming': 0,
+            'steps_count': 1,
+        })
+
+    def test_pairs_keep_roaming_without_reachability_tracking(self):
+        # Two components, where agents always have somewhere to go
+        stations = main.Stations.from_graph(main.StationsGraph.from_edges(
+            range(4), [(0, 1), (2, 3)]))
+        game = main.FindTheCatGame(stations, events=events.NullEventSink(),
+                                   track_reachability=False)
+        game.start(1, stations_pairs_ids=[(0, 2)])
+        game.run(iteration_count=5)
+
+        self.assertEquals(game.steps_count, 5)
+        self.assertEquals(game.cats_unreachable, 0)
+
+    def test_frozen_pairs_are_retired_without_reachability_tracking(self):
+        game = main.FindTheCatGame(self.stations,
+                                   events=events.NullEventSink(),
+                                   track_reachability=False)
+        game.start(self.pairs_count,
+                   stations_pairs_ids=GameFactory.STATIONS_PAIRS_IDS)
+        game.run(iteration_count=5)
+
+        # The same pairs as with tracking, once their agents got stuck
+        self.assertEquals(game.get_result(), {
+            'cats_count': self.pairs_count,
+            'cats_found': len(GameFactory.MATCHED_PAIRS_ON_START),
+            'cats_unreachable':
+                self.pairs_count - len(GameFactory.MATCHED_PAIRS_ON_START),
+            'cats_roaming': 0,
+            'steps_count': 2,
+        })
+
+
+class TestDormantAgents(TestCase):
+    def setUp(self):
+        self.game, self.pairs_count = GameFactory.create_and_start_game()
+        self.game.dirty_indexes = set()
+
+    def test_cats_without_open_neighbours_become_dormant(self):
+        a_pair_id = 0
+        self.game.by_id(StationsFactory.STATION_2_ID).close()
+        self.game.by_id(StationsFactory.STATION_4_ID).close()
+        self.game.move_cats()
+
+        self.assertIn(a_pair_id, self.game.dormant_cats_pairs_ids)
+        self.assertNotIn(a_pair_id, self.game.moving_cats_pairs_ids)
+        self.assertIn(a_pair_id, self.game.roaming_pairs_ids)
+
+    def test_owners_without_open_neighbours_become_dormant(self):
+        a_pair_id = 5
+        self.game.by_id(StationsFactory.STATION_2_ID).close()
+        self.game.by_id(StationsFactory.STATION_4_ID).close()
+        self.game.move_owners()
+
+        self.assertIn(a_pair_id, self.game.dormant_owners_pairs_ids)
+        self.assertNotIn(a_pair_id, self.game.moving_owners_pairs_ids)
+
+    def test_dormant_cats_can_still_be_found(self):
+        a_pair_id = 0
+        # Station 3 has no neighbours
+        self.game.by_id(StationsFactory.STATION_3_ID).put_cat(a_pair_id)
+        self.game.move_cats()
+        # Fixures sanity check
+        self.assertIn(a_pair_id, self.game.dormant_cats_pairs_ids)
+
+        self.game.by_id(StationsFactory.STATION_3_ID).put_owner(a_pair_id)
+        self.game.find_and_close_stations()
+        self.assertIn(a_pair_id, self.game.found_pairs_ids)
+        self.assertNotIn(a_pair_id, self.game.dormant_cats_pairs_ids)
+
+    def test_pairs_frozen_apart_are_retired(self):
+        a_pair_id = 2
+        # Fixures sanity check: the owner is on station 3, with no neighbours
+        self.assertEquals(
+            self.game.get_owner_game_station(a_pair_id).station._id,
+            StationsFactory.STATION_3_ID)
+
+        self.game.by_id(StationsFactory.STATION_2_ID).close()
+        self.game.by_id(StationsFactory.STATION_4_ID).close()
+        self.game.move_cats()
+        self.game.move_owners()
+
+        self.assertNotIn(a_pair_id, self.game.roaming_pairs_ids)
+        self.assertIn(a_pair_id, self.game.unreachable_pairs_ids)
+        self.assertNotIn(a_pair_id, self.game.dormant_cats_pairs_ids)
+        self.assertNotIn(a_pair_id, self.game.dormant_owners_pairs_ids)
+
+
+class RecordingEventSink(events.EventSink):
+    def __init__(self):
+        self.events = []
+
+    def pair_found(self, step, pair_id, station_id, station_name):
+        self.events.append(('pair_found', step, pair_id, station_id))
+
+    def station_closed(self, step, station_id, station_name):
+        self.events.append(('station_closed', step, station_id))
+
+    def step_completed(self, step, roaming_pairs_count):
+        self.events.append(('step_completed', step, roaming_pairs_count))
+
+    def run_finished(self, steps_count, cats_count, cats_found,
+                     cats_unreachable=0):
+        self.events.append(('run_finished', steps_count, cats_count,
+                            cats_found, cats_unreachable))
+
+
+class TestEvents(TestCase):
+    def test_game_sends_events_to_its_sink(self):
+        sink = RecordingEventSink()
+        game, pairs_count = GameFactory.create_and_start_game(event_sink=sink)
+        game.step()
+
+        found_events = [
+            event[2]
+            for event in sink.events
+            if event[0] == 'pair_found'
+        ]
+        self.assertEquals(set(found_events),
+                          GameFactory.MATCHED_PAIRS_ON_START)
+        closed_events = [
+            event[2]
+            for event in sink.events
+            if event[0] == 'station_closed'
+        ]
+        self.assertEquals(set(closed_events),
+                          GameFactory.STATIONS_WITH_MATCHED_PAIRS)
+        self.assertEquals(sink.events[-1], (
+            'step_completed', 0, game.roaming_pairs_count))
+
+    def test_run_finished_event(self):
+        sink = RecordingEventSink()
+        game, pairs_count = GameFactory.create_and_start_game(event_sink=sink)
+        game.run(iteration_count=3)
+
+        self.assertEquals(sink.events[-1], (
+            'run_finished', game.steps_count, pairs_count, game.cats_found,
+            game.cats_unreachable))
+
+    def test_text_sink_output_matches_the_printed_output(self):
+        stream = StringIO()
+        sink = events.TextEventSink(stream)
+        sink.pair_found(0, 3, StationsFactory.STATION_1_ID,
+                        StationsFactory.STATION_1_NAME)
+        # Fixures sanity check: it's buffered
+        self.assertEquals(stream.getvalue(), '')
+
+        sink.run_finished(10, 20, 1, 4)
+        self.assertEquals(stream.getvalue(), (
+            'Owner 3 found cat 3 - London Bridge is now closed\n'
+            'Total number of cats: 20\n'
+            'Number of cats found: 1\n'
+            'Number of cats unreachable: 4\n'
+            'Number of cats still roaming: 15\n'
+        ))
+
+    def test_json_lines_sink(self):
+        stream = StringIO()
+        sink = events.JsonLinesEventSink(stream)
+        sink.pair_found(0, 3, StationsFactory.STATION_1_ID,
+                        StationsFactory.STATION_1_NAME)
+        sink.run_finished(10, 20, 1, 4)
+
+        self.assertEquals(map(json.loads, stream.getvalue().splitlines()), [
+            {
+                'event': 'pair_found', 'step': 0, 'pair_id': 3,
+                'station_id': StationsFactory.STATION_1_ID,
+            },
+            {
+                'event': 'run_finished', 'steps_count': 10, 'cats_count': 20,
+                'cats_found': 1, 'cats_unreachable': 4,
+            },
+        ])
+
+    def test_binary_sink_can_be_read_back(self):
+        stream = StringIO()
+        sink = events.BinaryEventSink(stream)
+        sink.station_closed(2, StationsFactory.STATION_1_ID,
+                            StationsFactory.STATION_1_NAME)
+        sink.step_completed(2, 5)
+        sink.flush()
+
+        self.assertEquals(
+            list(events.read_binary_events(StringIO(stream.getvalue()))), [
+                {
+                    'event': 'station_closed', 'step': 2,
+                    'station_id': StationsFactory.STATION_1_ID,
+                },
+                {
+                    'event': 'step_completed', 'step': 2,
+                    'roaming_pairs_count': 5,
+                },
+            ])
+
+
+class TestSeededGames(TestCase):
+    def setUp(self):
+        self.stations = StationsFactory\
+            .create_stations_with_json_stations_and_connections()
+
+    def get_game_trace(self, seed):
+        game = GameFactory.create_game(stations=self.stations)
+        game.rng = Random(seed)
+        game.start(GameFactory.PAIRS_COUNT)
+        trace = []
+        for _ in xrange(20):
+            game.step()
+            trace.append((
+                sorted(game.roaming_pairs_ids),
+                [
+                    game.get_cat_game_station(pair_id).index
+                    for pair_id in game.pairs_ids
+                ],
+                [
+                    game.get_owner_game_station(pair_id).index
+                    for pair_id in game.pairs_ids
+                ],
+            ))
+
+        return trace
+
+    def test_games_with_the_same_seed_are_identical(self):
+        self.assertEquals(self.get_game_trace(seed=3),
+                          self.get_game_trace(seed=3))
+
+
+class TestCheckpoints(TestCase):
+    PAIRS_COUNT = 40
+
+    def setUp(self):
+        self.stations = main.Stations.from_graph(
+            benchmark.create_grid_graph(100, Random(0)))
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'checkpoint')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def create_game(self):
+        game = main.FindTheCatGame(self.stations, rng=Random(4),
+                                   events=events.NullEventSink())
+        game.start(self.PAIRS_COUNT)
+
+        return game
+
+    def get_game_trace(self, game):
+        return (
+            game.steps_count,
+            list(game.cats_indexes),
+            list(game.owners_indexes),
+            list(game.moving_cats_pairs_ids),
+            list(game.moving_owners_pairs_ids),
+            sorted(game.found_pairs_ids),
+            sorted(game.unreachable_pairs_ids),
+            sorted(game.closed_indexes),
+            game.rng.getstate(),
+        )
+
+    def test_resumed_game_carries_on_identically(self):
+        game = self.create_game()
+        game.run(iteration_count=25,
+                 checkpointer=checkpoint.Checkpointer(self.filename,
+                                                      interval=10))
+        resumed_game = checkpoint.resume_game(
+            self.stations, self.filename, events=events.NullEventSink())
+        self.assertEquals(resumed_game.steps_count, 20)
+
+        resumed_game.run(iteration_count=5)
+        self.assertEquals(self.get_game_trace(resumed_game),
+                          self.get_game_trace(game))
+        game.run(iteration_count=200)
+        resumed_game.run(iteration_count=200)
+        self.assertEquals(self.get_game_trace(resumed_game),
+                          self.get_game_trace(game))
+
+    @skipIf(random_streams is None, "NumPy is not installed")
+    def test_resumed_game_draws_from_the_same_stream(self):
+        game = main.FindTheCatGame(
+            self.stations, rng=random_streams.RandomStream(4, block_size=100),
+            events=events.NullEventSink())
+        game.start(self.PAIRS_COUNT)
+        game.run(iteration_count=10,
+                 checkpointer=checkpoint.Checkpointer(self.filename,
+                                                      interval=10))
+        resumed_game = checkpoint.resume_game(
+            self.stations, self.filename, events=events.NullEventSink())
+        self.assertIsInstance(resumed_game.rng, random_streams.RandomStream)
+
+        game.run(iteration_count=200)
+        resumed_game.run(iteration_count=200)
+        # The states of streams have arrays, which don't compare
+        self.assertEquals(self.get_game_trace(resumed_game)[:-1],
+                          self.get_game_trace(game)[:-1])
+        self.assertEquals(resumed_game.rng.draws_used, game.rng.draws_used)
+
+    def test_resuming_with_another_type_of_generator_fails(self):
+        game = self.create_game()
+        checkpoint.Checkpointer(self.filename).save(game)
+
+        with self.assertRaises(checkpoint.CheckpointError):
+            checkpoint.resume_game(self.stations, self.filename,
+                                   rng=object())
+
+    def test_checkpoints_only_have_the_pairs_that_were_roaming(self):
+        game = self.create_game()
+        game.run(iteration_count=40,
+                 checkpointer=checkpoint.Checkpointer(self.filename,
+                                                      interval=20))
+
+        records = list(checkpoint.iterate_records(self.filename))
+        self.assertEquals(len(records), 2)
+        self.assertEquals(len(records[0]['owners_visited']), self.PAIRS_COUNT)
+        self.assertEquals(
+            len(records[1]['owners_visited']),
+            self.PAIRS_COUNT - len(records[0]['stopped_roaming_pairs_ids']))
+
+    def test_partly_written_checkpoint_is_ignored(self):
+        game = self.create_game()
+        game.run(iteration_count=20,
+                 checkpointer=checkpoint.Checkpointer(self.filename,
+                                                      interval=10))
+        with open(self.filename, 'ab') as f:
+            f.write(checkpoint.Checkpointer.RECORD_LENGTH.pack(1000) + 'x')
+
+        self.assertEquals(checkpoint.load_state(self.filename)['steps_count'],
+                          20)
+
+    def test_resuming_on_other_stations_fails(self):
+        game = self.create_game()
+        checkpoint.Checkpointer(self.filename).save(game)
+
+        with self.assertRaises(checkpoint.CheckpointError):
+            checkpoint.resume_game(
+                StationsFactory
+                .create_stations_with_json_stations_and_connections(),
+                self.filename)
+
+
+class TestResultCache(TestCase):
+    GRAPH_HASH = 'a' * 40
+
+    def setUp(self):
+        self.stations = main.Stations.from_graph(
+            benchmark.create_grid_graph(100, Random(0)))
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'results.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_results_are_kept_between_caches(self):
+        cache = result_cache.ResultCache(self.filename)
+        cache.put(self.GRAPH_HASH, 10, 2 ** 70, 100, {'cats_found': 3})
+        cache.close()
+
+        cache = result_cache.ResultCache(self.filename)
+        self.assertEquals(cache.get(self.GRAPH_HASH, 10, 2 ** 70, 100),
+                          {'cats_found': 3})
+        self.assertIsNone(cache.get('b' * 40, 10, 2 ** 70, 100))
+        self.assertIsNone(cache.get(self.GRAPH_HASH, 10, 2 ** 70, 101))
+
+    def test_seeds_bigger_than_sqlite_integers_are_kept_apart(self):
+        cache = result_cache.ResultCache(self.filename)
+        cache.put(self.GRAPH_HASH, 10, 2 ** 64 - 5, 100, {'cats_found': 1})
+        cache.put(self.GRAPH_HASH, 10, 2 ** 64 - 4, 100, {'cats_found': 2})
+
+        self.assertEquals(cache.entries_count, 2)
+        self.assertEquals(cache.get(self.GRAPH_HASH, 10, 2 ** 64 - 5, 100),
+                          {'cats_found': 1})
+        self.assertEquals(cache.get(self.GRAPH_HASH, 10, 2 ** 64 - 4, 100),
+                          {'cats_found': 2})
+
+    def test_caches_with_older_tables_are_emptied(self):
+        cache = result_cache.ResultCache(self.filename)
+        cache.put(self.GRAPH_HASH, 10, 1, 100, {'cats_found': 1})
+        cache.connection.execute('PRAGMA user_version = 1')
+        cache.close()
+
+        cache = result_cache.ResultCache(self.filename)
+        self.assertEquals(cache.entries_count, 0)
+
+    def test_least_recently_used_results_are_evicted(self):
+        cache = result_cache.ResultCache(self.filename, max_entries=2,
+                                         touch_interval=0)
+        cache.put(self.GRAPH_HASH, 1, 0, 100, {})
+        cache.put(self.GRAPH_HASH, 2, 0, 100, {})
+        cache.get(self.GRAPH_HASH, 1, 0, 100)
+        cache.put(self.GRAPH_HASH, 3, 0, 100, {})
+
+        self.assertEquals(cache.entries_count, 2)
+        self.assertIsNotNone(cache.get(self.GRAPH_HASH, 1, 0, 100))
+        self.assertIsNone(cache.get(self.GRAPH_HASH, 2, 0, 100))
+        self.assertIsNotNone(cache.get(self.GRAPH_HASH, 3, 0, 100))
+
+    def test_recently_used_results_are_not_touched(self):
+        cache = result_cache.ResultCache(self.filename)
+        cache.put(self.GRAPH_HASH, 1, 0, 100, {})
+        last_used, = cache.connection.execute(
+            'SELECT last_used FROM results').fetchone()
+        cache.get(self.GRAPH_HASH, 1, 0, 100)
+
+        self.assertEquals(cache.connection.execute(
+            'SELECT last_used FROM results').fetchone(), (last_used,))
+
+    def test_a_hundredth_of_full_caches_is_evicted_at_once(self):
+        cache = result_cache.ResultCache(self.filename, max_entries=200)
+        for pairs_count in xrange(1, 202):
+            cache.put(self.GRAPH_HASH, pairs_count, 0, 100, {})
+
+        self.assertEquals(cache.entries_count, 198)
+        self.assertEquals(cache.known_entries_count, 198)
+        self.assertIsNone(cache.get(self.GRAPH_HASH, 3, 0, 100))
+        self.assertIsNotNone(cache.get(self.GRAPH_HASH, 4, 0, 100))
+
+    def test_cached_games_are_not_run_again(self):
+        cache = result_cache.ResultCache(self.filename)
+        result, computed = result_cache.run_cached_game(
+            self.stations, 5, 3, 50, cache, summarise=get_steps_count)
+        self.assertTrue(computed)
+        self.assertEquals(result['summary'], result['steps_count'])
+
+        cached_result, computed = result_cache.run_cached_game(
+            self.stations, 5, 3, 50, cache, summarise=get_steps_count)
+        self.assertFalse(computed)
+        self.assertEquals(cached_result, result)
+
+        game = batch.run_game(self.stations, 5, 3, iteration_count=50)
+        self.assertEquals(result['cats_found'], game.cats_found)
+
+    def test_sweeps_only_run_the_new_cells(self):
+        sweep = result_cache.Sweep(self.stations, self.filename, processes=2)
+        results = sweep.run([2, 4], [0, 1, 2], iteration_count=50)
+        self.assertEquals(sweep.computed_cells_count, 6)
+
+        new_results = sweep.run([2, 4, 6], [0, 1, 2], iteration_count=50)
+        self.assertEquals(sweep.computed_cells_count, 3)
+        self.assertEquals(len(new_results), 9)
+        for cell, result in results.iteritems():
+            self.assertEquals(new_results[cell], result)
+        self.assertEquals(
+            new_results[(6, 1)]['cats_found'],
+            batch.run_game(self.stations, 6, 1,
+                           iteration_count=50).cats_found)
+
+    def test_sweeps_summarising_dont_reuse_results_without_summary(self):
+        sweep = result_cache.Sweep(self.stations, self.filename, processes=1)
+        results = sweep.run([2], [0, 1], iteration_count=50)
+
+        summarising_sweep = result_cache.Sweep(
+            self.stations, self.filename, processes=1,
+            summarise=get_steps_count)
+        summarised_results = summarising_sweep.run([2], [0, 1],
+                                                   iteration_count=50)
+        self.assertEquals(summarising_sweep.computed_cells_count, 2)
+        for cell, result in summarised_results.iteritems():
+            self.assertEquals(result['summary'], result['steps_count'])
+            self.assertEquals(dict(result, summary=None),
+                              dict(results[cell], summary=None))
+
+        summarising_sweep.run([2], [0, 1], iteration_count=50)
+        self.assertEquals(summarising_sweep.computed_cells_count, 0)
+
+
+def get_steps_count(game):
+    return game.steps_count
+
+
+class TestGamesStatistics(TestCase):
+    def setUp(self):
+        self.stations = main.Stations.from_graph(
+            benchmark.create_grid_graph(100, Random(0)))
+
+    def test_merged_moments_are_the_moments_of_all_values(self):
+        values = [Random(1).random() * 100 for _ in xrange(50)]
+        first, second = game_statistics.Moments(), game_statistics.Moments()
+        for value in values[:20]:
+            first.add(value)
+        for value in values[20:]:
+            second.add(value)
+        first.merge(second)
+
+        mean = sum(values) / len(values)
+        variance = sum((value - mean) ** 2 for value in values) \
+            / (len(values) - 1)
+        self.assertEquals(first.count, 50)
+        self.assertAlmostEquals(first.mean, mean)
+        self.assertAlmostEquals(first.variance, variance)
+        self.assertEquals((first.min, first.max), (min(values), max(values)))
+
+    def test_sketch_quantiles_are_within_the_relative_accuracy(self):
+        sketch = game_statistics.QuantileSketch(relative_accuracy=0.01)
+        for value in xrange(1, 10001):
+            sketch.add(value)
+
+        for quantile in (0.1, 0.5, 0.99):
+            expected = 1 + quantile * 9999
+            self.assertLess(
+                abs(sketch.get_quantile(quantile) - expected) / expected,
+                0.011)
+
+    def test_sketch_size_only_grows_with_the_range_of_values(self):
+        sketch = game_statistics.QuantileSketch()
+        for value in xrange(100000):
+            sketch.add(value % 1000)
+
+        self.assertLess(len(sketch.buckets), 400)
+        self.assertEquals(sketch.get_quantile(0), 0)
+
+    def test_games_statistics_follow_the_games(self):
+        statistics = game_statistics.GamesStatistics()
+        games = [
+            batch.run_game(self.stations, 10, seed, iteration_count=200,
+                           events=statistics.create_event_sink())
+            for seed in xrange(5)
+        ]
+
+        self.assertEquals(statistics.games_count, 5)
+        self.assertEquals(statistics.cats_found.total, 5)
+        self.assertEquals(statistics.found_steps.count,
+                          sum(game.cats_found for game in games))
+        self.assertEquals(statistics.steps_counts_moments.max,
+                          max(game.steps_count for game in games))
+        self.assertEquals(
+            sum(statistics.stations_closures.closures_counts.itervalues()),
+            sum(len(game.closed_indexes) for game in games))
+
+    def test_batch_statistics_dont_depend_on_the_chunks(self):
+        runner = batch.BatchRunner(self.stations, processes=2)
+        summaries = [
+            runner.run_statistics(7, 10, base_seed=3, iteration_count=200,
+                                  chunk_size=chunk_size).get_summary()
+            for chunk_size in (2, 7)
+        ]
+
+        self.assertEquals(summaries[0]['games_count'], 7)
+        self.assertEquals(summaries[0]['cats_found']['histogram'],
+                          summaries[1]['cats_found']['histogram'])
+        self.assertEquals(summaries[0]['stations_closures'],
+                          summaries[1]['stations_closures'])
+        self.assertAlmostEquals(
+            summaries[0]['steps_counts']['moments']['variance'],
+            summaries[1]['steps_counts']['moments']['variance'])
+
+
+class TestDaemon(TestCase):
+    def setUp(self):
+        self.stations = StationsFactory\
+            .create_stations_with_json_stations_and_connections()
+
+    def test_jobs_are_seeded_games(self):
+        response = daemon.run_job(self.stations, {
+            'id': 'a', 'pairs_count': 3, 'seed': 7, 'iteration_count': 50,
+        })
+
+        game = batch.run_game(self.stations, 3, 7, iteration_count=50)
+        self.assertEquals(response, {'id': 'a', 'result': game.get_result()})
+
+    def test_jobs_can_place_the_pairs(self):
+        response = daemon.run_job(self.stations, {
+            'stations_pairs_ids': [[StationsFactory.STATION_1_ID,
+                                    StationsFactory.STATION_1_ID]],
+        })
+
+        self.assertEquals(response['result']['cats_found'], 1)
+        self.assertEquals(response['result']['steps_count'], 1)
+
+    def test_invalid_jobs_are_answered_with_an_error(self):
+        self.assertIn('error', daemon.run_job(self.stations, {}))
+        self.assertIn('error', daemon.run_job(self.stations,
+                                              {'pairs_count': 0}))
+        self.assertIn('error', daemon.run_job(self.stations, {
+            'stations_pairs_ids': [[123456, StationsFactory.STATION_1_ID]],
+        }))
+        for pairs_count in (1e400, 2.5, True, daemon.MAX_PAIRS_COUNT + 1):
+            self.assertIn('error', daemon.run_job(
+                self.stations, {'pairs_count': pairs_count}))
+        self.assertIn('error', daemon.run_job(
+            self.stations, {'pairs_count': 1, 'iteration_count': -1}))
+
+    def test_jobs_failing_in_a_pool_are_answered_with_an_error(self):
+        def fail(stations, job):
+            raise MemoryError()
+
+        run_job = daemon.run_job
+        # The workers fork with the failing `run_job`
+        daemon.run_job = fail
+        try:
+            service = daemon.SimulationService(self.stations, processes=1)
+        finally:
+            daemon.run_job = run_job
+        output_stream = StringIO()
+        try:
+            daemon.serve_stream(service, StringIO(
+                '{"id": 1, "pairs_count": 2}\n'), output_stream)
+        finally:
+            service.close()
+
+        self.assertEquals(
+            [json.loads(line) for line in output_stream.getvalue()
+             .splitlines()],
+            [{'id': 1, 'error': 'Job failed: MemoryError()'}])
+
+    def test_streams_get_one_response_per_job(self):
+        service = daemon.SimulationService(self.stations, processes=0)
+        output_stream = StringIO()
+        daemon.serve_stream(service, StringIO(
+            '{"id": 1, "pairs_count": 2, "seed": 1}\n\nnot json\n'),
+            output_stream)
+
+        responses = [
+            json.loads(line)
+            for line in output_stream.getvalue().splitlines()
+        ]
+        self.assertEquals(len(responses), 2)
+        self.assertEquals(responses[0]['id'], 1)
+        self.assertIn('result', responses[0])
+        self.assertIn('error', responses[1])
+
+    def test_clients_get_the_responses_in_the_order_of_their_jobs(self):
+        directory = tempfile.mkdtemp()
+        socket_path = os.path.join(directory, 'socket')
+        service = daemon.SimulationService(self.stations, processes=2)
+        server = daemon.JobsServer(socket_path, service)
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.start()
+        try:
+            client = daemon.SimulationClient(socket_path)
+            responses = client.run_many([
+                {'pairs_count': 3, 'seed': seed, 'iteration_count': 50}
+                for seed in xrange(20)
+            ])
+            single_response = client.run(pairs_count=3, seed=4,
+                                         iteration_count=50)
+            client.close()
+        finally:
+            server.shutdown()
+            server_thread.join()
+            server.server_close()
+            service.close()
+            shutil.rmtree(directory)
+
+        self.assertEquals([response['id'] for response in responses],
+                          range(20))
+        self.assertEquals(single_response['result'], responses[4]['result'])
+        self.assertEquals(
+            responses[9]['result'],
+            batch.run_game(self.stations, 3, 9,
+                           iteration_count=50).get_result())
+
+    def test_clients_going_away_dont_stop_the_others_being_answered(self):
+        directory = tempfile.mkdtemp()
+        socket_path = os.path.join(directory, 'socket')
+        service = daemon.SimulationService(self.stations, processes=2)
+        server = daemon.JobsServer(socket_path, service)
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.start()
+        try:
+            leaving_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            leaving_socket.connect(socket_path)
+            leaving_socket.sendall(''.join(
+                '{"id": %s, "pairs_count": 3, "seed": %s}\n' % (seed, seed)
+                for seed in xrange(20)))
+            leaving_socket.close()
+            client = daemon.SimulationClient(socket_path)
+            first_response = client.run(pairs_count=3, seed=4,
+                                        iteration_count=50)
+            second_response = client.run(pairs_count=3, seed=5,
+                                         iteration_count=50)
+            client.close()
+        finally:
+            server.shutdown()
+            server_thread.join()
+            server.server_close()
+            service.close()
+            shutil.rmtree(directory)
+
+        self.assertIn('result', first_response)
+        self.assertIn('result', second_response)
+
+
+class FoundStepsEventSink(events.EventSink):
+    def __init__(self):
+        self.found_steps = {}
+
+    def pair_found(self, step, pair_id, station_id, station_name):
+        self.found_steps[pair_id] = step
+
+
+class TestShardedGame(TestCase):
+    PAIRS_COUNT = 60
+
+    def setUp(self):
+        self.stations = main.Stations.from_graph(
+            benchmark.create_scale_free_graph(200, Random(0)))
+
+    def test_move_draws_only_depend_on_their_arguments(self):
+        draw = sharded.get_move_draw(1, 2, 3)
+
+        self.assertEquals(sharded.get_move_draw(1, 2, 3), draw)
+        self.assertNotEquals(sharded.get_move_draw(1, 2, 4), draw)
+        self.assertNotEquals(sharded.get_move_draw(1, 3, 3), draw)
+        self.assertTrue(0 <= draw < 1)
+
+    def test_partitions_cover_every_region(self):
+        for partitioner in sharded.PARTITIONERS.itervalues():
+            regions_ids = partitioner(self.stations.graph, 3)
+            self.assertEquals(len(regions_ids),
+                              self.stations.graph.stations_count)
+            self.assertEquals(set(regions_ids), {0, 1, 2})
+
+    def test_sharded_games_are_the_same_as_the_single_process_game(self):
+        found_steps = FoundStepsEventSink()
+        game = sharded.HashedMovesFindTheCatGame(self.stations, seed=2,
+                                                 events=found_steps)
+        game.start(self.PAIRS_COUNT)
+        game.run(iteration_count=100)
+        roaming_pairs_ids = game.roaming_pairs_ids
+
+        for regions_count, partition, use_processes in (
+                (1, 'index_range', False), (3, 'index_range', False),
+                (4, 'breadth_first', False), (2, 'breadth_first', True)):
+            sharded_game = sharded.ShardedFindTheCatGame(
+                self.stations, regions_count, seed=2, partition=partition,
+                use_processes=use_processes)
+            try:
+                sharded_game.start(self.PAIRS_COUNT)
+                sharded_game.run(iteration_count=100)
+                cats_indexes, owners_indexes = \
+                    sharded_game.get_agents_indexes()
+            finally:
+                sharded_game.stop()
+
+            self.assertEquals(sharded_game.found_steps,
+                              found_steps.found_steps)
+            self.assertEquals(sharded_game.steps_count, game.steps_count)
+            self.assertEquals(cats_indexes, {
+                pair_id: game.cats_indexes[pair_id]
+                for pair_id in roaming_pairs_ids
+            })
+            self.assertEquals(owners_indexes, {
+                pair_id: game.owners_indexes[pair_id]
+                for pair_id in roaming_pairs_ids
+            })
+
+    def test_frozen_pairs_are_retired(self):
+        stations = StationsFactory\
+            .create_stations_with_json_stations_and_connections()
+        game = sharded.ShardedFindTheCatGame(stations, 2,
+                                             use_processes=False)
+        game.start(GameFactory.PAIRS_COUNT,
+                   stations_pairs_ids=GameFactory.STATIONS_PAIRS_IDS)
+        game.run(iteration_count=10)
+
+        self.assertEquals(game.get_result(), {
+            'cats_count': GameFactory.PAIRS_COUNT,
+            'cats_found': len(GameFactory.MATCHED_PAIRS_ON_START),
+            'cats_unreachable':
+                GameFactory.PAIRS_COUNT
+                - len(GameFactory.MATCHED_PAIRS_ON_START),
+            'cats_roaming': 0,
+            'steps_count': 2,
+        })
+        self.assertEquals(game.get_roaming_positions(), {})
+
+
+class TestVerification(TestCase):
+    PAIRS_COUNT = 20
+
+    def setUp(self):
+        self.stations = main.Stations.from_graph(
+            benchmark.create_scale_free_graph(100, Random(0)))
+
+    def test_sharded_traces_are_the_same(self):
+        comparison = verification.run_trace_comparison(
+            self.stations, 'sharded', 1, pairs_count=self.PAIRS_COUNT)
+
+        self.assertIsNone(comparison['diverged_at'])
+        self.assertEquals(comparison['reference_trace'],
+                          comparison['candidate_trace'])
+        self.assertEquals(len(comparison['reference_trace']),
+                          comparison['steps_count'] + 1)
+        found_pairs_ids = [
+            pair_id
+            for trace_step in comparison['reference_trace']
+            for pair_id in trace_step.found_pairs_ids
+        ]
+        self.assertTrue(found_pairs_ids)
+        self.assertEquals(len(set(found_pairs_ids)), len(found_pairs_ids))
+
+    @skipIf(numpy_game is None, "NumPy is not installed")
+    def test_numpy_traces_are_the_same(self):
+        comparison = verification.run_trace_comparison(
+            self.stations, 'numpy', 1, pairs_count=self.PAIRS_COUNT)
+
+        self.assertIsNone(comparison['diverged_at'])
+        self.assertTrue(comparison['steps_count'] > 0)
+
+    def test_first_divergence_is_found(self):
+        def create_other_game(stations, seed, event_sink):
+            return verification.create_hashed_moves_game(stations, seed + 1,
+                                                         event_sink)
+
+        verification.TRACE_ENGINES['other_seed'] = (
+            verification.create_hashed_moves_game, create_other_game)
+        try:
+            comparison = verification.run_trace_comparison(
+                self.stations, 'other_seed', 1,
+                stations_pairs_ids=[
+                    (self.stations.graph.id_of(index),
+                     self.stations.graph.id_of(index + 50))
+                    for index in xrange(self.PAIRS_COUNT)
+                ])
+        finally:
+            del verification.TRACE_ENGINES['other_seed']
+
+        self.assertEquals(comparison['diverged_at'], 1)
+        self.assertEquals(len(comparison['reference_trace']), 2)
+        self.assertEquals(comparison['reference_trace'][0],
+                          comparison['candidate_trace'][0])
+        self.assertTrue(comparison['differences']['misplaced_pairs_count'])
+
+    def test_ks_statistic(self):
+        self.assertEquals(
+            verification.get_ks_statistic([1, 2, 3, 4], [4, 3, 2, 1]), 0)
+        self.assertEquals(
+            verification.get_ks_statistic([1, 2, 3, 4], [3, 4, 5, 6]), 0.5)
+        self.assertEquals(
+            verification.get_ks_statistic([1, 2], [3, 4]), 1)
+
+    def test_comparing_distributions(self):
+        rng = Random(0)
+        reference_results = [
+            {'cats_found': rng.randrange(10), 'steps_count': 100}
+            for _ in xrange(500)
+        ]
+        similar_results = [
+            {'cats_found': rng.randrange(10), 'steps_count': 100}
+            for _ in xrange(500)
+        ]
+        shifted_results = [
+            {'cats_found': rng.randrange(10) + 3, 'steps_count': 100}
+            for _ in xrange(500)
+        ]
+
+        self.assertEquals([
+            comparison['passed']
+            for comparison in verification.compare_distributions(
+                reference_results, similar_results)
+        ], [True, True])
+        self.assertEquals([
+            comparison['passed']
+            for comparison in verification.compare_distributions(
+                reference_results, shifted_results)
+        ], [False, True])
+
+    def test_statistical_verification_of_sharded_games(self):
+        comparisons = verification.run_distributions_comparison(
+            self.stations, 'sharded', 10, range(100), iteration_count=300)
+
+        self.assertTrue(all(
+            comparison['passed']
+            for comparison in comparisons
+        ))
+
+
+class TestSharedGraph(TestCase):
+    def setUp(self):
+        self.stations = StationsFactory\
+            .create_stations_with_json_stations_and_connections()
+        self.directory = tempfile.mkdtemp()
+        self.filename = shared_graph.export_graph(
+            self.stations.graph,
+            filename=os.path.join(self.directory, 'graph'))
+        self.shared_stations = shared_graph.attach_stations(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shared_graph_is_the_same_as_the_graph(self):
+        graph = self.stations.graph
+        shared = self.shared_stations.graph
+
+        self.assertEquals(list(shared.ids), list(graph.ids))
+        self.assertEquals(list(shared.offsets), list(graph.offsets))
+        self.assertEquals(shared.neighbours_indexes[1:3],
+                          graph.neighbours_indexes[1:3])
+        self.assertEquals(shared.ids[-1], graph.ids[-1])
+        self.assertEquals(list(shared.names), list(graph.names))
+        self.assertEquals(shared.get_content_hash(), graph.get_content_hash())
+        for index in xrange(graph.stations_count):
+            self.assertEquals(shared.get_neighbours_indexes(index),
+                              graph.get_neighbours_indexes(index))
+            self.assertEquals(shared.index_of(graph.id_of(index)), index)
+        self.assertRaises(KeyError, shared.index_of, 123456)
+
+    def test_shared_stations_are_like_the_stations(self):
+        station = self.shared_stations.by_id(StationsFactory.STATION_1_ID)
+
+        self.assertIs(station,
+                      self.shared_stations.by_id(StationsFactory.STATION_1_ID))
+        self.assertEquals(station.name, StationsFactory.STATION_1_NAME)
+        self.assertEquals(
+            {
+                connected_station._id
+                for connected_station in station.connections
+            },
+            {
+                connected_station._id
+                for connected_station in self.stations.by_id(
+                    StationsFactory.STATION_1_ID).connections
+            })
+        self.assertEquals(self.shared_stations.stations_count,
+                          self.stations.stations_count)
+
+    def test_shared_stations_pickle_as_their_file(self):
+        pickled = dumps(self.shared_stations, 2)
+
+        self.assertLess(len(pickled), 200)
+        self.assertEquals(loads(pickled).graph.filename, self.filename)
+
+    def test_snapshots_attach_with_the_content_hash_of_their_graph(self):
+        filename = os.path.join(self.directory, 'snapshot')
+        self.stations.graph.save_snapshot(filename, 'a' * 20)
+
+        self.assertEquals(
+            shared_graph.attach_graph(filename).get_content_hash(),
+            self.stations.graph.get_content_hash())
+        with self.assertRaises(main.SnapshotError):
+            shared_graph.attach_graph(filename, content_hash='b' * 40)
+
+    def test_snapshots_without_a_content_hash_are_rejected(self):
+        # The content hash is the last field before the three counts
+        position = main.StationsGraph.SNAPSHOT_HEADER.size - 3 * 8 - 20
+        with open(self.filename, 'r+b') as f:
+            f.seek(position)
+            # Fixtures sanity check
+            self.assertEquals(f.read(20).encode('hex'),
+                              self.stations.graph.get_content_hash())
+            f.seek(position)
+            f.write(main.StationsGraph.MISSING_HASH)
+
+        with self.assertRaises(main.SnapshotError):
+            shared_graph.attach_graph(self.filename)
+
+    def test_exporting_the_same_graph_again_reuses_the_file(self):
+        os.utime(self.filename, (0, 0))
+        shared_graph.export_graph(self.stations.graph, filename=self.filename)
+
+        self.assertEquals(os.stat(self.filename).st_mtime, 0)
+
+    def test_games_are_the_same_on_shared_stations(self):
+        for seed in xrange(3):
+            self.assertEquals(
+                batch.run_game(self.shared_stations, 3, seed,
+                               iteration_count=50).get_result(),
+                batch.run_game(self.stations, 3, seed,
+                               iteration_count=50).get_result())
+
+        results = batch.BatchRunner(self.shared_stations, processes=2).run(
+            games_count=4, pairs_count=3, base_seed=1, iteration_count=50)
+        self.assertEquals(
+            results.games_results,
+            batch.BatchRunner(self.stations, processes=2).run(
+                games_count=4, pairs_count=3, base_seed=1,
+                iteration_count=50).games_results)
+
+
+class TestBatchRunner(TestCase):
+    def setUp(self):
+        self.stations = StationsFactory\
+            .create_stations_with_json_stations_and_connections()
+
+    def test_derived_seeds_are_stable_and_distinct(self):
+        self.assertEquals(batch.derive_seed(1, 5), batch.derive_seed(1, 5))
+        self.assertNotEquals(batch.derive_seed(1, 5), batch.derive_seed(1, 6))
+        self.assertNotEquals(batch.derive_seed(1, 5), batch.derive_seed(2, 5))
+
+    def test_results_dont_depend_on_the_number_of_workers(self):
+        results_per_processes = [
+            batch.BatchRunner(self.stations, processes=processes).run(
+                games_count=8, pairs_count=3, base_seed=7,
+                iteration_count=50).games_results
+            for processes in (1, 2)
+        ]
+
+        self.assertEquals(results_per_processes[0], results_per_processes[1])
+        self.assertEquals([
+            game_result.game_index
+            for game_result in results_per_processes[0]
+        ], range(8))
+
+    def test_a_single_game_can_be_reproduced_from_its_seed(self):
+        results = batch.BatchRunner(self.stations, processes=2).run(
+            games_count=4, pairs_count=3, base_seed=7, iteration_count=50)
+        a_game_result = results.games_results[2]
+
+        game = batch.run_game(self.stations, 3, a_game_result.seed,
+                              iteration_count=50)
+        self.assertEquals(game.cats_found, a_game_result.cats_found)
+        self.assertEquals(game.steps_count, a_game_result.steps_count)
+
+    def test_aggregated_results(self):
+        results = batch.BatchResults([
+            batch.GameResult(1, 0, 3, 2, 1, 10),
+            batch.GameResult(0, 0, 3, 1, 0, 20),
+        ])
+
+        self.assertEquals(results.games_count, 2)
+        self.assertEquals(results.cats_count, 6)
+        self.assertEquals(results.cats_found, 3)
+        self.assertEquals(results.cats_unreachable, 1)
+        self.assertEquals(results.mean_cats_found, 1.5)
+        self.assertEquals(results.get_cats_found_histogram(), {1: 1, 2: 1})
+
+
+class TestBenchmark(TestCase):
+    def assertUndirected(self, graph):
+        for index in xrange(graph.stations_count):
+            for neighbour_index in graph.get_neighbours_indexes(index):
+                self.assertNotEquals(neighbour_index, index)
+                self.assertIn(index,
+                              graph.get_neighbours_indexes(neighbour_index))
+
+    def test_generated_networks(self):
+        for network, generate in sorted(
+                benchmark.NETWORKS_GENERATORS.iteritems()):
+            graph = generate(900, Random(1))
+
+            self.assertTrue(300 <= graph.stations_count <= 900, network)
+            self.assertUndirected(graph)
+            self.assertEquals(
+                list(graph.neighbours_indexes),
+                list(generate(900, Random(1)).neighbours_indexes))
+
+    def test_tiled_network_connects_the_tiles(self):
+        graph = benchmark.create_tiled_tfl_graph(
+            1000, Random(1), tfl_graph=StationsFactory
+            .create_stations_with_json_stations_and_connections().graph)
+
+        self.assertEquals(graph.stations_count, 1000)
+        self.assertEquals(len(graph.neighbours_indexes),
+                          2 * (250 * 2 + 249))
+
+    def test_running_a_case(self):
+        case_result = benchmark.run_case(('grid', 100, 5, 3, 20))
+
+        self.assertEquals(case_result['stations_count'], 100)
+        self.assertEquals(case_result['connections_count'], 180)
+        self.assertTrue(0 < case_result['steps_count'] <= 20)
+        self.assertTrue(case_result['reachability_setup_seconds'] > 0)
+        self.assertEquals(benchmark.run_case(('grid', 100, 5, 3, 20))[
+            'moves_count'], case_result['moves_count'])
+
+    def test_running_a_lockstep_case(self):
+        case_result = benchmark.run_lockstep_case(('grid', 100, 30, 3, 20))
+
+        self.assertEquals(case_result['games_count'], 30)
+        self.assertTrue(case_result['games_per_second'] > 0)
+        self.assertTrue(case_result['reference_games_per_second'] > 0)
+        # Less than a byte per station for each owner
+        self.assertTrue(0 < case_result['owners_visited_bytes']
+                        < 30 * benchmark.LOCKSTEP_PAIRS_COUNT * 100)
+
+    def test_comparing_with_a_baseline(self):
+        baseline = {'cases': [{
+            'network': 'grid', 'size': 100, 'pairs_count': 5,
+            'steps_per_second': 100., 'moves_per_second': 1000.,
+            'run_seconds': 1., 'startup_seconds': 0.01, 'peak_rss_kb': 1000,
+        }]}
+        results = {'cases': [dict(
+            baseline['cases'][0], steps_per_second=50., startup_seconds=0.02,
+            peak_rss_kb=1100)]}
+
+        self.assertEquals(
+            [
+                regression['measure']
+                for regression in benchmark.compare_with_baseline(
+                    results, baseline)
+            ],
+            ['steps_per_second'])
+
+
+class TestProfiling(TestCase):
+    def setUp(self):
+        self.game, self.pairs_count = GameFactory.create_and_start_game()
+        self.profiler = profiling.GameProfiler(sample_memory=True,
+                                               memory_sample_interval=1)
+        self.profiler.attach(self.game)
+
+    def test_phases_are_timed_for_every_step(self):
+        self.game.run(iteration_count=10)
+
+        report = self.profiler.get_report()
+        self.assertEquals(report['steps_count'], self.game.steps_count)
+        self.assertEquals(len(report['steps']), self.game.steps_count)
+        self.assertEquals(len(report['memory']), self.game.steps_count)
+        for phase in ('find_and_close_stations', 'move_cats', 'move_owners'):
+            self.assertEquals(report['phases'][phase]['calls'],
+                              self.game.steps_count)
+            self.assertIn(phase, report['steps'][0]['phases'])
+
+    def test_counters(self):
+        self.game.step()
+
+        counters = self.profiler.get_report()['counters']
+        self.assertEquals(counters['pairs_found'],
+                          len(GameFactory.MATCHED_PAIRS_ON_START))
+        self.assertEquals(counters['stations_closed'],
+                          len(GameFactory.STATIONS_WITH_MATCHED_PAIRS))
+        self.assertEquals(counters['pairs_retired'],
+                          self.game.cats_unreachable)
+        self.assertEquals(
+            counters['cats_moved'] + counters['cats_stuck'],
+            len(GameFactory.UNMATCHED_PAIRS_ON_START))
+        self.assertEquals(
+            self.profiler.get_report()['steps'][0]['counters'], counters)
+
+    def test_report_is_json(self):
+        self.game.run(iteration_count=3)
+        stream = StringIO()
+        self.profiler.write_report(stream)
+
+        self.assertEquals(json.loads(stream.getvalue())['steps_count'],
+                          self.game.steps_count)
+
+    def test_detaching_restores_the_game(self):
+        self.profiler.detach()
+
+        self.assertNotIn('step', self.game.__dict__)
+        self.assertNotIn('move_cats', self.game.__dict__)
+        self.game.step()
+        self.assertEquals(self.profiler.get_report()['steps_count'], 0)
+
+
+@skipIf(random_streams is None, "NumPy is not installed")
+class TestRandomStreams(TestCase):
+    def test_streams_are_seeded(self):
+        first, second = (random_streams.RandomStream(3, block_size=10)
+                         for _ in xrange(2))
+        draws = [first.random() for _ in xrange(25)]
+
+        self.assertEquals(draws, [second.random() for _ in xrange(25)])
+        self.assertEquals(first.draws_used, 25)
+        self.assertTrue(all(0 <= draw < 1 for draw in draws))
+
+    def test_samples_are_the_next_draws(self):
+        first, second = (random_streams.RandomStream(3, block_size=10)
+                         for _ in xrange(2))
+        first.random()
+        second.random()
+
+        self.assertEquals(first.random_sample(15).tolist(),
+                          [second.random() for _ in xrange(15)])
+        self.assertEquals(first.draws_used, 16)
+
+    def test_samples_on_block_boundaries(self):
+        first, second = (random_streams.RandomStream(3, block_size=10)
+                         for _ in xrange(2))
+
+        self.assertEquals(first.random_sample(0).tolist(), [])
+        for size in (10, 4, 6, 20, 1):
+            self.assertEquals(first.random_sample(size).tolist(),
+                              [second.random() for _ in xrange(size)])
+            self.assertEquals(first.draws_used, second.draws_used)
+        self.assertEquals(first.random(), second.random())
+
+    def test_streams_go_on_from_a_saved_state(self):
+        for draws_count in (0, 7, 10, 23):
+            stream = random_streams.RandomStream(5, block_size=10)
+            for _ in xrange(draws_count):
+                stream.random()
+            state = stream.getstate()
+            draws = [stream.random() for _ in xrange(30)]
+
+            other_stream = random_streams.RandomStream(block_size=4)
+            other_stream.setstate(state)
+            self.assertEquals(other_stream.draws_used, draws_count)
+            self.assertEquals([other_stream.random() for _ in xrange(30)],
+                              draws)
+
+    def test_both_engines_play_the_same_game_from_the_same_stream(self):
+        stations = main.Stations.from_graph(
+            benchmark.create_scale_free_graph(200, Random(0)))
+        game = main.FindTheCatGame(
+            stations, rng=random_streams.RandomStream(1, block_size=100),
+            events=events.NullEventSink(), track_reachability=False)
+        game.start(50)
+        game.run(iteration_count=100)
+        vectorised_game = numpy_game.NumpyFindTheCatGame(
+            stations,
+            random_state=random_streams.RandomStream(1, block_size=64),
+            events=events.NullEventSink(), track_reachability=False)
+        vectorised_game.start(50)
+        vectorised_game.run(iteration_count=100)
+
+        self.assertEquals(list(game.cats_indexes),
+                          vectorised_game.cats_stations.tolist())
+        self.assertEquals(list(game.owners_indexes),
+                          vectorised_game.owners_stations.tolist())
+        self.assertEquals(game.cats_found, vectorised_game.cats_found)
+        self.assertEquals(game.rng.draws_used,
+                          vectorised_game.random_state.draws_used)
+
+    def test_both_engines_retire_the_same_unreachable_pairs(self):
+        stations = main.Stations.from_graph(
+            benchmark.create_tree_graph(200, Random(0)))
+        game = main.FindTheCatGame(
+            stations, rng=random_streams.RandomStream(1),
+            events=events.NullEventSink())
+        game.start(100)
+        game.run(iteration_count=100)
+        vectorised_game = numpy_game.NumpyFindTheCatGame(
+            stations, random_state=random_streams.RandomStream(1),
+            events=events.NullEventSink())
+        vectorised_game.start(100)
+        vectorised_game.run(iteration_count=100)
+
+        self.assertTrue(game.cats_unreachable > 0)
+        self.assertEquals(game.get_result(), vectorised_game.get_result())
+
+
+@skipIf(numpy_game is None, "NumPy is not installed")
+class TestNumpyGame(TestCase):
+    def setUp(self):
+        self.stations = StationsFactory\
+            .create_stations_with_json_stations_and_connections()
+        self.game = numpy_game.NumpyFindTheCatGame(
+            self.stations, numpy_game.numpy.random.RandomState(0),
+            events=events.NullEventSink())
+        self.game.start(GameFactory.PAIRS_COUNT,
+                        stations_pairs_ids=GameFactory.STATIONS_PAIRS_IDS)
+
+    def test_just_started_game_counts(self):
+        self.assertEquals(self.game.cats_count, GameFactory.PAIRS_COUNT)
+        self.assertEquals(self.game.cats_found, 0)
+        self.assertEquals(self.game.roaming_pairs_count,
+                          GameFactory.PAIRS_COUNT)
+
+    def test_matched_pairs_on_just_started_game(self):
+        self.assertEquals(set(self.game.get_all_matched_pairs()),
+                          GameFactory.MATCHED_PAIRS_ON_START)
+
+    def test_finding_matches_closes_their_stations(self):
+        self.game.find_and_close_stations()
+
+        self.assertEquals(self.game.cats_found,
+                          len(GameFactory.MATCHED_PAIRS_ON_START))
+        for _id in StationsFactory.STATIONS_IDS:
+            self.assertEquals(
+                self.game.stations_open[self.stations.graph.index_of(_id)],
+                _id in GameFactory.STATIONS_WITHOUT_MATCHED_PAIRS)
+
+    def test_agents_only_move_to_open_neighbours(self):
+        graph = self.stations.graph
+        self.game.find_and_close_stations()
+        # Fixures sanity check: only station 4 is still open
+        self.assertEquals(
+            list(self.game.stations_open),
+            [_id == StationsFactory.STATION_4_ID for _id in graph.ids])
+
+        self.game.move_cats()
+        self.game.move_owners()
+
+        a_pair_id = 0
+        self.assertEquals(self.game.cats_stations[a_pair_id],
+                          graph.index_of(StationsFactory.STATION_4_ID))
+        self.assertEquals(self.game.owners_stations[a_pair_id],
+                          graph.index_of(StationsFactory.STATION_2_ID))
+
+    def test_owners_prefer_not_visited_stations(self):
+        graph = self.stations.graph
+        a_pair_id = 5
+        pairs_ids = numpy_game.numpy.array([a_pair_id])
+        visited_index = graph.index_of(StationsFactory.STATION_2_ID)
+
+        for _ in xrange(10):
+            self.game.start(GameFactory.PAIRS_COUNT,
+                            stations_pairs_ids=GameFactory.STATIONS_PAIRS_IDS)
+            self.game.owners_stations[a_pair_id] = \
+                graph.index_of(StationsFactory.STATION_1_ID)
+            self.game.owners_visited.add(
+                pairs_ids, numpy_game.numpy.array([visited_index]))
+            self.game.move_owners()
+            self.assertEquals(self.game.owners_stations[a_pair_id],
+                              graph.index_of(StationsFactory.STATION_4_ID))
+
+    def test_visited_stations_on_both_sides_of_the_window(self):
+        visited_bitsets = numpy_game.VisitedBitsets(
+            numpy_game.numpy.array([40, 1]), 100)
+        pairs_ids = numpy_game.numpy.array([0, 1])
+        visited_bitsets.add(pairs_ids, numpy_game.numpy.array([3, 2]))
+        visited_bitsets.add(pairs_ids, numpy_game.numpy.array([97, 17]))
+
+        visited = visited_bitsets.contains(
+            pairs_ids[:, numpy_game.numpy.newaxis],
+            numpy_game.numpy.array([[40, 3, 97, 2], [1, 2, 17, 40]]))
+        self.assertEquals(visited.tolist(), [[True, True, True, False],
+                                             [True, True, True, False]])
+
+    def test_pairs_that_cant_meet_are_retired(self):
+        self.game.run(iteration_count=10)
+
+        self.assertEquals(self.game.steps_count, 1)
+        self.assertEquals(self.game.cats_found,
+                          len(GameFactory.MATCHED_PAIRS_ON_START))
+        self.assertEquals(
+            self.game.cats_unreachable,
+            GameFactory.PAIRS_COUNT - len(GameFactory.MATCHED_PAIRS_ON_START))
+
+    def test_frozen_pairs_are_retired_without_reachability_tracking(self):
+        game = numpy_game.NumpyFindTheCatGame(
+            self.stations, numpy_game.numpy.random.RandomState(0),
+            events=events.NullEventSink(), track_reachability=False)
+        game.start(GameFactory.PAIRS_COUNT,
+                   stations_pairs_ids=GameFactory.STATIONS_PAIRS_IDS)
+        game.run(iteration_count=10)
+
+        self.assertEquals(game.steps_count, 2)
+        self.assertEquals(
+            game.cats_unreachable,
+            GameFactory.PAIRS_COUNT - len(GameFactory.MATCHED_PAIRS_ON_START))
+
+    def test_neighbours_are_in_graph_order_by_station(self):
+        graph = self.stations.graph
+        stations_indexes = numpy_game.numpy.array([
+            graph.index_of(StationsFactory.STATION_1_ID),
+            graph.index_of(StationsFactory.STATION_3_ID),
+            graph.index_of(StationsFactory.STATION_2_ID),
+        ])
+        neighbours, rows = numpy_game.get_neighbours(
+            self.game.offsets, self.game.neighbours_indexes, stations_indexes)
+
+        self.assertEquals(
+            zip(rows.tolist(), neighbours.tolist()),
+            [(row, neighbour_index)
+             for row, index in enumerate(stations_indexes)
+             for neighbour_index in graph.get_neighbours_indexes(index)])
+
+    def test_random_pairs_start_on_different_stations(self):
+        self.game.start(1000)
+
+        self.assertEquals(self.game.cats_count, 1000)
+        self.assertFalse((self.game.cats_stations
+                          == self.game.owners_stations).any())
+
+
+
+@skipIf(numpy_game is None, "NumPy is not installed")
+class TestNumpyLockstepGames(TestCase):
+    GAMES_COUNT = 50
+
+    def setUp(self):
+        self.stations = StationsFactory\
+            .create_stations_with_json_stations_and_connections()
+        self.games = numpy_game.NumpyFindTheCatGames(
+            self.stations, numpy_game.numpy.random.RandomState(0))
+        self.games.start(self.GAMES_COUNT, GameFactory.PAIRS_COUNT)
+
+    def test_just_started_games(self):
+        self.assertEquals(list(self.games.get_roaming_pairs_counts()),
+                          [GameFactory.PAIRS_COUNT] * self.GAMES_COUNT)
+        self.assertFalse((self.games.cats_stations
+                          == self.games.owners_stations).any())
+
+    def test_closing_a_station_only_closes_it_in_its_game(self):
+        a_game_index = 3
+        an_agent = a_game_index * GameFactory.PAIRS_COUNT
+        station_index = self.stations.graph.index_of(
+            StationsFactory.STATION_1_ID)
+        self.games.cats_stations[an_agent] = station_index
+        self.games.owners_stations[an_agent] = station_index
+
+        self.games.find_and_close_stations()
+
+        self.assertFalse(self.games.stations_open[a_game_index,
+                                                  station_index])
+        self.assertEquals(
+            self.games.stations_open[:, station_index].sum(),
+            self.GAMES_COUNT - 1)
+        self.assertFalse(self.games.roaming[an_agent])
+
+    def test_pairs_that_cant_meet_are_retired(self):
+        # Station 3 isn't connected to anything, so the pairs with an agent
+        # on it can't meet once any station closes
+        graph = self.stations.graph
+        self.games.start(1, 2)
+        self.games.cats_stations[:] = [
+            graph.index_of(StationsFactory.STATION_2_ID),
+            graph.index_of(StationsFactory.STATION_3_ID),
+        ]
+        self.games.owners_stations[:] = [
+            graph.index_of(StationsFactory.STATION_2_ID),
+            graph.index_of(StationsFactory.STATION_1_ID),
+        ]
+
+        self.games.step()
+
+        self.assertEquals(self.games.get_result(0), {
+            'cats_count': 2,
+            'cats_found': 1,
+            'cats_unreachable': 1,
+            'cats_roaming': 0,
+            'steps_count': 1,
+        })
+
+    def test_all_games_run_to_the_end(self):
+        self.games.run(iteration_count=1000)
+
+        cats_found = self.games.get_cats_found()
+        cats_unreachable = self.games.get_cats_unreachable()
+        for game_index in xrange(self.GAMES_COUNT):
+            result = self.games.get_result(game_index)
+            self.assertEquals(result['cats_found'], cats_found[game_index])
+            self.assertEquals(result['cats_found']
+                              + result['cats_unreachable']
+                              + result['cats_roaming'],
+                              GameFactory.PAIRS_COUNT)
+            self.assertEquals(result['cats_unreachable'],
+                              cats_unreachable[game_index])
+            self.assertTrue(0 < result['steps_count']
+                            <= self.games.steps_count)
+        self.assertEquals(self.games.steps_counts.max(),
+                          self.games.steps_count)
+
+
 if __name__ == '__main__':
     unittest_main()
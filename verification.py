@@ -0,0 +1,389 @@
+import math
+import hashlib
+from array import array
+from collections import namedtuple
+from random import Random
+
+from main import FindTheCatGame
+from events import EventSink, NullEventSink
+from sharded import ShardedFindTheCatGame, HashedMovesFindTheCatGame
+
+try:
+    import numpy
+    from numpy_game import NumpyFindTheCatGame, NumpyFindTheCatGames
+    from random_streams import RandomStream
+except ImportError:
+    numpy = None
+
+
+# What a game looks like after `steps_count` steps: a digest of where every
+# roaming cat and owner is, and the pairs found and stations closed in the
+# last step
+TraceStep = namedtuple('TraceStep', [
+    'steps_count', 'positions_digest', 'found_pairs_ids',
+    'closed_stations_ids',
+])
+
+
+class TraceEventSink(EventSink):
+    """
+    Collects the pairs found and the stations closed, until the game's trace
+    takes them.
+    """
+    def __init__(self):
+        self.found_pairs_ids = []
+        self.closed_stations_ids = []
+
+    def pair_found(self, step, pair_id, station_id, station_name):
+        self.found_pairs_ids.append(pair_id)
+
+    def station_closed(self, step, station_id, station_name):
+        self.closed_stations_ids.append(station_id)
+
+    def take_changes(self):
+        changes = (tuple(sorted(self.found_pairs_ids)),
+                   tuple(sorted(self.closed_stations_ids)))
+        self.found_pairs_ids = []
+        self.closed_stations_ids = []
+
+        return changes
+
+
+def get_positions_digest(positions):
+    values = array('l')
+    for pair_id in sorted(positions):
+        cat_index, owner_index = positions[pair_id]
+        values.extend((pair_id, cat_index, owner_index))
+
+    return hashlib.sha1(values.tostring()).hexdigest()
+
+
+def create_trace_step(game, events, positions):
+    found_pairs_ids, closed_stations_ids = events.take_changes()
+    return TraceStep(game.steps_count, get_positions_digest(positions),
+                     found_pairs_ids, closed_stations_ids)
+
+
+def get_differences(reference_step, candidate_step, reference_positions,
+                    candidate_positions, max_pairs_count=10):
+    """
+    What differs between two steps of traces, with the positions of the first
+    few pairs that aren't in the same place in both games.
+    """
+    differences = {}
+    for field in ('found_pairs_ids', 'closed_stations_ids'):
+        if getattr(reference_step, field) != getattr(candidate_step, field):
+            differences[field] = (getattr(reference_step, field),
+                                  getattr(candidate_step, field))
+    misplaced_pairs_ids = sorted(
+        pair_id
+        for pair_id in set(reference_positions) | set(candidate_positions)
+        if reference_positions.get(pair_id)
+        != candidate_positions.get(pair_id)
+    )
+    if misplaced_pairs_ids:
+        differences['positions'] = {
+            pair_id: (reference_positions.get(pair_id),
+                      candidate_positions.get(pair_id))
+            for pair_id in misplaced_pairs_ids[:max_pairs_count]
+        }
+        differences['misplaced_pairs_count'] = len(misplaced_pairs_ids)
+
+    return differences
+
+
+def create_hashed_moves_game(stations, seed, events):
+    return HashedMovesFindTheCatGame(stations, seed=seed, events=events)
+
+
+def create_local_sharded_game(stations, seed, events, regions_count=3):
+    return ShardedFindTheCatGame(stations, regions_count, seed=seed,
+                                 use_processes=False, events=events)
+
+
+# For each engine, how to create the reference game and the candidate game
+# that must play exactly the same game given the same seed. Sharded games
+# draw their moves from hashes, so they're compared with the single process
+# game that draws them the same way, on top of being compared statistically
+# with `FindTheCatGame`
+TRACE_ENGINES = {
+    'sharded': (create_hashed_moves_game, create_local_sharded_game),
+}
+
+if numpy is not None:
+    def create_streamed_game(stations, seed, events):
+        return FindTheCatGame(stations, rng=RandomStream(seed), events=events,
+                              track_reachability=False)
+
+    def create_streamed_numpy_game(stations, seed, events):
+        return NumpyFindTheCatGame(stations, random_state=RandomStream(seed),
+                                   events=events, track_reachability=False)
+
+    def create_streamed_reachability_game(stations, seed, events):
+        return FindTheCatGame(stations, rng=RandomStream(seed), events=events)
+
+    def create_streamed_numpy_reachability_game(stations, seed, events):
+        return NumpyFindTheCatGame(stations, random_state=RandomStream(seed),
+                                   events=events)
+
+    TRACE_ENGINES['numpy'] = (create_streamed_game,
+                              create_streamed_numpy_game)
+    TRACE_ENGINES['numpy_reachability'] = (
+        create_streamed_reachability_game,
+        create_streamed_numpy_reachability_game)
+
+
+def run_trace_comparison(stations, engine, seed, pairs_count=None,
+                         stations_pairs_ids=None, iteration_count=1000):
+    """
+    Plays the reference game and the candidate game of the engine side by
+    side, from the same seed and the same pairs, and compares their traces
+    after every step. It stops at the first step where they diverge, which
+    is `diverged_at` in the result, with what differs then.
+    """
+    create_reference_game, create_candidate_game = TRACE_ENGINES[engine]
+    reference_events = TraceEventSink()
+    candidate_events = TraceEventSink()
+    reference_game = create_reference_game(stations, seed, reference_events)
+    candidate_game = create_candidate_game(stations, seed, candidate_events)
+
+    reference_trace = []
+    candidate_trace = []
+    differences = None
+    try:
+        reference_game.start(pairs_count, stations_pairs_ids)
+        candidate_game.start(pairs_count, stations_pairs_ids)
+        for _ in xrange(iteration_count + 1):
+            reference_positions = reference_game.get_roaming_positions()
+            candidate_positions = candidate_game.get_roaming_positions()
+            reference_trace.append(create_trace_step(
+                reference_game, reference_events, reference_positions))
+            candidate_trace.append(create_trace_step(
+                candidate_game, candidate_events, candidate_positions))
+            if reference_trace[-1] != candidate_trace[-1]:
+                differences = get_differences(
+                    reference_trace[-1], candidate_trace[-1],
+                    reference_positions, candidate_positions)
+                break
+            if not reference_game.roaming_pairs_exist:
+                break
+
+            reference_game.step()
+            candidate_game.step()
+    finally:
+        if isinstance(candidate_game, ShardedFindTheCatGame):
+            candidate_game.stop()
+
+    return {
+        'engine': engine,
+        'seed': seed,
+        'steps_count': reference_trace[-1].steps_count,
+        'diverged_at': None if differences is None
+        else reference_trace[-1].steps_count,
+        'differences': differences,
+        'reference_trace': reference_trace,
+        'candidate_trace': candidate_trace,
+    }
+
+
+def run_reference_games(stations, pairs_count, seeds, iteration_count,
+                        track_reachability):
+    results = []
+    for seed in seeds:
+        game = FindTheCatGame(stations, rng=Random(seed),
+                              events=NullEventSink(),
+                              track_reachability=track_reachability)
+        game.start(pairs_count)
+        game.run(iteration_count=iteration_count)
+        results.append(game.get_result())
+
+    return results
+
+
+def run_sharded_games(stations, pairs_count, seeds, iteration_count):
+    """
+    With a process per region, like sharded games are actually played, so
+    that handing agents over between processes is checked too.
+    """
+    results = []
+    for seed in seeds:
+        game = ShardedFindTheCatGame.start_and_run(
+            stations, pairs_count, 3, seed=seed,
+            iteration_count=iteration_count, use_processes=True)
+        results.append(game.get_result())
+
+    return results
+
+
+# For each engine, whether its games retire unreachable pairs (which changes
+# when they end), and how to play a game for each seed
+STATISTICAL_ENGINES = {
+    'sharded': (False, run_sharded_games),
+}
+
+if numpy is not None:
+    def run_numpy_games(stations, pairs_count, seeds, iteration_count):
+        return [
+            NumpyFindTheCatGame.start_and_run(
+                stations, pairs_count, iteration_count=iteration_count,
+                random_state=numpy.random.RandomState(seed),
+                events=NullEventSink()).get_result()
+            for seed in seeds
+        ]
+
+    def run_numpy_lockstep_games(stations, pairs_count, seeds,
+                                 iteration_count, chunk_size=500):
+        """
+        One seed per chunk of games in lockstep, since they share a
+        `RandomState`.
+        """
+        results = []
+        for start in xrange(0, len(seeds), chunk_size):
+            games_count = len(seeds[start:start + chunk_size])
+            games = NumpyFindTheCatGames.start_and_run(
+                stations, games_count, pairs_count,
+                iteration_count=iteration_count,
+                random_state=numpy.random.RandomState(seeds[start]))
+            results.extend(
+                games.get_result(game_index)
+                for game_index in xrange(games_count)
+            )
+
+        return results
+
+    STATISTICAL_ENGINES['numpy'] = (True, run_numpy_games)
+    STATISTICAL_ENGINES['numpy_lockstep'] = (True, run_numpy_lockstep_games)
+
+
+def get_ks_statistic(first_values, second_values):
+    """
+    The two-sample Kolmogorov-Smirnov statistic: the largest distance between
+    the empirical distribution functions of the two samples.
+    """
+    first_values = sorted(first_values)
+    second_values = sorted(second_values)
+    first_count, second_count = len(first_values), len(second_values)
+    first_position = second_position = 0
+    statistic = 0.
+    while first_position < first_count and second_position < second_count:
+        value = min(first_values[first_position],
+                    second_values[second_position])
+        while first_position < first_count \
+                and first_values[first_position] == value:
+            first_position += 1
+        while second_position < second_count \
+                and second_values[second_position] == value:
+            second_position += 1
+        statistic = max(statistic, abs(
+            float(first_position) / first_count
+            - float(second_position) / second_count))
+
+    return statistic
+
+
+def get_ks_p_value(statistic, first_count, second_count, max_terms=100):
+    """
+    The asymptotic probability of a statistic at least this large if both
+    samples come from the same distribution, with the small samples
+    correction of Stephens (1970). It's conservative for discrete values.
+    """
+    effective_count = math.sqrt(
+        float(first_count * second_count) / (first_count + second_count))
+    scaled_statistic = (effective_count + 0.12 + 0.11 / effective_count) \
+        * statistic
+    total = 0.
+    sign = 1.
+    for term_index in xrange(1, max_terms + 1):
+        term = sign * 2 * math.exp(
+            -2 * term_index ** 2 * scaled_statistic ** 2)
+        total += term
+        if abs(term) <= 1e-10 * abs(total):
+            return min(1., max(0., total))
+        sign = -sign
+
+    # The series only fails to converge for tiny statistics
+    return 1.
+
+
+def compare_distributions(reference_results, candidate_results,
+                          measures=('cats_found', 'steps_count'),
+                          significance=0.001):
+    comparisons = []
+    for measure in measures:
+        reference_values = [result[measure] for result in reference_results]
+        candidate_values = [result[measure] for result in candidate_results]
+        statistic = get_ks_statistic(reference_values, candidate_values)
+        p_value = get_ks_p_value(statistic, len(reference_values),
+                                 len(candidate_values))
+        comparisons.append({
+            'measure': measure,
+            'statistic': statistic,
+            'p_value': p_value,
+            'reference_mean':
+            float(sum(reference_values)) / len(reference_values),
+            'candidate_mean':
+            float(sum(candidate_values)) / len(candidate_values),
+            'passed': p_value >= significance,
+        })
+
+    return comparisons
+
+
+def run_distributions_comparison(stations, engine, pairs_count, seeds,
+                                 iteration_count=1000, significance=0.001):
+    """
+    Plays a game per seed with the reference engine and with the candidate
+    engine, and compares the distributions of the cats found and of the
+    steps the games took, for engines that don't play exactly the same
+    games.
+    """
+    track_reachability, run_candidate_games = STATISTICAL_ENGINES[engine]
+    reference_results = run_reference_games(
+        stations, pairs_count, seeds, iteration_count, track_reachability)
+    candidate_results = run_candidate_games(
+        stations, pairs_count, seeds, iteration_count)
+
+    return compare_distributions(reference_results, candidate_results,
+                                 significance=significance)
+
+
+def run_verification(stations, quick=False, pairs_count=10,
+                     iteration_count=300):
+    """
+    Compares every engine with the reference one, game by game for the
+    engines that must play the same games, and statistically for all of
+    them. Returns the descriptions of what didn't match.
+
+    The statistical comparison only means something if most games end
+    before `iteration_count`: on bipartite networks, like grids, many pairs
+    never meet.
+    """
+    traces_seeds = range(3 if quick else 20)
+    statistical_seeds = range(300 if quick else 2000)
+    failures = []
+    for engine in sorted(TRACE_ENGINES):
+        for seed in traces_seeds:
+            comparison = run_trace_comparison(
+                stations, engine, seed, pairs_count=pairs_count,
+                iteration_count=iteration_count)
+            if comparison['diverged_at'] is not None:
+                failures.append(
+                    '%s diverged from the reference at step %s with seed '
+                    '%s: %r' % (engine, comparison['diverged_at'], seed,
+                                comparison['differences']))
+
+    for engine in sorted(STATISTICAL_ENGINES):
+        comparisons = run_distributions_comparison(
+            stations, engine, pairs_count, statistical_seeds,
+            iteration_count=iteration_count)
+        for comparison in comparisons:
+            if not comparison['passed']:
+                failures.append(
+                    '%s %s differs from the reference: mean %.2f instead of '
+                    '%.2f, KS statistic %.3f, p-value %.2g' % (
+                        engine, comparison['measure'],
+                        comparison['candidate_mean'],
+                        comparison['reference_mean'],
+                        comparison['statistic'], comparison['p_value']))
+
+    return failures